@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+"""Time reading and writing of synthetic ModelCIF systems.
+
+   Systems of the requested size are built with synthetic.py, then written
+   to and read back from memory in both mmCIF and BinaryCIF formats with
+   :func:`modelcif.dumper.write` and :func:`modelcif.reader.read`. Times
+   are the best of several runs; peak memory is measured in a separate
+   run (since tracing memory allocation slows Python down considerably).
+   The finalize and dump steps of the QA metric dumper are also timed
+   on their own, since for systems with a full pairwise (PAE) metric
+   these dominate the time taken to write the file.
+   Results are written in JSON format, and can be compared with a
+   previous run to catch performance regressions.
+"""
+
+import argparse
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOPDIR)
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+import ihm  # noqa: E402
+import ihm.format  # noqa: E402
+import modelcif  # noqa: E402
+import modelcif.dumper  # noqa: E402
+import modelcif.reader  # noqa: E402
+import synthetic  # noqa: E402
+
+FORMATS = ('mmCIF', 'BCIF')
+
+# Timed quantities, compared against the baseline by --compare
+TIME_KEYS = ('write_time', 'read_time', 'finalize_time', 'dump_time')
+
+# Configurations run by --suite
+SUITE = (
+    dict(residues=300, chains=1, models=1, pae=True),
+    dict(residues=1000, chains=2, models=1, pae=True),
+    dict(residues=1000, chains=4, models=5, pae=False),
+    dict(residues=500, chains=1, models=1, pae=True, compact=True),
+    dict(residues=300, chains=2, models=1, pae=False, template_atoms=True,
+         alignments=4),
+)
+
+# Parameters accepted by synthetic.make_system, with their defaults
+PARAMETERS = dict(residues=300, chains=1, models=1, pae=True,
+                  template_atoms=False, alignments=1, compact=False)
+
+
+def _new_file(fmt, data=None):
+    if fmt == 'BCIF':
+        return io.BytesIO() if data is None else io.BytesIO(data)
+    else:
+        return io.StringIO() if data is None else io.StringIO(data)
+
+
+def _write(system, fmt):
+    fh = _new_file(fmt)
+    modelcif.dumper.write(fh, [system], format=fmt)
+    return fh.getvalue()
+
+
+def _read(data, fmt):
+    return modelcif.reader.read(_new_file(fmt, data), format=fmt)
+
+
+def _qa_metric_dumper_times(system, repeat):
+    """Get the best times for the finalize and dump steps of the
+       QA metric dumper"""
+    def finalize():
+        d = modelcif.dumper._QAMetricDumper()
+        d._check = True
+        d.finalize(system)
+        return d
+
+    d = finalize()
+    return (_best_time(finalize, repeat),
+            _best_time(lambda: d.dump(system, ihm.format.CifWriter(
+                io.StringIO())), repeat))
+
+
+def _best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _peak_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(params, repeat=3, memory=True):
+    """Time reading and writing of a system built with the given
+       parameters. Return a list of results, one per file format,
+       plus one for the QA metric dumper alone."""
+    system = synthetic.make_system(**params)
+    results = []
+    for fmt in FORMATS:
+        data = _write(system, fmt)
+        r = {'parameters': params, 'benchmark': 'read_write', 'format': fmt,
+             'file_size': len(data) if fmt == 'BCIF'
+             else len(data.encode('utf-8')),
+             'write_time': _best_time(lambda: _write(system, fmt), repeat),
+             'read_time': _best_time(lambda: _read(data, fmt), repeat),
+             'write_peak_memory': None, 'read_peak_memory': None}
+        if memory:
+            r['write_peak_memory'] = _peak_memory(lambda: _write(system, fmt))
+            r['read_peak_memory'] = _peak_memory(lambda: _read(data, fmt))
+        results.append(r)
+    finalize_time, dump_time = _qa_metric_dumper_times(system, repeat)
+    results.append({'parameters': params, 'benchmark': 'qa_metric_dumper',
+                    'finalize_time': finalize_time, 'dump_time': dump_time})
+    return results
+
+
+def get_metadata():
+    return {'python_modelcif_version': modelcif.__version__,
+            'python_ihm_version': ihm.__version__,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds')}
+
+
+def _result_key(r):
+    return (json.dumps(r['parameters'], sort_keys=True),
+            r.get('benchmark', 'read_write'), r.get('format'))
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline, and return a list of descriptions
+       of any times that are more than `threshold` (a fraction) slower"""
+    base = dict((_result_key(r), r) for r in baseline)
+    regressions = []
+    for r in results:
+        b = base.get(_result_key(r))
+        if b is None:
+            continue
+        for key in TIME_KEYS:
+            if b.get(key) and r[key] > b[key] * (1. + threshold):
+                regressions.append(
+                    "%s %s %s: %.3fs (baseline %.3fs)"
+                    % (r.get('format', r.get('benchmark')), key,
+                       r['parameters'], r[key], b[key]))
+    return regressions
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Time reading and writing of synthetic ModelCIF "
+                    "systems in mmCIF and BinaryCIF formats.")
+    parser.add_argument("--residues", type=int,
+                        default=PARAMETERS['residues'],
+                        help="Total number of residues in each model")
+    parser.add_argument("--chains", type=int, default=PARAMETERS['chains'],
+                        help="Number of chains")
+    parser.add_argument("--models", type=int, default=PARAMETERS['models'],
+                        help="Number of models")
+    parser.add_argument("--no-pae", dest="pae", action="store_false",
+                        help="Don't include a full pairwise (PAE) QA metric")
+    parser.add_argument("--template-atoms", action="store_true",
+                        help="Use custom templates with coordinates")
+    parser.add_argument("--alignments", type=int,
+                        default=PARAMETERS['alignments'],
+                        help="Number of template-target alignments")
+    parser.add_argument("--compact", action="store_true",
+                        help="Store QA metrics in compact tables")
+    parser.add_argument("--suite", action="store_true",
+                        help="Run the built-in set of configurations "
+                             "rather than a single one")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of timed runs (the best is reported)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Don't measure peak memory usage")
+    parser.add_argument("-o", "--output",
+                        help="Write results in JSON format to this file "
+                             "(default: standard output)")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare timings against those in this "
+                             "JSON file, and exit with an error if any "
+                             "are significantly slower")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Fractional slowdown relative to the baseline "
+                             "that is considered a regression "
+                             "(default: 0.2)")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    if args.suite:
+        configs = [dict(PARAMETERS, **c) for c in SUITE]
+    else:
+        configs = [dict((k, getattr(args, k)) for k in PARAMETERS)]
+    results = []
+    for params in configs:
+        results.extend(run_benchmark(params, repeat=args.repeat,
+                                     memory=args.memory))
+    out = {'metadata': get_metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(out, fh, indent=2)
+    else:
+        json.dump(out, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print("Regression: " + r, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""Generate synthetic, but realistically-sized, ModelCIF systems.
+
+   These are used by the benchmark suite (see benchmark.py) to exercise the
+   hot paths in the reader and dumper: atom coordinates, per-residue and
+   pairwise (PAE) QA metrics, alignments and custom template coordinates.
+"""
+
+import math
+import random
+import modelcif
+import modelcif.model
+import modelcif.qa_metric
+import modelcif.alignment
+import modelcif.reference
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Heavy atoms written for each residue, as (name, element, offset) where
+# offset is a small displacement from the CA position
+_ATOMS = (('N', 'N', (-1.2, 0.4, -0.5)), ('CA', 'C', (0., 0., 0.)),
+          ('C', 'C', (1.3, 0.3, 0.4)), ('O', 'O', (1.8, 1.4, 0.6)),
+          ('CB', 'C', (-0.3, -1.5, 0.2)))
+
+
+class _Alignment(modelcif.alignment.Global, modelcif.alignment.Pairwise):
+    pass
+
+
+def _get_software():
+    return modelcif.Software(
+        name='SyntheticModeler', classification='model building',
+        description='Synthetic structure generator for benchmarks',
+        version='1.0', location='https://example.com/', type='program')
+
+
+def _make_metric_classes(software):
+    class PTM(modelcif.qa_metric.Global, modelcif.qa_metric.PTM):
+        """Predicted TM-score"""
+    PTM.software = software
+
+    class PLDDT(modelcif.qa_metric.Local, modelcif.qa_metric.PLDDT):
+        """Predicted lDDT"""
+    PLDDT.software = software
+
+    class PAE(modelcif.qa_metric.LocalPairwise, modelcif.qa_metric.PAE):
+        """Predicted aligned error"""
+    PAE.software = software
+    return PTM, PLDDT, PAE
+
+
+def _residue_atoms(seq_id, code, chain_index, model_index):
+    """Yield (atom_id, type_symbol, x, y, z) for a single residue,
+       placing residues along an idealized helix"""
+    angle = math.radians(100. * seq_id)
+    cx = 2.3 * math.cos(angle) + 30. * chain_index
+    cy = 2.3 * math.sin(angle)
+    cz = 1.5 * seq_id + 0.01 * model_index
+    for atom_id, type_symbol, (dx, dy, dz) in _ATOMS:
+        if atom_id == 'CB' and code == 'G':
+            continue
+        yield atom_id, type_symbol, cx + dx, cy + dy, cz + dz
+
+
+def make_system(residues=300, chains=1, models=1, pae=True,
+                template_atoms=False, alignments=1, compact=False, seed=42):
+    """Make a synthetic :class:`modelcif.System`.
+
+       :param int residues: Total number of residues in each model, split
+              evenly over all chains.
+       :param int chains: Number of chains (each a distinct entity).
+       :param int models: Number of models.
+       :param bool pae: If True, include a full residue-residue pairwise
+              (PAE) QA metric for each model.
+       :param bool template_atoms: If True, use custom templates (whose
+              coordinates are written to the file) rather than PDB
+              templates.
+       :param int alignments: Number of template-target alignments.
+       :param bool compact: If True, store per-residue and pairwise QA
+              metrics in compact tables rather than individual objects.
+       :param int seed: Seed for the random number generator.
+    """
+    rng = random.Random(seed)
+    s = modelcif.System(id='synthetic', title='Synthetic benchmark system')
+    software = _get_software()
+    s.software_groups.append(software)
+    PTM, PLDDT, PAE = _make_metric_classes(software)
+
+    chain_len = max(1, residues // chains)
+    asyms = []
+    for i in range(chains):
+        seq = ''.join(rng.choice(AMINO_ACIDS) for _ in range(chain_len))
+        e = modelcif.Entity(seq, description='Chain %d' % (i + 1))
+        s.entities.append(e)
+        asym = modelcif.AsymUnit(e, details='Subunit %d' % (i + 1))
+        s.asym_units.append(asym)
+        asyms.append(asym)
+    assembly = modelcif.Assembly(asyms, name='Modeled assembly')
+
+    for i in range(alignments):
+        asym = asyms[i % len(asyms)]
+        seq = ''.join(c.code for c in asym.entity.sequence)
+        template_e = modelcif.Entity(seq, description='Template %d' % i)
+        if template_atoms:
+            template = modelcif.CustomTemplate(
+                entity=template_e, asym_id='A', model_num=1,
+                name='Custom template %d' % i,
+                transformation=modelcif.Transformation.identity())
+            for seq_id, code in enumerate(seq, 1):
+                for atom_id, type_symbol, x, y, z in _residue_atoms(
+                        seq_id, code, 0, 0):
+                    template.atoms.append(modelcif.TemplateAtom(
+                        seq_id=seq_id, atom_id=atom_id,
+                        type_symbol=type_symbol, x=x, y=y, z=z))
+        else:
+            template = modelcif.Template(
+                entity=template_e, asym_id='A', model_num=1,
+                name='Template %d' % i,
+                transformation=modelcif.Transformation.identity(),
+                references=[modelcif.reference.PDB('%dabc' % (i % 10))])
+        p = modelcif.alignment.Pair(
+            template=template.segment(seq, 1, len(seq)),
+            target=asym.segment(seq, 1, len(seq)),
+            score=modelcif.alignment.BLASTEValue(1e-20),
+            identity=modelcif.alignment.ShorterSequenceIdentity(100.))
+        s.alignments.append(_Alignment(name='Alignment %d' % i, pairs=[p],
+                                       software=software))
+
+    all_residues = [asym.residue(seq_id) for asym in asyms
+                    for seq_id in range(1, len(asym.entity.sequence) + 1)]
+    group = modelcif.model.ModelGroup(name='All models')
+    for n in range(models):
+        m = modelcif.model.AbInitioModel(assembly, name='Model %d' % (n + 1))
+        for chain_index, asym in enumerate(asyms):
+            for seq_id, comp in enumerate(asym.entity.sequence, 1):
+                for atom_id, type_symbol, x, y, z in _residue_atoms(
+                        seq_id, comp.code, chain_index, n):
+                    m.add_atom(modelcif.model.Atom(
+                        asym_unit=asym, seq_id=seq_id, atom_id=atom_id,
+                        type_symbol=type_symbol, x=x, y=y, z=z,
+                        biso=rng.uniform(50., 100.), occupancy=1.0))
+        m.qa_metrics.append(PTM(rng.uniform(0.5, 1.0)))
+        if compact:
+            table = modelcif.qa_metric.LocalMetricTable(PLDDT)
+            for r in all_residues:
+                table.add(r.asym, r.seq_id, rng.uniform(50., 100.))
+            m.qa_metrics.append(table)
+        else:
+            m.qa_metrics.extend(PLDDT(r, rng.uniform(50., 100.))
+                                for r in all_residues)
+        if pae:
+            nres = len(all_residues)
+            if compact:
+                matrix = modelcif.qa_metric.PairwiseMatrix(PAE, all_residues)
+                for i in range(nres):
+                    for j in range(nres):
+                        matrix[i, j] = rng.uniform(0., 30.)
+                m.qa_metrics.append(matrix)
+            else:
+                m.qa_metrics.extend(PAE(r1, r2, rng.uniform(0., 30.))
+                                    for r1 in all_residues
+                                    for r2 in all_residues)
+        group.append(m)
+    s.model_groups.append(group)
+    return s
@@ -1,5 +1,6 @@
 # This example demonstrates using the library to convert an mmCIF file
 # containing ModelCIF data to BinaryCIF format.
+# To convert many files in parallel, see modelcif/util/convert.py instead.
 
 # Import used classes.
 import modelcif
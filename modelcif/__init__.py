@@ -80,6 +80,13 @@ class System:
         #: See :class:`modelcif.associated.Repository`.
         self.repositories = []
 
+        #: Any mmCIF categories read from a file that python-modelcif does
+        #: not understand (only if ``keep_unknown`` was passed to
+        #: :func:`modelcif.reader.read`). These are written out again,
+        #: unchanged, by :func:`modelcif.dumper.write`.
+        #: See :class:`UnknownCategory`.
+        self.unknown_categories = []
+
         self.entities = []
         self.asym_units = []
         self.templates = []
@@ -95,6 +102,35 @@ class System:
         # Mapping from ID to QA metric classes
         self._qa_by_id = {}
 
+    def load_associated(self, root, categories=None, lazy=True):
+        """Read data from associated files that are available locally.
+
+           Any associated mmCIF or BinaryCIF files listed in
+           :attr:`repositories` (including those inside
+           :class:`modelcif.associated.ZipFile` archives) are looked for
+           in `root`, and the data in them (typically QA metrics) are
+           added to this system. Files that cannot be found are ignored.
+
+           :param str root: Either a local directory or a zip file. Files
+                  are looked up by their path. For a directory, files inside
+                  a :class:`~modelcif.associated.ZipFile` can also be read
+                  directly from the archive (by its path) in the directory.
+           :param list categories: If given, only read these mmCIF categories
+                  (see ``include_categories`` in
+                  :func:`modelcif.reader.read`).
+           :param bool lazy: If True (the default), the files are not read
+                  until the QA metrics of any model in the system are first
+                  accessed (see :attr:`modelcif.model.Model.qa_metrics`), so
+                  large files that are not needed are never parsed.
+                  Otherwise, the files are read immediately.
+        """
+        import modelcif.associated
+        loader = modelcif.associated._AssociatedLoader(self, root, categories)
+        if lazy:
+            loader.defer()
+        else:
+            loader.load()
+
     def _all_models(self):
         """Iterate over all Models in the system"""
         # todo: raise an error if a model is present in multiple groups?
@@ -370,6 +406,23 @@ class Database:
         self.id, self.code = id, code
 
 
+class UnknownCategory:
+    """An mmCIF category that python-modelcif does not understand, kept as
+       raw data so that it can be written out again unchanged.
+       See :attr:`System.unknown_categories`.
+
+       :param str name: The name of the category (e.g. ``_my_vendor_data``).
+       :param list keywords: The names of the data items in the category.
+       :param list rows: The data, as a list of rows, each a sequence of
+              values in the same order as ``keywords``. Values are strings,
+              exactly as given in the file (without any quoting), or None
+              for omitted values ('.') or :attr:`ihm.unknown` for
+              unknown values ('?').
+    """
+    def __init__(self, name, keywords, rows):
+        self.name, self.keywords, self.rows = name, keywords, rows
+
+
 class SoftwareGroup(list):
     """A number of :class:`Software` and/or :class:`SoftwareWithParameters`
        objects that are grouped together.
@@ -3,8 +3,11 @@
    Typically, one or more :class:`Repository` objects are created and
    added to :attr:`modelcif.System.repositories`."""
 
+import contextlib
+import os
 import posixpath
 import warnings
+import zipfile
 
 
 class Repository:
@@ -69,8 +72,10 @@ class CIFFile(File):
               if written (by specifying ``categories`` or ``copy_categories``).
        :param str local_path: File name that will be used for ``categories``
               or ``copy_categories``. If not given, it defaults to the same
-              as ``path``. (The file is always written directly to the local
-              disk, even if this object is placed inside a :class:`ZipFile`.)
+              as ``path``. (If this object is placed inside a
+              :class:`ZipFile` that has its own ``local_path``, the file is
+              instead written into that archive, using ``path`` as the name
+              of the archive member, and this parameter is ignored.)
        :param bool binary: If False (the default), any output file is written
               in mmCIF format; if True, the file is written in BinaryCIF.
     """
@@ -114,11 +119,96 @@ class ZipFile(File):
        :param list files: A list of the :class:`File` objects contained
               within this archive. Note that an archive cannot contain another
               archive.
+       :param str local_path: If given, any :class:`CIFFile` objects in
+              this archive that have ``categories`` or ``copy_categories``
+              are written by :func:`modelcif.dumper.write` directly into a
+              zip archive with this file name, rather than to the local disk.
+              (Other files in the archive are not written.)
     """
     file_type = 'archive'
     file_content = 'archive with multiple files'
     file_format = 'zip'
 
-    def __init__(self, path, details=None, files=[], data=None):
+    def __init__(self, path, details=None, files=[], data=None,
+                 local_path=None):
         super().__init__(path, details, data)
         self.files = files
+        self.local_path = local_path
+
+
+class _AssociatedLoader:
+    """Read associated mmCIF or BinaryCIF files, stored in a local
+       directory or zip archive, into an existing System.
+       See :meth:`modelcif.System.load_associated`."""
+    def __init__(self, system, root, categories):
+        self.system, self.root, self.categories = system, root, categories
+        self.models = [model for group, model in system._all_models()]
+        self.files = list(self._find_files())
+
+    def _all_cif_files(self):
+        """Yield (file, archive) for all CIF files in the system"""
+        for r in self.system.repositories:
+            for f in r.files:
+                if isinstance(f, CIFFile):
+                    yield f, None
+                for af in getattr(f, 'files', []):
+                    if isinstance(af, CIFFile):
+                        yield af, f
+
+    def _find_files(self):
+        """Yield (file, locator) for each CIF file that can be found,
+           where locator is (zip archive name or None, path)"""
+        root = self.root
+        if os.path.isfile(root):
+            # The root is a zip archive containing the files
+            with zipfile.ZipFile(root) as zf:
+                names = frozenset(zf.namelist())
+            for f, archive in self._all_cif_files():
+                if f.path in names:
+                    yield f, (root, f.path)
+            return
+        for f, archive in self._all_cif_files():
+            path = os.path.join(root, f.path)
+            if os.path.exists(path):
+                # File in the directory (e.g. extracted from its archive)
+                yield f, (None, path)
+            elif archive is not None:
+                zpath = os.path.join(root, archive.path)
+                if zipfile.is_zipfile(zpath):
+                    with zipfile.ZipFile(zpath) as zf:
+                        if f.path in zf.namelist():
+                            yield f, (zpath, f.path)
+
+    @contextlib.contextmanager
+    def _open(self, locator):
+        zpath, path = locator
+        if zpath is None:
+            with open(path, 'rb') as fh:
+                yield fh
+        else:
+            with zipfile.ZipFile(zpath) as zf:
+                with zf.open(path) as fh:
+                    yield fh
+
+    def defer(self):
+        """Load the files when any model's QA metrics are first accessed"""
+        for m in self.models:
+            m._qa_loader = self.load
+
+    def load(self):
+        """Read all of the files into the System"""
+        import modelcif.reader
+        for m in self.models:
+            if m._qa_loader == self.load:
+                m._qa_loader = None
+        # Don't let the associated file's own ID replace that of the system
+        system_id = self.system.id
+        try:
+            for f, locator in self.files:
+                with self._open(locator) as fh:
+                    modelcif.reader.read(
+                        fh, format='BCIF' if f.binary else 'mmCIF',
+                        add_to_system=self.system,
+                        include_categories=self.categories)
+        finally:
+            self.system.id = system_id
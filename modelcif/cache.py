@@ -0,0 +1,133 @@
+"""Classes to cache the results of reading mmCIF or BinaryCIF files.
+
+   Reading a large file can take some time. If the same files are read
+   repeatedly, a :class:`ReadCache` can be used to store the resulting
+   :class:`modelcif.System` objects on disk so that subsequent reads are
+   much faster.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+import ihm
+import modelcif
+import modelcif.reader
+import modelcif.util
+
+
+class ReadCache:
+    """An on-disk cache of :class:`modelcif.System` objects read from files.
+
+       Each entry is keyed by the contents of the file, the versions of
+       python-modelcif and python-ihm, and the arguments passed to
+       :func:`modelcif.reader.read`, so entries for modified files (or
+       after a library upgrade) are never used. Entries are stored in
+       Python's pickle format, so the directory should not be writable by
+       untrusted users.
+
+       :param str directory: Directory in which to store the cache. It
+              will be created if it does not already exist.
+       :param int max_size: The maximum total size, in bytes, of cache
+              entries. When this is exceeded, the least recently used
+              entries are removed.
+    """
+
+    _suffix = '.pickle'
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._total_size = None
+
+    def _get_key(self, data, kwargs):
+        h = hashlib.sha256()
+        h.update(("%s %s %s" % (modelcif.__version__, ihm.__version__,
+                                sorted(kwargs.items()))).encode('utf-8'))
+        h.update(data)
+        return h.hexdigest()
+
+    def _get_entries(self):
+        """Get (mtime, size, path) for all cache entries"""
+        for fname in os.listdir(self.directory):
+            if fname.endswith(self._suffix):
+                path = os.path.join(self.directory, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _prune(self):
+        """Remove least recently used entries until under the size limit"""
+        entries = sorted(self._get_entries())
+        self._total_size = sum(e[1] for e in entries)
+        for mtime, size, path in entries:
+            if self._total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._total_size -= size
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as fh:
+                systems = pickle.load(fh)
+        except Exception:
+            # Treat a missing, truncated or otherwise unreadable entry
+            # as a cache miss
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return systems
+
+    def _store(self, path, systems):
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(systems, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.stat(tmpname).st_size
+            os.replace(tmpname, path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        if self._total_size is None:
+            self._prune()
+        else:
+            self._total_size += size
+            if self._total_size > self.max_size:
+                self._prune()
+
+    def read(self, path, format=None, **kwargs):
+        """Read the given file, using a cached copy if available.
+
+           :param str path: The name of the file to read.
+           :param str format: The format of the file ('mmCIF' or 'BCIF').
+                  If not specified, it is guessed from the file name
+                  (files ending in .bcif, optionally followed by a
+                  compression extension such as .gz, are assumed to be
+                  BinaryCIF).
+           :param kwargs: Any other arguments are passed to
+                  :func:`modelcif.reader.read`.
+           :return: A list of :class:`modelcif.System` objects.
+        """
+        if kwargs.get('add_to_system') is not None:
+            raise ValueError("add_to_system cannot be used with the cache")
+        if format is None:
+            format = modelcif.util._get_format(path)
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        key = self._get_key(data, dict(kwargs, format=format))
+        entry = os.path.join(self.directory, key + self._suffix)
+        systems = self._load(entry)
+        if systems is None:
+            systems = modelcif.reader._read_path(path, format, None,
+                                                 kwargs)[1]
+            self._store(entry, systems)
+        return systems
@@ -1,16 +1,28 @@
 """Utility classes to dump out information in mmCIF or BinaryCIF format"""
 
 from datetime import date
+import contextlib
+import io
 import itertools
+import logging
 import operator
+import os
+import shutil
+import tempfile
+import time
+import zipfile
 import ihm.dumper
 import ihm
 from ihm import util
 import ihm.format
 import ihm.format_bcif
+import ihm.model
 from ihm.dumper import Dumper, Variant, _prettyprint_seq, _get_transform
 import modelcif.qa_metric
+import modelcif.model
 import modelcif.data
+import modelcif.associated
+import modelcif.util
 
 
 class _AuditConformDumper(Dumper):
@@ -631,6 +643,32 @@ class _ProtocolDumper(Dumper):
                              if s.output_data else None)
 
 
+class _ArrayAtomModel:
+    """Wrap an ArrayModel so that its atoms are provided by a single
+       reused Atom object rather than creating one per atom"""
+    def __init__(self, model):
+        self._model = model
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def get_atoms(self):
+        return self._model._get_reused_atoms()
+
+
+class _ArrayModelSystem:
+    """Wrap a System so that any ArrayModels are dumped via
+       :class:`_ArrayAtomModel`"""
+    def __init__(self, system):
+        self._system = system
+
+    def _all_models(self):
+        for group, model in self._system._all_models():
+            if isinstance(model, modelcif.model.ArrayModel):
+                model = _ArrayAtomModel(model)
+            yield group, model
+
+
 class _ModelDumper(ihm.dumper._ModelDumperBase):
     def dump(self, system, writer):
         self.dump_model_list(system, writer)
@@ -638,6 +676,10 @@ class _ModelDumper(ihm.dumper._ModelDumperBase):
         seen_types = self.dump_atoms(system, writer, add_ihm=False)
         self.dump_atom_type(seen_types, system, writer)
 
+    def dump_atoms(self, system, writer, add_ihm=False):
+        return super().dump_atoms(_ArrayModelSystem(system), writer,
+                                  add_ihm=add_ihm)
+
     def dump_model_list(self, system, writer):
         with writer.loop("_ma_model_list",
                          ["ordinal_id", "model_name",
@@ -719,46 +761,57 @@ class _AssociatedDumper(Dumper):
 
 class _FeatureDumper(Dumper):
     def finalize(self, system):
-        seen_features = {}
+        self._seen_features = {}
         self._features_by_id = []
-        for f in system._all_features():
+        self._add_features(system._all_features())
+
+    def _add_features(self, features):
+        """Assign IDs to the given features, and return a list of those
+           that were not seen before"""
+        features = list(features)
+        for f in features:
             util._remove_id(f)
-        for f in system._all_features():
-            util._assign_id(f, seen_features, self._features_by_id,
+        start = len(self._features_by_id)
+        for f in features:
+            util._assign_id(f, self._seen_features, self._features_by_id,
                             seen_obj=f._signature())
+        return self._features_by_id[start:]
 
     def dump(self, system, writer):
-        self.dump_list(writer)
-        self.dump_atom(writer)
-        self.dump_residue(writer)
-        self.dump_instance(writer)
+        self._dump_features(self._features_by_id, writer)
 
-    def dump_list(self, writer):
+    def _dump_features(self, features, writer):
+        self.dump_list(features, writer)
+        self.dump_atom(features, writer)
+        self.dump_residue(features, writer)
+        self.dump_instance(features, writer)
+
+    def dump_list(self, features, writer):
         with writer.loop("_ma_feature_list",
                          ["feature_id", "feature_type", "entity_type",
                           "details"]) as lp:
-            for f in self._features_by_id:
+            for f in features:
                 lp.write(feature_id=f._id, feature_type=f.type,
                          entity_type=f._get_entity_type(check=self._check),
                          details=f.details)
 
-    def dump_atom(self, writer):
+    def dump_atom(self, features, writer):
         ordinal = itertools.count(1)
         with writer.loop("_ma_atom_feature",
                          ["ordinal_id", "feature_id", "atom_id"]) as lp:
-            for f in self._features_by_id:
+            for f in features:
                 if not isinstance(f, modelcif.AtomFeature):
                     continue
                 for a in f.atoms:
                     lp.write(ordinal_id=next(ordinal), feature_id=f._id,
                              atom_id=a)
 
-    def dump_residue(self, writer):
+    def dump_residue(self, features, writer):
         ordinal = itertools.count(1)
         with writer.loop("_ma_poly_residue_feature",
                          ["ordinal_id", "feature_id", "label_asym_id",
                           "label_seq_id", "label_comp_id"]) as lp:
-            for f in self._features_by_id:
+            for f in features:
                 if not isinstance(f, modelcif.PolyResidueFeature):
                     continue
                 for r in f.residues:
@@ -768,11 +821,11 @@ class _FeatureDumper(Dumper):
                              label_seq_id=r.seq_id,
                              label_comp_id=seq[r.seq_id - 1].id)
 
-    def dump_instance(self, writer):
+    def dump_instance(self, features, writer):
         ordinal = itertools.count(1)
         with writer.loop("_ma_entity_instance_feature",
                          ["ordinal_id", "feature_id", "label_asym_id"]) as lp:
-            for f in self._features_by_id:
+            for f in features:
                 if not isinstance(f, modelcif.EntityInstanceFeature):
                     continue
                 for a in f.asym_units:
@@ -781,20 +834,100 @@ class _FeatureDumper(Dumper):
 
 
 class _QAMetricDumper(Dumper):
+    # Each mode of QA metric is written to its own category; compact
+    # collections of metrics are written alongside the same mode
+    _mode_classes = (modelcif.qa_metric.Global, modelcif.qa_metric.Local,
+                     modelcif.qa_metric.LocalPairwise,
+                     modelcif.qa_metric.Feature,
+                     modelcif.qa_metric.FeaturePairwise,
+                     modelcif.qa_metric.Dihedral)
+    _mode_categories = {
+        modelcif.qa_metric.Global: '_ma_qa_metric_global',
+        modelcif.qa_metric.Local: '_ma_qa_metric_local',
+        modelcif.qa_metric.LocalPairwise: '_ma_qa_metric_local_pairwise',
+        modelcif.qa_metric.Feature: '_ma_qa_metric_feature',
+        modelcif.qa_metric.FeaturePairwise: '_ma_qa_metric_feature_pairwise',
+        modelcif.qa_metric.Dihedral: '_ma_qa_metric_dihedral'}
+    _collection_modes = {
+        modelcif.qa_metric.LocalMetricTable: modelcif.qa_metric.Local,
+        modelcif.qa_metric.PairwiseMatrix: modelcif.qa_metric.LocalPairwise}
+
+    def _get_mode_class(self, cls):
+        for coll, mode in self._collection_modes.items():
+            if issubclass(cls, coll):
+                return mode
+        for mode in self._mode_classes:
+            if issubclass(cls, mode):
+                return mode
+
     def finalize(self, system):
-        # Get all metric classes used by all systems
-        seen_metric_classes = set()
+        # Get all metric classes used by all systems, and sort metrics
+        # by mode in a single pass so that each category only needs to
+        # visit its own metrics
+        self._seen_metric_classes = set()
         self._metric_classes_by_id = []
-        metric_id = itertools.count(1)
+        self._metric_id = itertools.count(1)
+        self._mode_for_class = {}
+        self._reset_metrics()
         for group, model in system._all_models():
-            for m in model.qa_metrics:
-                cls = type(m)
-                if cls not in seen_metric_classes:
-                    seen_metric_classes.add(cls)
-                    cls._id = next(metric_id)
-                    # We need an instance of the class in case name or
-                    # description are provided by property()
-                    self._metric_classes_by_id.append(m)
+            self._add_model_metrics(model)
+
+    def _reset_metrics(self):
+        # Mapping from mode class to a list of (model, metrics) pairs
+        self._metrics_by_mode = dict((mode, [])
+                                     for mode in self._mode_classes)
+
+    def _add_model_metrics(self, model):
+        """Sort the metrics of a single model by mode, assigning IDs to
+           any metric classes not seen before"""
+        mode_for_class = self._mode_for_class
+        seen_metric_classes = self._seen_metric_classes
+        model_metrics = {}
+        for m in model.qa_metrics:
+            mcls = type(m)
+            if mcls not in mode_for_class:
+                mode_for_class[mcls] = self._get_mode_class(mcls)
+            mode = mode_for_class[mcls]
+            if mode is not None:
+                if mode not in model_metrics:
+                    model_metrics[mode] = []
+                    self._metrics_by_mode[mode].append(
+                        (model, model_metrics[mode]))
+                model_metrics[mode].append(m)
+            if isinstance(m, modelcif.qa_metric._MetricCollection):
+                cls = m.metric_class
+                if cls in seen_metric_classes:
+                    continue
+                # Make a metric object from the first value (if any)
+                m = next(iter(m), None)
+                if m is None:
+                    continue
+            else:
+                cls = mcls
+            if cls not in seen_metric_classes:
+                seen_metric_classes.add(cls)
+                cls._id = next(self._metric_id)
+                # We need an instance of the class in case name or
+                # description are provided by property()
+                self._metric_classes_by_id.append(m)
+
+    def _get_row_counts(self, system):
+        """Get a mapping from category name to the number of rows that
+           would be written to each QA metric value category"""
+        self.finalize(system)
+        counts = {}
+        for mode, model_metrics in self._metrics_by_mode.items():
+            counts[self._mode_categories[mode]] = sum(
+                len(m) if isinstance(m, modelcif.qa_metric._MetricCollection)
+                else 1 for model, metrics in model_metrics for m in metrics)
+        self._reset_metrics()
+        return counts
+
+    def _all_metrics(self, mode):
+        """Yield (model, metric) for all metrics of the given mode"""
+        for model, metrics in self._metrics_by_mode[mode]:
+            for m in metrics:
+                yield model, m
 
     def dump(self, system, writer):
         self.dump_metric_types(system, writer)
@@ -822,12 +955,9 @@ class _QAMetricDumper(Dumper):
         with writer.loop(
                 "_ma_qa_metric_global",
                 ["ordinal_id", "model_id", "metric_id", "metric_value"]) as lp:
-            for group, model in system._all_models():
-                for m in model.qa_metrics:
-                    if not isinstance(m, modelcif.qa_metric.Global):
-                        continue
-                    lp.write(ordinal_id=next(ordinal), model_id=model._id,
-                             metric_id=m._id, metric_value=m.value)
+            for model, m in self._all_metrics(modelcif.qa_metric.Global):
+                lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                         metric_id=m._id, metric_value=m.value)
 
     def dump_metric_local(self, system, writer):
         ordinal = itertools.count(1)
@@ -835,16 +965,26 @@ class _QAMetricDumper(Dumper):
                 "_ma_qa_metric_local",
                 ["ordinal_id", "model_id", "label_asym_id", "label_seq_id",
                  "label_comp_id", "metric_id", "metric_value"]) as lp:
-            for group, model in system._all_models():
-                for m in model.qa_metrics:
-                    if not isinstance(m, modelcif.qa_metric.Local):
-                        continue
-                    seq = m.residue.asym.entity.sequence
-                    lp.write(ordinal_id=next(ordinal), model_id=model._id,
-                             label_asym_id=m.residue.asym._id,
-                             label_seq_id=m.residue.seq_id,
-                             label_comp_id=seq[m.residue.seq_id - 1].id,
-                             metric_id=m._id, metric_value=m.value)
+            for model, m in self._all_metrics(modelcif.qa_metric.Local):
+                if isinstance(m, modelcif.qa_metric.LocalMetricTable):
+                    self._dump_local_table(model, m, lp, ordinal)
+                    continue
+                seq = m.residue.asym.entity.sequence
+                lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                         label_asym_id=m.residue.asym._id,
+                         label_seq_id=m.residue.seq_id,
+                         label_comp_id=seq[m.residue.seq_id - 1].id,
+                         metric_id=m._id, metric_value=m.value)
+
+    def _dump_local_table(self, model, table, lp, ordinal):
+        if len(table) == 0:
+            return
+        metric_id = table.metric_class._id
+        for asym, seq_id, value in table._rows():
+            lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                     label_asym_id=asym._id, label_seq_id=seq_id,
+                     label_comp_id=asym.entity.sequence[seq_id - 1].id,
+                     metric_id=metric_id, metric_value=value)
 
     def dump_metric_pairwise(self, system, writer):
         ordinal = itertools.count(1)
@@ -853,20 +993,40 @@ class _QAMetricDumper(Dumper):
                 ["ordinal_id", "model_id", "label_asym_id_1", "label_seq_id_1",
                  "label_comp_id_1", "label_asym_id_2", "label_seq_id_2",
                  "label_comp_id_2", "metric_id", "metric_value"]) as lp:
-            for group, model in system._all_models():
-                for m in model.qa_metrics:
-                    if not isinstance(m, modelcif.qa_metric.LocalPairwise):
-                        continue
-                    seq1 = m.residue1.asym.entity.sequence
-                    seq2 = m.residue2.asym.entity.sequence
-                    lp.write(ordinal_id=next(ordinal), model_id=model._id,
-                             label_asym_id_1=m.residue1.asym._id,
-                             label_seq_id_1=m.residue1.seq_id,
-                             label_comp_id_1=seq1[m.residue1.seq_id - 1].id,
-                             label_asym_id_2=m.residue2.asym._id,
-                             label_seq_id_2=m.residue2.seq_id,
-                             label_comp_id_2=seq2[m.residue2.seq_id - 1].id,
-                             metric_id=m._id, metric_value=m.value)
+            for model, m in self._all_metrics(
+                    modelcif.qa_metric.LocalPairwise):
+                if isinstance(m, modelcif.qa_metric.PairwiseMatrix):
+                    self._dump_pairwise_matrix(model, m, lp, ordinal)
+                    continue
+                seq1 = m.residue1.asym.entity.sequence
+                seq2 = m.residue2.asym.entity.sequence
+                lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                         label_asym_id_1=m.residue1.asym._id,
+                         label_seq_id_1=m.residue1.seq_id,
+                         label_comp_id_1=seq1[m.residue1.seq_id - 1].id,
+                         label_asym_id_2=m.residue2.asym._id,
+                         label_seq_id_2=m.residue2.seq_id,
+                         label_comp_id_2=seq2[m.residue2.seq_id - 1].id,
+                         metric_id=m._id, metric_value=m.value)
+
+    def _dump_pairwise_matrix(self, model, matrix, lp, ordinal):
+        cells = matrix._cells()
+        first = next(cells, None)
+        if first is None:
+            return
+        metric_id = matrix.metric_class._id
+        # Look up per-residue information only once for each row/column
+        asym_ids = [r.asym._id for r in matrix.residues]
+        seq_ids = [r.seq_id for r in matrix.residues]
+        comp_ids = [r.asym.entity.sequence[r.seq_id - 1].id
+                    for r in matrix.residues]
+        for i, j, value in itertools.chain((first,), cells):
+            lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                     label_asym_id_1=asym_ids[i], label_seq_id_1=seq_ids[i],
+                     label_comp_id_1=comp_ids[i],
+                     label_asym_id_2=asym_ids[j], label_seq_id_2=seq_ids[j],
+                     label_comp_id_2=comp_ids[j],
+                     metric_id=metric_id, metric_value=value)
 
     def dump_metric_feature(self, system, writer):
         ordinal = itertools.count(1)
@@ -874,13 +1034,10 @@ class _QAMetricDumper(Dumper):
                 "_ma_qa_metric_feature",
                 ["ordinal_id", "model_id", "feature_id", "metric_id",
                  "metric_value"]) as lp:
-            for group, model in system._all_models():
-                for m in model.qa_metrics:
-                    if not isinstance(m, modelcif.qa_metric.Feature):
-                        continue
-                    lp.write(ordinal_id=next(ordinal), model_id=model._id,
-                             feature_id=m.feature._id,
-                             metric_id=m._id, metric_value=m.value)
+            for model, m in self._all_metrics(modelcif.qa_metric.Feature):
+                lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                         feature_id=m.feature._id,
+                         metric_id=m._id, metric_value=m.value)
 
     def dump_metric_feature_pairwise(self, system, writer):
         ordinal = itertools.count(1)
@@ -888,14 +1045,12 @@ class _QAMetricDumper(Dumper):
                 "_ma_qa_metric_feature_pairwise",
                 ["ordinal_id", "model_id", "feature_id_1", "feature_id_2",
                  "metric_id", "metric_value"]) as lp:
-            for group, model in system._all_models():
-                for m in model.qa_metrics:
-                    if not isinstance(m, modelcif.qa_metric.FeaturePairwise):
-                        continue
-                    lp.write(ordinal_id=next(ordinal), model_id=model._id,
-                             feature_id_1=m.feature1._id,
-                             feature_id_2=m.feature2._id,
-                             metric_id=m._id, metric_value=m.value)
+            for model, m in self._all_metrics(
+                    modelcif.qa_metric.FeaturePairwise):
+                lp.write(ordinal_id=next(ordinal), model_id=model._id,
+                         feature_id_1=m.feature1._id,
+                         feature_id_2=m.feature2._id,
+                         metric_id=m._id, metric_value=m.value)
 
     def dump_metric_dihedral(self, system, writer):
         ordinal = itertools.count(1)
@@ -904,15 +1059,12 @@ class _QAMetricDumper(Dumper):
                 ["ordinal_id", "atom_id_1", "atom_id_2", "atom_id_3",
                  "atom_id_4", "metric_id", "metric_value", "quality",
                  "smarts_pattern"]) as lp:
-            for group, model in system._all_models():
-                for m in model.qa_metrics:
-                    if not isinstance(m, modelcif.qa_metric.Dihedral):
-                        continue
-                    lp.write(ordinal_id=next(ordinal), atom_id_1=m.atom_id_1,
-                             atom_id_2=m.atom_id_2, atom_id_3=m.atom_id_3,
-                             atom_id_4=m.atom_id_4, metric_id=m._id,
-                             metric_value=m.value, quality=m.quality,
-                             smarts_pattern=m.smarts_pattern)
+            for model, m in self._all_metrics(modelcif.qa_metric.Dihedral):
+                lp.write(ordinal_id=next(ordinal), atom_id_1=m.atom_id_1,
+                         atom_id_2=m.atom_id_2, atom_id_3=m.atom_id_3,
+                         atom_id_4=m.atom_id_4, metric_id=m._id,
+                         metric_value=m.value, quality=m.quality,
+                         smarts_pattern=m.smarts_pattern)
 
 
 class _CopyWriter:
@@ -934,13 +1086,51 @@ class _CopyWriter:
         self.w2.__exit__(exc_type, exc_value, traceback)
 
 
+class _ZipArchiveWriter:
+    """Write associated files into a zip archive. Only one archive member
+       can be written at a time, so the first member is written directly
+       while any others are spooled to temporary files and added to the
+       archive when it is closed."""
+    def __init__(self, path):
+        self._zf = zipfile.ZipFile(path, 'w',
+                                   compression=zipfile.ZIP_DEFLATED)
+        self._direct = False
+        self._spooled = []
+
+    def open(self, path, binary):
+        if not self._direct:
+            self._direct = True
+            fh = self._zf.open(path, 'w')
+            return fh if binary else io.TextIOWrapper(fh, encoding='utf-8')
+        else:
+            fd, tmpname = tempfile.mkstemp()
+            self._spooled.append((path, tmpname))
+            if binary:
+                return open(fd, 'wb')
+            else:
+                return open(fd, 'w', encoding='utf-8')
+
+    def close(self):
+        """Add any spooled files to the archive and close it. All file
+           handles returned by open() must be closed first."""
+        try:
+            for path, tmpname in self._spooled:
+                self._zf.write(tmpname, arcname=path)
+        finally:
+            for path, tmpname in self._spooled:
+                os.unlink(tmpname)
+            self._zf.close()
+
+
 class _SystemWriter:
     """Utility class which normally just passes through to the default
        ``base_writer``, but outputs selected categories to associated files."""
-    def __init__(self, base_writer, category_map, copy_category_map):
+    def __init__(self, base_writer, category_map, copy_category_map,
+                 archives=()):
         self._base_writer = base_writer
         self.category_map = category_map
         self.copy_category_map = copy_category_map
+        self.archives = archives
 
     def category(self, category):
         w = self.copy_category_map.get(category)
@@ -962,12 +1152,16 @@ class _SystemWriter:
 
     def end_block(self):
         # Flush and close all file handles of associated files
-        for w in self.category_map.values():
+        for w in itertools.chain(self.category_map.values(),
+                                 self.copy_category_map.values()):
             if not hasattr(w, 'fh'):
                 continue
             w.flush()
             w.fh.close()
             del w.fh
+        # Finish writing any zip archives
+        for a in self.archives:
+            a.close()
 
     # Just pass through to base writer object
     def flush(self):
@@ -980,6 +1174,49 @@ class _SystemWriter:
         return self._base_writer.write_comment(comment)
 
 
+class _CategoryTrackingWriter:
+    """Writer-like object which passes through to ``base_writer``, but
+       records the name of every category written"""
+    def __init__(self, base_writer):
+        self._base_writer = base_writer
+        self.written_categories = set()
+
+    def category(self, category):
+        self.written_categories.add(category.lower())
+        return self._base_writer.category(category)
+
+    def loop(self, category, keys):
+        self.written_categories.add(category.lower())
+        return self._base_writer.loop(category, keys)
+
+    def __getattr__(self, name):
+        # Pass through everything else (end_block, flush, etc.)
+        return getattr(self._base_writer, name)
+
+
+class _UnknownCategoryDumper(Dumper):
+    """Write out any categories that were not understood by the reader.
+       See :attr:`modelcif.System.unknown_categories`. Categories that
+       were already written by another dumper are skipped, so that
+       they never appear twice in the output."""
+    def dump(self, system, writer):
+        written = frozenset(getattr(writer, 'written_categories', ()))
+        for cat in system.unknown_categories:
+            if cat.name.lower() in written:
+                continue
+            if len(cat.rows) == 1:
+                with writer.category(cat.name) as lp:
+                    lp.write(**dict(zip(cat.keywords, cat.rows[0])))
+            else:
+                # Loop writers remove brackets (which are not valid in
+                # Python identifiers) from keywords
+                keys = [k.replace('[', '').replace(']', '')
+                        for k in cat.keywords]
+                with writer.loop(cat.name, cat.keywords) as lp:
+                    for row in cat.rows:
+                        lp.write(**dict(zip(keys, row)))
+
+
 class ModelCIFVariant(Variant):
     """Used to select typical PDBx/ModelCIF file output.
        See :func:`write` and :class:`ihm.dumper.Variant`."""
@@ -1004,7 +1241,7 @@ class ModelCIFVariant(Variant):
         _DataDumper, _DataGroupDumper, _DataRefDBDumper,
         _TargetEntityDumper, _TemplateTransformDumper, _AlignmentDumper,
         _ProtocolDumper, _ModelDumper, _AssociatedDumper, _FeatureDumper,
-        _QAMetricDumper]
+        _QAMetricDumper, _UnknownCategoryDumper]
 
     def get_dumpers(self):
         return [d() for d in self._dumpers]
@@ -1015,22 +1252,33 @@ class ModelCIFVariant(Variant):
         category_map = {}
         copy_category_map = {}
 
+        # Map from id(ZipFile) to writer, for archives written directly
+        archives = {}
+
         def _all_repo_files(r):
             for f in r.files:
-                yield f
+                yield f, None
                 if hasattr(f, 'files'):
                     for subf in f.files:
-                        yield subf
+                        yield subf, f
+
+        def _open(f, archive):
+            if archive is not None and archive.local_path:
+                if id(archive) not in archives:
+                    archives[id(archive)] = _ZipArchiveWriter(
+                        archive.local_path)
+                return archives[id(archive)].open(f.path, f.binary)
+            else:
+                return open(f.local_path, 'wb' if f.binary else 'w')
         for r in system.repositories:
-            for f in _all_repo_files(r):
+            for f, archive in _all_repo_files(r):
                 if (not hasattr(f, 'categories')
                         or (not f.categories and not f.copy_categories)):
                     continue
                 if f.binary:
-                    w = ihm.format_bcif.BinaryCifWriter(
-                        open(f.local_path, 'wb'))
+                    w = ihm.format_bcif.BinaryCifWriter(_open(f, archive))
                 else:
-                    w = ihm.format.CifWriter(open(f.local_path, 'w'))
+                    w = ihm.format.CifWriter(_open(f, archive))
                 # Write header information to the associated file
                 dumpers = (ihm.dumper._EntryDumper(), _EntryLinkDumper())
                 # We are passing the File object to the dumpers here where
@@ -1046,17 +1294,587 @@ class ModelCIFVariant(Variant):
                 for c in f.copy_categories:
                     copy_category_map['_' + c.lstrip('_').lower()] = w
         if category_map or copy_category_map:
-            return _SystemWriter(writer, category_map, copy_category_map)
+            writer = _SystemWriter(writer, category_map, copy_category_map,
+                                   list(archives.values()))
+        # Track categories written so that unknown categories don't
+        # duplicate them
+        return _CategoryTrackingWriter(writer)
+
+
+class OffloadPolicy:
+    """Policy for automatically moving large QA metric categories out of
+       the main file and into an associated file, for use with
+       :func:`write`.
+
+       For each system written, the number of rows in each QA metric
+       category (e.g. ``_ma_qa_metric_local_pairwise``) is counted, and
+       any that exceed ``max_rows`` are written to a new
+       :class:`modelcif.associated.QAMetricsFile` rather than the main
+       file. The file is referenced from the main file by a
+       :class:`modelcif.associated.Repository`, which is added to
+       :attr:`modelcif.System.repositories` only while writing.
+
+       :param int max_rows: Categories with more rows than this are
+              offloaded.
+       :param str path: The name of the associated file, as used in its URL
+              in the main file. ``{id}`` is replaced with the ID of the
+              system. If not given, ``{id}_qa.bcif`` (or ``{id}_qa.cif``
+              if ``binary`` is False) is used.
+       :param str url_root: URL root for the associated file. See
+              :class:`modelcif.associated.Repository`.
+       :param bool binary: If True (the default), the associated file is
+              written in BinaryCIF format; otherwise mmCIF is used.
+       :param str local_dir: If given, the directory in which the
+              associated file is written; by default it is written to the
+              current directory.
+       :param list categories: The names of the categories to consider
+              for offloading. By default, all QA metric value categories
+              are considered.
+    """
+    def __init__(self, max_rows, path=None, url_root=None, binary=True,
+                 local_dir=None, categories=None):
+        self.max_rows = max_rows
+        if path is None:
+            path = '{id}_qa.bcif' if binary else '{id}_qa.cif'
+        self.path, self.url_root = path, url_root
+        self.binary, self.local_dir = binary, local_dir
+        self.categories = categories
+
+    def _get_categories(self, system):
+        """Get the list of categories to offload for the given system"""
+        counts = _QAMetricDumper()._get_row_counts(system)
+        if self.categories is None:
+            categories = sorted(counts.keys())
         else:
-            # If no categories, we can just use the base writer
-            return writer
+            categories = ['_' + c.lstrip('_').lower()
+                          for c in self.categories]
+        return [c for c in categories if counts.get(c, 0) > self.max_rows]
+
+    @contextlib.contextmanager
+    def _apply(self, systems):
+        """Context manager that temporarily adds a Repository containing
+           an associated file to each system that needs one"""
+        added = []
+        try:
+            for system in systems:
+                categories = self._get_categories(system)
+                if not categories:
+                    continue
+                path = self.path.format(id=system.id)
+                local_path = (os.path.join(self.local_dir, path)
+                              if self.local_dir else path)
+                f = modelcif.associated.QAMetricsFile(
+                    path, categories=categories, entry_id=system.id,
+                    local_path=local_path, binary=self.binary,
+                    details="QA metrics too large for the main file")
+                r = modelcif.associated.Repository(self.url_root, [f])
+                system.repositories.append(r)
+                added.append((system, r))
+            yield
+        finally:
+            for system, r in added:
+                system.repositories.remove(r)
+
+
+class DumperProfile:
+    """Timing information for a single dumper, as part of a
+       :class:`WriteProfile`. Times are totals, in seconds, over all
+       systems written."""
+    def __init__(self, name):
+        #: The name of the dumper class
+        self.name = name
+        #: Time spent in the dumper's ``finalize`` method
+        self.finalize_time = 0.
+        #: Time spent in the dumper's ``dump`` method
+        self.dump_time = 0.
+        #: Mapping from mmCIF category name to the number of rows written
+        #: by this dumper
+        self.rows = {}
+
+    total_time = property(lambda self: self.finalize_time + self.dump_time,
+                          doc="Total time spent in this dumper")
+
+
+class WriteProfile:
+    """A report of where time was spent by :func:`write`.
+
+       Create an object of this class and pass it as the `profile` argument
+       to :func:`write`; it will then be populated with timing information,
+       e.g.::
+
+           profile = modelcif.dumper.WriteProfile()
+           modelcif.dumper.write(fh, systems, profile=profile)
+           for d in profile.slowest(5):
+               print(d.name, d.total_time)
+    """
+    def __init__(self):
+        #: :class:`DumperProfile` objects, one for each dumper, in the
+        #: order they were run
+        self.dumpers = []
+        self._by_name = {}
+        self._current = None
+
+    def _get_dumper(self, dumper):
+        name = type(dumper).__module__ + '.' + type(dumper).__name__
+        if name not in self._by_name:
+            p = self._by_name[name] = DumperProfile(name)
+            self.dumpers.append(p)
+        return self._by_name[name]
+
+    def _get_categories(self):
+        rows = {}
+        for d in self.dumpers:
+            for category, nrows in d.rows.items():
+                rows[category] = rows.get(category, 0) + nrows
+        return rows
+    categories = property(
+        _get_categories,
+        doc="Mapping from mmCIF category name to total rows written")
+
+    total_time = property(lambda self: sum(d.total_time
+                                           for d in self.dumpers),
+                          doc="Total time spent in all dumpers")
+
+    def slowest(self, n=None):
+        """Get the `n` (or all, if not given) :class:`DumperProfile`
+           objects that took the most time, slowest first."""
+        return sorted(self.dumpers, key=operator.attrgetter('total_time'),
+                      reverse=True)[:n]
+
+    def log(self, logger=None, level=logging.INFO):
+        """Report the profile to a Python logger.
+
+           :param logger: The logger to use; if not given, the
+                  ``modelcif.dumper`` logger is used.
+           :type logger: :class:`logging.Logger`
+           :param int level: The logging level for the report.
+        """
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        for d in self.slowest():
+            logger.log(level, "%s: finalize %.3fs, dump %.3fs, rows %s",
+                       d.name, d.finalize_time, d.dump_time,
+                       ", ".join("%s=%d" % x for x in d.rows.items())
+                       or "none")
+        logger.log(level, "Total time in dumpers: %.3fs", self.total_time)
+
+
+class _ProfilingWriterLoop:
+    """Context manager which passes through to a category or loop writer,
+       counting rows"""
+    def __init__(self, lp, rows, category):
+        self._lp, self._rows, self._category = lp, rows, category
+
+    def write(self, *args, **keys):
+        self._rows[self._category] = self._rows.get(self._category, 0) + 1
+        self._lp.write(*args, **keys)
+
+    def __enter__(self):
+        self._lp.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._lp.__exit__(exc_type, exc_value, traceback)
+
+
+class _ProfilingWriter:
+    """Writer-like object which counts rows written by the current dumper"""
+    def __init__(self, base_writer, profile):
+        self._base_writer = base_writer
+        self._profile = profile
+
+    def _rows(self):
+        current = self._profile._current
+        # Rows written outside of a dumper are not counted
+        return {} if current is None else current.rows
+
+    def category(self, category):
+        return _ProfilingWriterLoop(self._base_writer.category(category),
+                                    self._rows(), category)
+
+    def loop(self, category, keys):
+        return _ProfilingWriterLoop(self._base_writer.loop(category, keys),
+                                    self._rows(), category)
+
+    def __getattr__(self, name):
+        # Pass through everything else (end_block, flush, etc.)
+        return getattr(self._base_writer, name)
+
+
+class _ProfilingDumper:
+    """Wrapper around a Dumper which records time spent in each method"""
+    def __init__(self, dumper, profile):
+        self._dumper = dumper
+        self._profile = profile
+        self._dumper_profile = profile._get_dumper(dumper)
+
+    def _set_check(self, check):
+        self._dumper._check = check
+    _check = property(lambda self: self._dumper._check, _set_check)
+
+    def finalize(self, system):
+        start = time.perf_counter()
+        try:
+            return self._dumper.finalize(system)
+        finally:
+            self._dumper_profile.finalize_time += time.perf_counter() - start
+
+    def dump(self, system, writer):
+        self._profile._current = self._dumper_profile
+        start = time.perf_counter()
+        try:
+            return self._dumper.dump(system, writer)
+        finally:
+            self._dumper_profile.dump_time += time.perf_counter() - start
+            self._profile._current = None
+
+
+class _ProfilingVariant(Variant):
+    """Wrapper around a Variant which profiles all of its dumpers"""
+    def __init__(self, variant, dumpers, profile):
+        self._variant, self._dumpers, self._profile = \
+            variant, dumpers, profile
+
+    def get_dumpers(self):
+        return [_ProfilingDumper(d, self._profile)
+                for d in self._variant.get_dumpers()
+                + [d() for d in self._dumpers]]
+
+    def get_system_writer(self, system, writer_class, writer):
+        return _ProfilingWriter(
+            self._variant.get_system_writer(system, writer_class, writer),
+            self._profile)
 
 
 def write(fh, systems, format='mmCIF', dumpers=[],
-          variant=ModelCIFVariant, check=True):
+          variant=ModelCIFVariant, check=True, compression=None,
+          offload=None, profile=None):
     """Write out all `systems` to the file handle `fh`.
 
        See :func:`ihm.dumper.write` for more information. The function
        here behaves similarly but writes out files compliant with the
-       ModelCIF extension directory rather than IHM."""
-    return ihm.dumper.write(fh, systems, format, dumpers, variant, check=check)
+       ModelCIF extension directory rather than IHM.
+
+       Output can be compressed on the fly by setting `compression` to
+       'gzip', 'bz2', 'xz' or 'zstd' (zstd needs Python 3.14 or later, or
+       the ``zstandard`` package). In this case `fh` must be opened in
+       binary mode, even for mmCIF. If `compression` is not given and `fh`
+       is a file opened in binary mode, it is guessed from the file
+       extension (.gz, .bz2, .xz or .zst). For example::
+
+           with open('output.cif.gz', 'wb') as fh:
+               modelcif.dumper.write(fh, systems)
+
+       Large QA metric categories (such as predicted aligned error tables)
+       can be moved automatically into associated files by passing an
+       :class:`OffloadPolicy` object as `offload`, e.g.::
+
+           modelcif.dumper.write(fh, systems,
+                                 offload=OffloadPolicy(max_rows=10000))
+
+       To find out where time is spent when writing, pass a
+       :class:`WriteProfile` object as `profile`.
+    """
+    with contextlib.ExitStack() as stack:
+        fh = stack.enter_context(
+            modelcif.util._compressed(fh, format, compression))
+        if offload is not None:
+            stack.enter_context(offload._apply(systems))
+        if profile is not None:
+            if isinstance(variant, type):
+                variant = variant()
+            variant = _ProfilingVariant(variant, dumpers, profile)
+            dumpers = []
+        return ihm.dumper.write(fh, systems, format, dumpers, variant,
+                                check=check)
+
+
+class _StreamLoop:
+    """A loop that stays open while models are added to a
+       :class:`StreamWriter`, optionally renumbering an ordinal key so that
+       IDs are unique across all models."""
+    def __init__(self, loop, ordinal_key):
+        self._loop = loop
+        self._ordinal_key = ordinal_key
+        self._ordinal = itertools.count(1)
+
+    def write(self, **keys):
+        if self._ordinal_key:
+            keys[self._ordinal_key] = next(self._ordinal)
+        self._loop.write(**keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The loop is only closed by close()
+        pass
+
+    def close(self):
+        self._loop.__exit__(None, None, None)
+
+
+class _StreamSystemWriter:
+    """Writer-like object used by :class:`StreamWriter`. mmCIF requires
+       all rows of a category to be contiguous, so atoms are written
+       directly to the output file while all other per-model categories
+       are spooled to temporary files, to be copied to the output when
+       the stream is closed."""
+
+    # Keys that must be renumbered so they are unique across models
+    _ordinal_keys = {'_atom_site': 'id',
+                     '_ma_atom_feature': 'ordinal_id',
+                     '_ma_poly_residue_feature': 'ordinal_id',
+                     '_ma_entity_instance_feature': 'ordinal_id',
+                     '_ma_qa_metric_global': 'ordinal_id',
+                     '_ma_qa_metric_local': 'ordinal_id',
+                     '_ma_qa_metric_local_pairwise': 'ordinal_id',
+                     '_ma_qa_metric_feature': 'ordinal_id',
+                     '_ma_qa_metric_feature_pairwise': 'ordinal_id',
+                     '_ma_qa_metric_dihedral': 'ordinal_id'}
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._loops = {}
+        self._spools = {}
+
+    def loop(self, category, keys):
+        lp = self._loops.get(category)
+        if lp is None:
+            if category == '_atom_site':
+                w = self._writer
+            else:
+                fh = tempfile.TemporaryFile('w+')
+                self._spools[category] = fh
+                w = ihm.format.CifWriter(fh)
+            lp = self._loops[category] = _StreamLoop(
+                w.loop(category, keys), self._ordinal_keys.get(category))
+        return lp
+
+    def copy(self, category):
+        """Close the loop for the given category (if any) and copy it
+           to the output file"""
+        lp = self._loops.pop(category, None)
+        if lp is None:
+            return
+        lp.close()
+        fh = self._spools.pop(category, None)
+        if fh is not None:
+            fh.seek(0)
+            shutil.copyfileobj(fh, self._writer.fh)
+            fh.close()
+
+    def close(self):
+        for fh in self._spools.values():
+            fh.close()
+        self._spools.clear()
+        self._loops.clear()
+
+
+class _StreamModels:
+    """Facade which looks enough like a System to pass a single model
+       to the model, feature and QA dumpers"""
+    def __init__(self, group, model):
+        self.group, self.model = group, model
+
+    def _all_models(self):
+        yield self.group, self.model
+
+    _all_features = modelcif.System._all_features
+
+
+class StreamWriter:
+    """Write a ModelCIF file one model at a time.
+
+       Unlike :func:`write`, which needs every model (and all of its atoms
+       and QA metrics) in memory at once, this writes the metadata in
+       `system` immediately and then each model as it is passed to
+       :meth:`add_model`. The model can be discarded as soon as
+       :meth:`add_model` returns. For example::
+
+           with open('output.cif', 'w') as fh:
+               with modelcif.dumper.StreamWriter(fh, system) as w:
+                   for model in generate_models():
+                       w.add_model(model, group)
+
+       Only the mmCIF format is supported. `system` should already contain
+       all of the entities and asym units used by the models (in
+       :attr:`modelcif.System.asym_units`), and all software used by QA
+       metrics (in :attr:`modelcif.System.software_groups`), but no
+       models. Models added to the stream must not be referenced by
+       protocol steps or data groups, and associated files that contain
+       categories split out from the main file are not supported.
+
+       :param file fh: The file handle to write to.
+       :param system: The system to write.
+       :type system: :class:`modelcif.System`
+       :param list dumpers: A list of :class:`ihm.dumper.Dumper` classes
+              (not objects), as for :func:`write`.
+       :param variant: A class or object that selects the type of file to
+              output. See :func:`write`.
+       :param bool check: If True (the default), check the output objects
+              for self-consistency. See :func:`write`.
+       :param str compression: If given, compress the output on the fly.
+              See :func:`write`.
+    """
+
+    # Dumpers that handle models; these are only used when models are added
+    _model_dumpers = (_ModelDumper, _FeatureDumper, _QAMetricDumper)
+
+    def __init__(self, fh, system, dumpers=[], variant=ModelCIFVariant,
+                 check=True, compression=None):
+        if isinstance(variant, type):
+            variant = variant()
+        self.system = system
+        self._exit_stack = contextlib.ExitStack()
+        fh = self._exit_stack.enter_context(
+            modelcif.util._compressed(fh, 'mmCIF', compression))
+        self._writer = ihm.format.CifWriter(fh)
+        self._stream = _StreamSystemWriter(self._writer)
+        self._dumpers = variant.get_dumpers() + [d() for d in dumpers]
+        self._groups = []
+        self._model_id = itertools.count(1)
+        self._seen_types = {}
+        system._before_write()
+        self._check_system(system)
+        for d in self._dumpers:
+            d._check = check
+            d.finalize(system)
+        system._check_after_write()
+        self._data_id = itertools.count(len(system.data) + 1)
+        self._software_groups = frozenset(id(s)
+                                          for s in system.software_groups)
+        self._asym_units = frozenset(id(a) for a in system.asym_units)
+        for d in self._dumpers:
+            if isinstance(d, _DataDumper):
+                # Model data will be added to the same table
+                d.dump(system, self._stream)
+            elif isinstance(d, self._model_dumpers):
+                if isinstance(d, _ModelDumper):
+                    self._model_dumper = d
+                elif isinstance(d, _FeatureDumper):
+                    self._feature_dumper = d
+                else:
+                    self._qa_dumper = d
+            else:
+                d.dump(system, self._writer)
+
+    def _check_system(self, system):
+        if any(group for group in system.model_groups):
+            raise ValueError("Models should be added with add_model(), "
+                             "not stored in the System")
+        for r in system.repositories:
+            for f in r.files:
+                if (getattr(f, 'categories', None)
+                        or getattr(f, 'copy_categories', None)):
+                    raise ValueError(
+                        "Associated files containing categories are not "
+                        "supported when streaming")
+
+    def _check_model(self, model):
+        for asym in model.assembly:
+            asym = asym.asym if hasattr(asym, 'asym') else asym
+            if id(asym) not in self._asym_units:
+                raise ValueError(
+                    "%s, used by %s, is not in System.asym_units"
+                    % (asym, model))
+        for m in model.qa_metrics:
+            if m.software and id(m.software) not in self._software_groups:
+                raise ValueError(
+                    "Software %s, used by %s, is not in "
+                    "System.software_groups" % (m.software, m))
+
+    def add_model(self, model, group):
+        """Write a single model to the file.
+
+           :param model: The model to write.
+           :type model: :class:`modelcif.model.Model`
+           :param group: The group to which the model belongs. The model
+                  is not added to the group's list of models.
+           :type group: :class:`modelcif.model.ModelGroup`
+        """
+        self._check_model(model)
+        if not any(g is group for g in self._groups):
+            self._groups.append(group)
+            group._id = len(self._groups)
+        model._id = next(self._model_id)
+        model._data_id = next(self._data_id)
+        system = _StreamModels(group, model)
+        stream = self._stream
+
+        with stream.loop("_ma_data",
+                         ["id", "name", "content_type",
+                          "content_type_other_details"]) as lp:
+            lp.write(id=model._data_id, name=model.name,
+                     content_type=model.data_content_type,
+                     content_type_other_details=model.data_other_details)
+
+        md = self._model_dumper
+        self._seen_types.update(md.dump_atoms(system, stream, add_ihm=False))
+        md.dump_model_list(system, stream)
+        with stream.loop("_ma_model_group_link",
+                         ["group_id", "model_id"]) as lp:
+            lp.write(model_id=model._id, group_id=group._id)
+
+        features = self._feature_dumper._add_features(system._all_features())
+        self._feature_dumper._dump_features(features, stream)
+
+        qd = self._qa_dumper
+        qd._reset_metrics()
+        qd._add_model_metrics(model)
+        qd.dump_metric_global(system, stream)
+        qd.dump_metric_local(system, stream)
+        qd.dump_metric_pairwise(system, stream)
+        qd.dump_metric_feature(system, stream)
+        qd.dump_metric_feature_pairwise(system, stream)
+        qd.dump_metric_dihedral(system, stream)
+        # Don't keep a reference to the model
+        qd._reset_metrics()
+
+    def close(self):
+        """Finish writing the file. This is called automatically if the
+           object is used as a context manager."""
+        if self._stream is None:
+            return
+        stream, writer = self._stream, self._writer
+        self._stream = None
+        try:
+            stream.copy('_atom_site')
+            self._model_dumper.dump_atom_type(self._seen_types, self.system,
+                                              writer)
+            stream.copy('_ma_data')
+            stream.copy('_ma_model_list')
+            with writer.loop("_ma_model_group",
+                             ["id", "name", "details"]) as lp:
+                for group in self._groups:
+                    lp.write(id=group._id, name=group.name,
+                             details=group.details
+                             if hasattr(group, 'details') else None)
+            stream.copy('_ma_model_group_link')
+            for category in ('_ma_feature_list', '_ma_atom_feature',
+                             '_ma_poly_residue_feature',
+                             '_ma_entity_instance_feature'):
+                stream.copy(category)
+            self._qa_dumper.dump_metric_types(self.system, writer)
+            for category in ('_ma_qa_metric_global', '_ma_qa_metric_local',
+                             '_ma_qa_metric_local_pairwise',
+                             '_ma_qa_metric_feature',
+                             '_ma_qa_metric_feature_pairwise',
+                             '_ma_qa_metric_dihedral'):
+                stream.copy(category)
+            writer.end_block()
+            writer.flush()
+        finally:
+            stream.close()
+            self._exit_stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._stream is not None:
+            self._stream.close()
+            self._stream = None
+            self._exit_stack.close()
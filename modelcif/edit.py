@@ -0,0 +1,389 @@
+"""Utility functions to edit selected categories of existing mmCIF files.
+
+   Making a small change to a file, such as correcting a QA metric value
+   or adding a revision, normally means reading the entire file into a
+   :class:`modelcif.System` with :func:`modelcif.reader.read` and then
+   writing it all out again with :func:`modelcif.dumper.write`. For large
+   files most of this time is spent on the atomic coordinates, which did
+   not change. The functions here instead regenerate only the requested
+   categories and copy the rest of the file byte for byte.
+"""
+
+import collections
+import contextlib
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import ihm.format
+import modelcif.reader
+import modelcif.dumper
+import modelcif.util
+
+
+#: The location of a single category in an mmCIF file, as returned by
+#: :func:`find_categories`. ``block`` is the index of the data block
+#: containing the category, ``name`` is the lowercased category name
+#: (e.g. '_ma_qa_metric_global'), and ``start`` and ``end`` are byte
+#: offsets into the file. The range includes the ``loop_`` header, if any,
+#: but not any comment lines that follow the category.
+CategoryRange = collections.namedtuple(
+    'CategoryRange', ['block', 'name', 'start', 'end'])
+
+# Text fields, data blocks, loops, and keywords at line start. Matching
+# the preceding newline is much faster than using ^ in multiline mode.
+_token = rb'(;|data_|loop_|_[^.\s]+)'
+_token_re = re.compile(rb'\n' + _token, re.IGNORECASE)
+_first_token_re = re.compile(_token, re.IGNORECASE)
+
+
+# QA metric categories that are read into compact tables unless edited
+_compact_qa_categories = frozenset(['_ma_qa_metric_local',
+                                    '_ma_qa_metric_local_pairwise'])
+
+# QA metric categories that are not read at all unless some QA metric
+# or feature category is being edited
+_qa_value_categories = (
+    '_ma_qa_metric_global', '_ma_qa_metric_local',
+    '_ma_qa_metric_local_pairwise', '_ma_qa_metric_feature',
+    '_ma_qa_metric_feature_pairwise', '_ma_qa_metric_dihedral')
+
+# Feature categories; features are only referenced by QA metrics, so are
+# only written if the QA metric values are read
+_feature_categories = frozenset(['_ma_feature_list', '_ma_atom_feature',
+                                 '_ma_poly_residue_feature',
+                                 '_ma_entity_instance_feature'])
+
+
+def _strip_trailing_comments(buf, start, end):
+    """Return the end of the last line in buf[start:end] that is not
+       empty or a comment"""
+    while end > start:
+        line_start = buf.rfind(b'\n', start, end - 1) + 1
+        line_start = max(line_start, start)
+        line = buf[line_start:end].strip()
+        if line and not line.startswith(b'#'):
+            break
+        end = line_start
+    return end
+
+
+def _get_tokens(buf):
+    """Yield (token, offset) for all tokens at line start in buf"""
+    m = _first_token_re.match(buf)
+    if m:
+        yield m.group(1), m.start(1)
+    for m in _token_re.finditer(buf):
+        yield m.group(1), m.start(1)
+
+
+def _scan(buf):
+    """Get the start of each data block in buf, and a list of the
+       ranges of all categories in the file"""
+    block_starts = []
+    ranges = []
+    in_text = False
+    loop_start = None
+    current = None
+
+    def close(pos):
+        if current is not None:
+            r = ranges[-1]
+            ranges[-1] = r._replace(
+                end=_strip_trailing_comments(buf, r.start, pos))
+
+    for token, start in _get_tokens(buf):
+        token = token.lower().decode('latin-1')
+        if token == ';':
+            in_text = not in_text
+        elif in_text:
+            continue
+        elif token == 'data_':
+            close(start)
+            block_starts.append(start)
+            current = loop_start = None
+        elif not block_starts:
+            raise ValueError("Category found outside of a data block at "
+                             "byte offset %d" % start)
+        elif token == 'loop_':
+            close(start)
+            loop_start = start
+            current = None
+        elif loop_start is not None or token != current:
+            close(start)
+            current = token
+            if loop_start is not None:
+                start = loop_start
+            ranges.append(CategoryRange(len(block_starts) - 1, current,
+                                        start, None))
+            loop_start = None
+    close(len(buf))
+    return block_starts, ranges
+
+
+@contextlib.contextmanager
+def _mapped(path):
+    with open(path, 'rb') as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+
+def _check_path(path):
+    if (modelcif.util._get_compression(path) is not None
+            or modelcif.util._get_format(path) != 'mmCIF'):
+        raise ValueError("Only uncompressed mmCIF files can be edited")
+
+
+def find_categories(path):
+    """Find the location of every category in an mmCIF file.
+
+       The file is scanned for category and loop headers without being
+       parsed, so this is fast even for very large files. If a category
+       appears more than once in a data block, each occurrence is
+       returned separately.
+
+       :param str path: The name of the mmCIF file to scan.
+       :return: A list of :data:`CategoryRange` objects, in file order.
+    """
+    _check_path(path)
+    with _mapped(path) as buf:
+        return _scan(buf)[1]
+
+
+class _NullWriter:
+    """Accept and discard output for a category that is not being edited"""
+    def write(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _CaptureWriter:
+    """Writer-like object which stores the mmCIF text for selected
+       categories, and the order in which all categories are written"""
+    def __init__(self, categories):
+        self._categories = categories
+        self.text = {}
+        self.order = []
+
+    def start_block(self, name):
+        pass
+
+    def end_block(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def write_comment(self, comment):
+        pass
+
+    def category(self, category):
+        return self._capture(category, lambda w: w.category(category))
+
+    def loop(self, category, keys):
+        return self._capture(category, lambda w: w.loop(category, keys))
+
+    @contextlib.contextmanager
+    def _capture(self, category, get_writer):
+        name = category.lower()
+        if name not in self.order:
+            self.order.append(name)
+        if name not in self._categories:
+            yield _NullWriter()
+            return
+        fh = io.StringIO()
+        with get_writer(ihm.format.CifWriter(fh)) as lp:
+            yield lp
+        self.text[name] = self.text.get(name, '') + fh.getvalue()
+
+
+def _get_category_text(system, categories, dumpers, check):
+    """Run all dumpers on system, returning the text of the given
+       categories and the order of all categories"""
+    writer = _CaptureWriter(categories)
+    system._before_write()
+    for d in dumpers:
+        d._check = check
+        d.finalize(system)
+    system._check_after_write()
+    for d in dumpers:
+        d.dump(system, writer)
+    return writer.text, writer.order
+
+
+def _get_insert_position(buf, r):
+    """Get the position just after the range r, including the comment line
+       that the dumpers write to close a loop"""
+    pos = r.end
+    if (buf[r.start:r.start + 5].lower() == b'loop_'
+            and buf[pos:pos + 1] == b'#'):
+        pos = buf.find(b'\n', pos) + 1 or len(buf)
+    return pos
+
+
+def _get_replace_region(buf, r):
+    """Get the region of the file to replace with new text for the
+       range r. This includes the comment lines that the dumpers write
+       before and after a loop."""
+    start = r.start
+    if (buf[start:start + 5].lower() == b'loop_'
+            and buf[max(start - 3, 0):start].endswith(b'\n#\n')):
+        start -= 2
+    return start, _get_insert_position(buf, r)
+
+
+def _get_block_edits(buf, ranges, block_start, block_end, text, order,
+                     categories):
+    """Get (start, end, text) tuples for all changes to a single block.
+       Existing categories are replaced in place (or removed). New
+       categories are inserted after the preceding category in the
+       order the dumpers use, so that the result matches the output of
+       :func:`modelcif.dumper.write` as closely as possible."""
+    edits = []
+    first = {}
+    for i, r in enumerate(ranges):
+        if r.name in categories:
+            edits.append(_get_replace_region(buf, r)
+                         + ('' if r.name in first
+                            else text.get(r.name, ''),))
+        first.setdefault(r.name, i)
+    for name in order:
+        if name not in text or name in first:
+            continue
+        following = order[order.index(name) + 1:]
+        i = min((first[n] for n in following if n in first),
+                default=len(ranges))
+        if i > 0:
+            pos = _get_insert_position(buf, ranges[i - 1])
+        else:
+            # Insert just after the data_ line
+            pos = buf.find(b'\n', block_start, block_end) + 1 or block_end
+        t = text[name]
+        if pos > 0 and buf[pos - 1:pos] != b'\n':
+            t = '\n' + t
+        edits.append((pos, pos, t))
+    return edits
+
+
+def _write_edited(fh, buf, block_starts, ranges, texts, categories):
+    """Write buf to fh, replacing or inserting categories in each block"""
+    edits = []
+    for block, (text, order) in enumerate(texts):
+        block_end = (block_starts[block + 1] if block + 1 < len(block_starts)
+                     else len(buf))
+        edits.extend(_get_block_edits(
+            buf, [r for r in ranges if r.block == block],
+            block_starts[block], block_end, text, order, categories))
+    pos = 0
+    for start, end, text in sorted(edits, key=lambda e: e[:2]):
+        fh.write(buf[pos:start])
+        fh.write(text.encode('utf-8'))
+        pos = end
+    fh.write(buf[pos:])
+
+
+def edit(path, categories, func=None, output=None, dumpers=[],
+         variant=modelcif.dumper.ModelCIFVariant, check=True):
+    """Regenerate selected categories in an mmCIF file.
+
+       The file is read with :func:`modelcif.reader.read`, skipping the
+       atomic coordinates (``_atom_site``) unless they are needed. QA metric
+       values are also skipped unless a QA metric category is being
+       edited, and per-residue and pairwise values are read into compact
+       tables (see the ``compact_qa_metrics`` option to
+       :func:`modelcif.reader.read`) unless they are being edited. `func`
+       is then called with each resulting :class:`modelcif.System`, and
+       can modify it as desired. Finally, only the given `categories` are
+       regenerated by the usual dumpers (as used by
+       :func:`modelcif.dumper.write`); every other part of the file is
+       copied unchanged. A requested category that was not in the original
+       file is added, and one that the dumpers no longer write (for
+       example because all of its data was removed) is deleted.
+       For example, to add a revision to a file::
+
+           def add_revision(system):
+               system.revisions.append(ihm.Revision(
+                   data_content_type='Structure model', major=1, minor=1,
+                   date=datetime.date.today()))
+
+           modelcif.edit.edit('model.cif', ['_pdbx_audit_revision_history'],
+                              add_revision)
+
+       Note that regenerated categories use the IDs assigned by the dumpers,
+       which only match those used in the rest of the file if it was itself
+       written by python-modelcif. Categories stored in associated files
+       are not handled.
+
+       Only uncompressed mmCIF files can be edited.
+
+       :param str path: The name of the mmCIF file to edit.
+       :param list categories: The names of the categories to regenerate
+              (e.g. '_ma_qa_metric_global').
+       :param func: If given, a function which is called with each
+              :class:`modelcif.System` read from the file, before the
+              categories are regenerated. If not given, categories are
+              simply regenerated from the file contents.
+       :param str output: The name of the file to write. If not given,
+              `path` is replaced with the edited file.
+       :param list dumpers: A list of :class:`ihm.dumper.Dumper` classes
+              (not objects), used to write extra categories.
+       :param variant: A class or object that selects the set of dumpers
+              used. See :func:`modelcif.dumper.write`.
+       :param bool check: If True (the default), check the regenerated
+              objects for self-consistency. Since most checks need the
+              atomic coordinates, this has no effect unless ``_atom_site``
+              or ``_atom_type`` is one of the categories being edited.
+    """
+    _check_path(path)
+    categories = frozenset(c.lower() for c in categories)
+    if isinstance(variant, type):
+        variant = variant()
+    exclude = []
+    if not categories & frozenset(['_atom_site', '_atom_type']):
+        exclude.append('_atom_site')
+    if (not any(c.startswith('_ma_qa_metric') for c in categories)
+            and not categories & _feature_categories):
+        # QA metrics (and the IDs assigned to them) don't affect
+        # any other category, except for features
+        exclude.extend(_qa_value_categories)
+    # Per-residue and pairwise QA values are much faster to read (and
+    # dump) as compact tables, unless they are being edited
+    compact = not categories & _compact_qa_categories
+    with open(path, encoding='utf-8') as fh:
+        systems = modelcif.reader.read(fh, exclude_categories=exclude,
+                                       compact_qa_metrics=compact)
+    texts = []
+    for system in systems:
+        if func is not None:
+            func(system)
+        texts.append(_get_category_text(
+            system, categories,
+            variant.get_dumpers() + [d() for d in dumpers],
+            check and '_atom_site' not in exclude))
+
+    if output is None:
+        output = path
+    outdir = os.path.dirname(output)
+    fd, tmpname = tempfile.mkstemp(dir=outdir or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            with _mapped(path) as buf:
+                block_starts, ranges = _scan(buf)
+                if len(block_starts) != len(systems):
+                    raise ValueError(
+                        "Found %d data blocks but read %d systems"
+                        % (len(block_starts), len(systems)))
+                _write_edited(fh, buf, block_starts, ranges, texts,
+                              categories)
+        shutil.copymode(path, tmpname)
+        os.replace(tmpname, output)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
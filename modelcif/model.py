@@ -1,4 +1,8 @@
+import array
+import collections
+import math
 import ihm.representation
+import ihm.util
 from ihm.model import Atom, ModelGroup  # noqa: F401
 import modelcif.data
 from ihm.util import _check_residue_range
@@ -66,9 +70,24 @@ class Model(modelcif.data.Data):
         #: :class:`NotModeledResidueRange`.
         self.not_modeled_residue_ranges = []
 
-        #: Quality scores for the model or part of it (a simple list of
-        #: metric objects; see :mod:`modelcif.qa_metric`)
-        self.qa_metrics = []
+        self._qa_metrics = []
+
+    # Function (if any) to call to load QA metrics on first access;
+    # see :meth:`modelcif.System.load_associated`
+    _qa_loader = None
+
+    def _get_qa_metrics(self):
+        if self._qa_loader is not None:
+            self._qa_loader()
+        return self._qa_metrics
+
+    def _set_qa_metrics(self, value):
+        self._qa_metrics = value
+
+    qa_metrics = property(
+        _get_qa_metrics, _set_qa_metrics,
+        doc="Quality scores for the model or part of it (a simple list of "
+            "metric objects; see :mod:`modelcif.qa_metric`)")
 
     def _get_other_details(self):
         if (type(self) is not Model
@@ -98,6 +117,213 @@ class Model(modelcif.data.Data):
     def add_atom(self, atom):
         self._atoms.append(atom)
 
+    def _get_modeled_seq_ids(self):
+        """Get a mapping from asym to the set of residue indices that
+           have at least one atom, in a single pass over all atoms"""
+        seq_ids = collections.defaultdict(set)
+        for atom in self.get_atoms():
+            if atom.seq_id is not None:
+                seq_ids[atom.asym_unit].add(atom.seq_id)
+        return seq_ids
+
+    def compute_not_modeled_residue_ranges(self):
+        """Get all ranges of polymer residues in the model's assembly
+           that are not covered by any atom.
+
+           This can be used to fill in :attr:`not_modeled_residue_ranges`
+           for models where the residue ranges are not known, e.g.::
+
+               model.not_modeled_residue_ranges.extend(
+                   model.compute_not_modeled_residue_ranges())
+
+           :return: A list of :class:`NotModeledResidueRange` objects.
+        """
+        modeled = self._get_modeled_seq_ids()
+        ranges = []
+        for assem in self.assembly:
+            asym = assem.asym if hasattr(assem, 'asym') else assem
+            if not asym.entity.is_polymeric():
+                continue
+            start, end = assem.seq_id_range
+            handled = sorted(seq_id for seq_id in modeled.get(asym, ())
+                             if start <= seq_id <= end)
+            for r in ihm.util._invert_ranges(
+                    ihm.util._make_range_from_list(handled),
+                    end=end, start=start):
+                ranges.append(NotModeledResidueRange(asym, r[0], r[1]))
+        return ranges
+
+
+class ArrayModel(Model):
+    """Coordinates of a single structure, stored in compact arrays.
+
+       This behaves like :class:`Model` but rather than keeping a list of
+       :class:`Atom` objects, atom coordinates and properties are stored in
+       flat arrays (with atom names and element names stored as indices
+       into a table of unique strings). This uses much less memory for
+       large models, and atoms can be written out directly from the arrays
+       by :func:`modelcif.dumper.write`.
+
+       Atoms can be added individually with :meth:`add_atom`, or many atoms
+       at once with :meth:`add_atoms`. :meth:`get_atoms` creates
+       :class:`Atom` objects on the fly.
+
+       To read files into these objects, pass this class as the
+       ``model_class`` argument to :func:`modelcif.reader.read`. Each
+       model read is then also an instance of the class for its model
+       type (e.g. :class:`HomologyModel`).
+
+       See :class:`Model` for a description of the parameters.
+    """
+
+    def __init__(self, assembly, name=None):
+        super().__init__(assembly, name)
+        self._asyms = []
+        self._asym_index = {}
+        # Unique atom names, element names and alternate location IDs
+        self._strings = []
+        self._string_index = {}
+        self._asym_indices = array.array('i')
+        self._seq_ids = array.array('i')
+        self._atom_id_indices = array.array('i')
+        self._type_symbol_indices = array.array('i')
+        self._alt_id_indices = array.array('i')
+        self._xyz = array.array('d')
+        self._biso = array.array('d')
+        self._occupancy = array.array('d')
+        self._het = array.array('b')
+
+    def _get_asym_index(self, asym):
+        ind = self._asym_index.get(asym)
+        if ind is None:
+            ind = self._asym_index[asym] = len(self._asyms)
+            self._asyms.append(asym)
+        return ind
+
+    def _get_string_index(self, s):
+        if s is None:
+            return -1
+        ind = self._string_index.get(s)
+        if ind is None:
+            ind = self._string_index[s] = len(self._strings)
+            self._strings.append(s)
+        return ind
+
+    def add_atom(self, atom):
+        """Add a single :class:`Atom` to the model. Only the atom's data
+           are stored; the object itself is not retained."""
+        self._add_atom(atom.asym_unit, atom.seq_id, atom.atom_id,
+                       atom.type_symbol, atom.x, atom.y, atom.z, atom.het,
+                       atom.biso, atom.occupancy, atom.alt_id)
+
+    def _add_atom(self, asym_unit, seq_id, atom_id, type_symbol, x, y, z,
+                  het, biso, occupancy, alt_id):
+        self._asym_indices.append(self._get_asym_index(asym_unit))
+        self._seq_ids.append(-1 if seq_id is None else seq_id)
+        self._atom_id_indices.append(self._get_string_index(atom_id))
+        self._type_symbol_indices.append(
+            self._get_string_index(type_symbol))
+        self._alt_id_indices.append(self._get_string_index(alt_id))
+        self._xyz.extend((x, y, z))
+        self._biso.append(math.nan if biso is None else biso)
+        self._occupancy.append(math.nan if occupancy is None else occupancy)
+        self._het.append(het)
+
+    def add_atoms(self, asym_unit, seq_ids, atom_ids, type_symbols, coords,
+                  het=False, biso=None, occupancy=None):
+        """Add a number of atoms, all in the same asymmetric unit, to the
+           model.
+
+           :param asym_unit: The asymmetric unit that the atoms represent.
+           :type asym_unit: :class:`modelcif.AsymUnit`
+           :param seq_ids: The residue index of each atom.
+           :param atom_ids: The name of each atom in its residue.
+           :param type_symbols: The element name of each atom.
+           :param coords: The coordinates of each atom, as
+                  (x, y, z) triples.
+           :param bool het: True if the atoms are HETATM sites.
+           :param biso: If given, the temperature factor of each atom.
+           :param occupancy: If given, the occupancy of each atom.
+        """
+        seq_ids, atom_ids = list(seq_ids), list(atom_ids)
+        type_symbols, coords = list(type_symbols), list(coords)
+        n = len(seq_ids)
+        if not (len(atom_ids) == len(type_symbols) == len(coords) == n):
+            raise ValueError("All per-atom inputs must be the same length")
+        biso = [None] * n if biso is None else list(biso)
+        occupancy = [None] * n if occupancy is None else list(occupancy)
+        for i in range(n):
+            x, y, z = coords[i]
+            self._add_atom(asym_unit, seq_ids[i], atom_ids[i],
+                           type_symbols[i], x, y, z, het, biso[i],
+                           occupancy[i], None)
+
+    def _get_atom_rows(self):
+        """Yield (asym, seq_id, atom_id, type_symbol, x, y, z, het, biso,
+           occupancy, alt_id) for each atom"""
+        asyms, strings = self._asyms, self._strings
+        xyz = self._xyz
+        for i, (asym_ind, seq_id, atom_ind, type_ind, alt_ind, biso,
+                occupancy, het) in enumerate(zip(
+                    self._asym_indices, self._seq_ids, self._atom_id_indices,
+                    self._type_symbol_indices, self._alt_id_indices,
+                    self._biso, self._occupancy, self._het)):
+            yield (asyms[asym_ind], None if seq_id == -1 else seq_id,
+                   None if atom_ind == -1 else strings[atom_ind],
+                   None if type_ind == -1 else strings[type_ind],
+                   xyz[3 * i], xyz[3 * i + 1], xyz[3 * i + 2], bool(het),
+                   None if biso != biso else biso,
+                   None if occupancy != occupancy else occupancy,
+                   None if alt_ind == -1 else strings[alt_ind])
+
+    def _reassign_seq_ids(self):
+        """Map provisional seq_ids to those in the branch scheme, using
+           each asym's num_map (see ihm.reader._BranchSchemeHandler)"""
+        asyms, seq_ids = self._asyms, self._seq_ids
+        for i, asym_ind in enumerate(self._asym_indices):
+            num_map = asyms[asym_ind].num_map
+            if num_map and seq_ids[i] != -1:
+                seq_ids[i] = num_map[seq_ids[i]]
+
+    def _get_modeled_seq_ids(self):
+        # Work directly from the arrays rather than creating Atom objects
+        seq_ids = [set() for _ in self._asyms]
+        for asym_ind, seq_id in zip(self._asym_indices, self._seq_ids):
+            seq_ids[asym_ind].add(seq_id)
+        for s in seq_ids:
+            s.discard(-1)
+        return dict(zip(self._asyms, seq_ids))
+
+    def get_atoms(self):
+        """Yield :class:`Atom` objects that represent this model.
+           The objects are created on demand from the arrays."""
+        for row in self._get_atom_rows():
+            yield Atom(*row)
+
+    def _get_reused_atoms(self):
+        """Like :meth:`get_atoms`, but update and yield a single
+           :class:`Atom` object rather than creating a new one per atom.
+           This is faster for callers that do not keep the objects."""
+        atom = Atom(*(None,) * 7)
+        for row in self._get_atom_rows():
+            (atom.asym_unit, atom.seq_id, atom.atom_id, atom.type_symbol,
+             atom.x, atom.y, atom.z, atom.het, atom.biso, atom.occupancy,
+             atom.alt_id) = row
+            yield atom
+
+    num_atoms = property(lambda self: len(self._seq_ids),
+                         doc="The number of atoms in this model.")
+
+    def _get_other_details(self):
+        # ArrayModel itself is a generic "other" model, like Model
+        if type(self) is not ArrayModel:
+            return super()._get_other_details()
+
+    other_details = property(
+        _get_other_details,
+        doc="More information about a custom model type. "
+            "By default it is the first line of the docstring.")
+
 
 class HomologyModel(Model):
     """Coordinates of a single structure generated using homology
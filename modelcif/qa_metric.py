@@ -19,8 +19,15 @@
 
    QA metric objects should be added to
    :attr:`modelcif.model.Model.qa_metrics`.
+
+   For large models, per-residue and pairwise scores can be stored more
+   compactly by adding a :class:`LocalMetricTable` or :class:`PairwiseMatrix`
+   to the model instead of many individual :class:`Local` or
+   :class:`LocalPairwise` objects.
 """
 
+import array
+import math
 from ihm.util import _text_choice_property
 
 
@@ -75,6 +82,75 @@ class Local(MetricMode):
                                                self.residue, self.value)
 
 
+class _MetricCollection:
+    """Base class for compact storage of many scores of a single metric"""
+
+    def __init__(self, metric_class):
+        self.metric_class = metric_class
+
+    software = property(lambda self: self.metric_class.software,
+                        doc="Software used to calculate the score "
+                            "(the same as for ``metric_class``).")
+
+    def __repr__(self):
+        return "<%s(metric_class=%s, %d values)>" % (
+            type(self).__name__, self.metric_class.__name__, len(self))
+
+
+class LocalMetricTable(_MetricCollection):
+    """A compact table of per-residue scores for a single :class:`Local`
+       metric.
+
+       Rather than creating a :class:`Local` object (and a
+       :class:`modelcif.Residue`) for every residue, the asymmetric units,
+       residue indices and score values are stored in flat arrays.
+       The table can be added to :attr:`modelcif.model.Model.qa_metrics`
+       in place of the individual metric objects. Iterating over the table
+       yields equivalent :class:`Local` objects, created on demand.
+
+       :param metric_class: The class of the score, derived from both
+              :class:`Local` and a subclass of :class:`MetricType`.
+    """
+
+    def __init__(self, metric_class):
+        super().__init__(metric_class)
+        self._asyms = []
+        self._asym_index = {}
+        self._asym_indices = array.array('i')
+        self._seq_ids = array.array('i')
+        self._values = array.array('d')
+
+    def add(self, asym, seq_id, value):
+        """Add a score for a single residue.
+
+           :param asym: The asymmetric unit containing the residue.
+           :type asym: :class:`modelcif.AsymUnit`
+           :param int seq_id: The residue index.
+           :param float value: The score value.
+        """
+        ind = self._asym_index.get(asym)
+        if ind is None:
+            ind = self._asym_index[asym] = len(self._asyms)
+            self._asyms.append(asym)
+        self._asym_indices.append(ind)
+        self._seq_ids.append(seq_id)
+        self._values.append(value)
+
+    def _rows(self):
+        """Yield (asym, seq_id, value) for each row in the table"""
+        asyms = self._asyms
+        return zip((asyms[i] for i in self._asym_indices),
+                   self._seq_ids, self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        cls = self.metric_class
+        for asym, seq_id, value in self._rows():
+            yield cls(asym.residue(seq_id), value)
+
+
 class LocalPairwise(MetricMode):
     """A score that is calculated between two residues.
 
@@ -98,6 +174,84 @@ class LocalPairwise(MetricMode):
                    self.value))
 
 
+class PairwiseMatrix(_MetricCollection):
+    """A dense matrix of scores between pairs of residues for a single
+       :class:`LocalPairwise` metric, such as a predicted aligned error
+       (PAE) matrix.
+
+       Rather than creating a :class:`LocalPairwise` object (and two
+       :class:`modelcif.Residue` objects) for every pair of residues,
+       the scores are stored in a single NxN array of single-precision
+       floats, where N is the number of residues. The matrix can be added
+       to :attr:`modelcif.model.Model.qa_metrics` in place of the individual
+       metric objects. Iterating over the matrix yields equivalent
+       :class:`LocalPairwise` objects, created on demand, for every pair
+       that has a score.
+
+       :param metric_class: The class of the score, derived from both
+              :class:`LocalPairwise` and a subclass of :class:`MetricType`.
+       :param residues: The residues that index the rows and columns
+              of the matrix, as :class:`modelcif.Residue` objects.
+    """
+
+    def __init__(self, metric_class, residues):
+        super().__init__(metric_class)
+        self.residues = list(residues)
+        self._index = dict(((r.asym, r.seq_id), i)
+                           for i, r in enumerate(self.residues))
+        n = len(self.residues)
+        self._values = array.array('f', [math.nan]) * (n * n)
+        # Number of non-NaN values, kept up to date by __setitem__
+        self._num_values = 0
+
+    values = property(
+        lambda self: self._values,
+        doc="Scores for all residue pairs, in row-major order, as an "
+            "``array.array`` of floats. Pairs without a score are NaN. "
+            "To change a score, assign to the matrix (e.g. "
+            "``matrix[i, j] = value``) rather than to this array, so that "
+            "the number of scores is kept up to date.")
+
+    def index(self, residue):
+        """Get the row or column index of the given residue.
+
+           :param residue: The residue to look up.
+           :type residue: :class:`modelcif.Residue`
+           :return: The index, or None if the residue is not in the matrix.
+        """
+        return self._index.get((residue.asym, residue.seq_id))
+
+    def __getitem__(self, key):
+        i, j = key
+        return self._values[i * len(self.residues) + j]
+
+    def __setitem__(self, key, value):
+        i, j = key
+        values = self._values
+        k = i * len(self.residues) + j
+        old = values[k]
+        values[k] = value
+        # NaN (no score) is the only value not equal to itself
+        self._num_values += (values[k] == values[k]) - (old == old)
+
+    def _cells(self):
+        """Yield (i, j, value) for each residue pair that has a score"""
+        n = len(self.residues)
+        for k, value in enumerate(self._values):
+            if value == value:  # skip NaN
+                i, j = divmod(k, n)
+                yield i, j, value
+
+    def __len__(self):
+        return self._num_values
+
+    def __iter__(self):
+        cls = self.metric_class
+        residues = self.residues
+        for i, j, value in self._cells():
+            yield cls(residues[i], residues[j], value)
+
+
 class Feature(MetricMode):
     """A score that is calculated on a single feature.
 
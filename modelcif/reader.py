@@ -8,9 +8,12 @@ import modelcif.alignment
 import modelcif.reference
 import modelcif.associated
 import modelcif.descriptor
+import modelcif.util
 import ihm
 import ihm.source
 import ihm.reader
+import ihm.format
+import ihm.format_bcif
 from ihm.reader import Variant, Handler, IDMapper, _ChemCompIDMapper
 from ihm.reader import OldFileError, _make_new_entity
 from datetime import date
@@ -18,8 +21,20 @@ import posixpath
 import operator
 import inspect
 import collections
+import copyreg
 import functools
+import array
+import bisect
+import heapq
+import multiprocessing
+import math
+import logging
+import time
+import tracemalloc
+import contextlib
 import warnings
+import io
+import copy
 
 
 def _get_date(iso_date_str):
@@ -103,6 +118,7 @@ class _AtomIDMap:
 
     def __init__(self):
         self._model_to_id_range = {}
+        self._index = None
 
     def add(self, atom_id, model_num):
         """Add a mapping between a single atom ID and model number"""
@@ -110,6 +126,7 @@ class _AtomIDMap:
             atom_id = int(atom_id)
         except ValueError:
             return
+        self._index = None
         if model_num not in self._model_to_id_range:
             self._model_to_id_range[model_num] = [atom_id, atom_id]
         else:
@@ -119,16 +136,60 @@ class _AtomIDMap:
             elif atom_id > r[1]:
                 r[1] = atom_id
 
+    def _build_index(self):
+        """Split the atom ID ranges into sorted, non-overlapping segments,
+           each mapping to a single model. Where ranges overlap, the model
+           that was seen first wins."""
+        ranges = sorted((rng[0], rng[1], order, model_id)
+                        for order, (model_id, rng)
+                        in enumerate(self._model_to_id_range.items()))
+        bounds = sorted(frozenset(
+            b for rng in ranges for b in (rng[0], rng[1] + 1)))
+        starts = []
+        models = []
+        active = []
+        nrange = 0
+        for b in bounds:
+            while nrange < len(ranges) and ranges[nrange][0] == b:
+                start, end, order, model_id = ranges[nrange]
+                heapq.heappush(active, (order, end, model_id))
+                nrange += 1
+            while active and active[0][1] < b:
+                heapq.heappop(active)
+            model_id = active[0][2] if active else None
+            # Merge adjacent segments that map to the same model
+            if not models or models[-1] != model_id:
+                starts.append(b)
+                models.append(model_id)
+        self._index = (starts, models)
+
     def get(self, atom_id):
         """Look up an atom ID and return the corresponding model number"""
-        # Do a dumb search through all models. If we have many models,
-        # this could be made more efficient by sorting the ranges first
-        # and doing a binary search.
-        for model_id, rng in self._model_to_id_range.items():
-            if atom_id >= rng[0] and atom_id <= rng[1]:
-                return model_id
-        raise ValueError("Atom ID %d could not be found in any model"
-                         % atom_id)
+        if self._index is None:
+            self._build_index()
+        starts, models = self._index
+        i = bisect.bisect_right(starts, atom_id) - 1
+        model_id = models[i] if i >= 0 else None
+        if model_id is None:
+            raise ValueError("Atom ID %d could not be found in any model"
+                             % atom_id)
+        return model_id
+
+
+class _ResidueMapper:
+    """Map asym and seq_id to a single shared :class:`ihm.Residue` object,
+       so that all data read for a given residue refer to the same
+       Python object (rather than allocating a new one for each)."""
+
+    def __init__(self):
+        self._residues = {}
+
+    def get(self, asym, seq_id):
+        k = (asym, seq_id)
+        r = self._residues.get(k)
+        if r is None:
+            r = self._residues[k] = asym.residue(seq_id)
+        return r
 
 
 class _SystemReader:
@@ -185,6 +246,8 @@ class _SystemReader:
             *(None,) * 4)
 
         self.default_model_class = model_class is modelcif.model.Model
+        # Generic ArrayModels are combined with the type given in the file
+        self.array_model_class = model_class is modelcif.model.ArrayModel
         self._all_seen_models = []
         for group, model in self.system._all_models():
             self._all_seen_models.append(model)
@@ -202,6 +265,9 @@ class _SystemReader:
         self.alignments = IDMapper(None, ihm.reference.Alignment)
         self.features = _FeatureIDMapper(None, modelcif.Feature)
 
+        #: Mapping from asym and seq_id to :class:`ihm.Residue` objects
+        self.residues = _ResidueMapper()
+
         self.assoc_by_id = {}
 
         self.qa_by_id = self.system._qa_by_id
@@ -224,6 +290,9 @@ class _SystemReader:
         # Mapping from atom_site.id to model number
         self.atom_id_to_model_num = _AtomIDMap()
 
+        # If True, store per-residue QA metrics in compact tables
+        self.compact_qa_metrics = False
+
     def finalize(self):
         # make sequence immutable (see also _make_new_entity)
         for e in self.system.entities:
@@ -441,16 +510,44 @@ class _DataRefDBHandler(Handler):
         d._data_id = data_id
 
 
+class _ReaderClass(type):
+    """Metaclass for classes that the reader creates on the fly.
+       These cannot be pickled by reference, so each class records
+       how it was made, so that it can be recreated on unpickling."""
+    pass
+
+
+def _make_class(name, bases, attrs):
+    """Create and return a new (picklable) class"""
+    cls = _ReaderClass(name, bases, dict(attrs))
+    cls._class_recipe = (name, bases, attrs)
+    return cls
+
+
+def _reduce_class(cls):
+    if '_class_recipe' in cls.__dict__:
+        return _make_class, cls._class_recipe
+    else:
+        # Subclasses defined elsewhere can be pickled as usual
+        return cls.__qualname__
+
+
+copyreg.pickle(_ReaderClass, _reduce_class)
+
+
 class _EnumerationMapper:
     """Map an mmCIF enumerated value to the corresponding Python class"""
     def __init__(self, module, base_class, attr="name"):
         self._base_class = base_class
         self._other_name = getattr(base_class, attr).upper()
         self._attr = attr
+        # Skip subclasses (e.g. storage variants) that don't change the
+        # enumerated value from that of the base class
         self._map = dict(
             (getattr(x[1], attr).upper(), x[1])
             for x in inspect.getmembers(module, inspect.isclass)
-            if issubclass(x[1], base_class) and x[1] is not base_class)
+            if issubclass(x[1], base_class) and x[1] is not base_class
+            and getattr(x[1], attr).upper() != self._other_name)
         self._other_map = {}
 
     def get(self, name, other_det):
@@ -463,18 +560,16 @@ class _EnumerationMapper:
         # If name is not Other this is an enumeration value we don't have
         # a class for; make and cache a new class for the given name:
         if name != self._other_name:
-            class ExtraType(self._base_class):
-                other_details = None
-            setattr(ExtraType, self._attr, name)
+            ExtraType = _make_class('ExtraType', (self._base_class,),
+                                    {'other_details': None, self._attr: name})
             self._map[name] = ExtraType
             return ExtraType
         # If name is "Other" then treat other_details as the key
         other_det_up = other_det if other_det is None else other_det.upper()
         if other_det_up not in self._other_map:
-            class CustomType(self._base_class):
-                other_details = other_det
-                __doc__ = other_det
-            self._other_map[other_det_up] = CustomType
+            self._other_map[other_det_up] = _make_class(
+                'CustomType', (self._base_class,),
+                {'other_details': other_det, '__doc__': other_det})
         return self._other_map[other_det_up]
 
 
@@ -651,9 +746,8 @@ def _get_align_class(type_class, mode_class, align_class_map):
     """Create and return a new class to represent an alignment"""
     k = (type_class, mode_class)
     if k not in align_class_map:
-        class Alignment(type_class, mode_class):
-            pass
-        align_class_map[k] = Alignment
+        align_class_map[k] = _make_class('Alignment',
+                                         (type_class, mode_class), {})
     return align_class_map[k]
 
 
@@ -825,11 +919,62 @@ class _AtomSiteHandler(ihm.reader._AtomSiteHandler):
         # Update mapping from atom ID to model number
         self.sysr.atom_id_to_model_num.add(id, pdbx_pdb_model_num)
 
-        super().__call__(
-            pdbx_pdb_model_num, label_asym_id, b_iso_or_equiv,
-            label_seq_id, label_atom_id, type_symbol, cartn_x, cartn_y,
-            cartn_z, occupancy, group_pdb, auth_seq_id, pdbx_pdb_ins_code,
-            auth_asym_id, label_comp_id, label_alt_id)
+        model = self.sysr.models.get_by_id(pdbx_pdb_model_num)
+        if isinstance(model, modelcif.model.ArrayModel):
+            self._add_array_atom(
+                model, label_asym_id, b_iso_or_equiv, label_seq_id,
+                label_atom_id, type_symbol, cartn_x, cartn_y, cartn_z,
+                occupancy, group_pdb, auth_seq_id, pdbx_pdb_ins_code,
+                auth_asym_id, label_comp_id, label_alt_id)
+        else:
+            super().__call__(
+                pdbx_pdb_model_num, label_asym_id, b_iso_or_equiv,
+                label_seq_id, label_atom_id, type_symbol, cartn_x, cartn_y,
+                cartn_z, occupancy, group_pdb, auth_seq_id, pdbx_pdb_ins_code,
+                auth_asym_id, label_comp_id, label_alt_id)
+
+    def _add_array_atom(self, model, label_asym_id, b_iso_or_equiv,
+                        label_seq_id, label_atom_id, type_symbol, cartn_x,
+                        cartn_y, cartn_z, occupancy, group_pdb, auth_seq_id,
+                        pdbx_pdb_ins_code, auth_asym_id, label_comp_id,
+                        label_alt_id):
+        """Add an atom directly to the arrays of an ArrayModel, without
+           creating an Atom object. Otherwise this behaves identically to
+           the base class __call__ method."""
+        seq_id = label_seq_id
+        if label_asym_id is None:
+            asym = self.sysr.asym_units.get_by_id(auth_asym_id)
+            self._missing_poly_sequence[asym][seq_id] = label_comp_id
+        else:
+            asym = self.sysr.asym_units.get_by_id(label_asym_id)
+        auth_seq_id = self.get_int_or_string(auth_seq_id)
+        if seq_id is None:
+            our_seq_id = self._get_seq_id_from_auth(
+                auth_seq_id, pdbx_pdb_ins_code, asym)
+        else:
+            our_seq_id = seq_id
+        het = group_pdb not in (None, 'ATOM')
+        if het:
+            self._missing_nonpoly_chem_comp[asym] = label_comp_id
+        model._add_atom(asym, our_seq_id, label_atom_id, type_symbol,
+                        cartn_x, cartn_y, cartn_z, het, b_iso_or_equiv,
+                        occupancy, label_alt_id)
+
+        if (auth_seq_id is not None and seq_id is not None and
+                (seq_id != auth_seq_id
+                 or pdbx_pdb_ins_code not in (None, ihm.unknown))):
+            if asym.auth_seq_id_map == 0:
+                asym.auth_seq_id_map = {}
+            asym.auth_seq_id_map[seq_id] = auth_seq_id, pdbx_pdb_ins_code
+
+
+class _BranchSchemeHandler(ihm.reader._BranchSchemeHandler):
+    def _reassign_seq_ids(self):
+        super()._reassign_seq_ids()
+        # The base class only handles models that store Atom objects
+        for m in self.sysr.models.get_all():
+            if isinstance(m, modelcif.model.ArrayModel):
+                m._reassign_seq_ids()
 
 
 class _ModelListHandler(Handler):
@@ -843,6 +988,21 @@ class _ModelListHandler(Handler):
             attr='model_type')
         # Old-style model groups
         self._old_group_for_model = {}
+        # Map model type class to the equivalent ArrayModel subclass
+        self._array_classes = {}
+
+    def _get_array_class(self, cls):
+        """Get a class combining ArrayModel storage with the given
+           model type"""
+        acls = self._array_classes.get(cls)
+        if acls is None:
+            attrs = {'__doc__': cls.__doc__}
+            if 'other_details' in cls.__dict__:
+                attrs['other_details'] = cls.__dict__['other_details']
+            acls = self._array_classes[cls] = _make_class(
+                'Array' + cls.__name__, (modelcif.model.ArrayModel, cls),
+                attrs)
+        return acls
 
     def finalize(self):
         # Put all models not in a group in their own group
@@ -870,6 +1030,10 @@ class _ModelListHandler(Handler):
             model_type = self._type_map.get(
                 model_type, model_type_other_details)
             model = self.sysr.models.get_by_id(ordinal_id, model_type)
+        elif self.sysr.array_model_class:
+            model_type = self._get_array_class(self._type_map.get(
+                model_type, model_type_other_details))
+            model = self.sysr.models.get_by_id(ordinal_id, model_type)
         else:
             model = self.sysr.models.get_by_id(ordinal_id)
             model.model_type = model_type
@@ -1047,7 +1211,7 @@ class _PolyResidueFeatureHandler(Handler):
         f = self.sysr.features.get_by_id(
             feature_id, modelcif.PolyResidueFeature)
         asym = self.sysr.asym_units.get_by_id(label_asym_id)
-        f.residues.append(asym.residue(label_seq_id))
+        f.residues.append(self.sysr.residues.get(asym, label_seq_id))
 
 
 class _EntityInstanceFeatureHandler(Handler):
@@ -1062,12 +1226,10 @@ class _EntityInstanceFeatureHandler(Handler):
 
 def _make_qa_class(type_class, mode_class, p_name, p_description, p_software):
     """Create and return a new class to represent a QA metric"""
-    class QA(type_class, mode_class):
-        name = p_name
-        __doc__ = description = p_description
-        software = p_software
-    QA.__name__ = p_name
-    return QA
+    return _make_class(p_name, (type_class, mode_class),
+                       {'name': p_name, '__doc__': p_description,
+                        'description': p_description,
+                        'software': p_software})
 
 
 class _QAMetricHandler(Handler):
@@ -1109,29 +1271,125 @@ class _QAMetricGlobalHandler(Handler):
 class _QAMetricLocalHandler(Handler):
     category = '_ma_qa_metric_local'
 
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Mapping from (model_id, metric_id) to LocalMetricTable
+        self._tables = {}
+
     def __call__(self, model_id, label_asym_id, label_seq_id: int, metric_id,
                  metric_value: float):
+        if self.sysr.compact_qa_metrics:
+            self._add_to_table(model_id, label_asym_id, label_seq_id,
+                               metric_id, metric_value)
+            return
         model = self.sysr.models.get_by_id(model_id)
         asym = self.sysr.asym_units.get_by_id(label_asym_id)
-        residue = asym.residue(label_seq_id)
+        residue = self.sysr.residues.get(asym, label_seq_id)
         metric_class = self.sysr.qa_by_id[metric_id]
         model.qa_metrics.append(metric_class(residue, metric_value))
 
+    def _add_to_table(self, model_id, label_asym_id, label_seq_id, metric_id,
+                      metric_value):
+        k = (model_id, metric_id)
+        table = self._tables.get(k)
+        if table is None:
+            model = self.sysr.models.get_by_id(model_id)
+            table = modelcif.qa_metric.LocalMetricTable(
+                self.sysr.qa_by_id[metric_id])
+            model.qa_metrics.append(table)
+            self._tables[k] = table
+        asym = self.sysr.asym_units.get_by_id(label_asym_id)
+        table.add(asym, label_seq_id, metric_value)
+
+
+class _PairwiseMatrixBuilder:
+    """Accumulate pairwise QA metric values for a single model and metric,
+       for later conversion to a :class:`modelcif.qa_metric.PairwiseMatrix`
+       once all residues are known."""
+
+    def __init__(self, model, metric_class, residue_mapper):
+        self.model, self.metric_class = model, metric_class
+        self._residue_mapper = residue_mapper
+        self._residues = []
+        self._residue_index = {}
+        self._rows = array.array('i')
+        self._cols = array.array('i')
+        self._values = array.array('f')
+
+    def _get_index(self, asym, seq_id):
+        k = (asym, seq_id)
+        ind = self._residue_index.get(k)
+        if ind is None:
+            ind = self._residue_index[k] = len(self._residues)
+            self._residues.append(self._residue_mapper.get(asym, seq_id))
+        return ind
+
+    def add(self, asym1, seq_id1, asym2, seq_id2, value):
+        self._rows.append(self._get_index(asym1, seq_id1))
+        self._cols.append(self._get_index(asym2, seq_id2))
+        self._values.append(value)
+
+    def get_matrix(self):
+        m = modelcif.qa_metric.PairwiseMatrix(self.metric_class,
+                                              self._residues)
+        n = len(self._residues)
+        values = m._values
+        num_values = duplicates = 0
+        for i, j, value in zip(self._rows, self._cols, self._values):
+            k = i * n + j
+            old = values[k]
+            if old == old:
+                duplicates += 1
+                num_values -= 1
+            values[k] = value
+            if value == value:
+                num_values += 1
+        m._num_values = num_values
+        if duplicates:
+            # Non-compact reading would keep every row as a separate
+            # object, but the matrix can only hold one value per pair
+            warnings.warn(
+                "%d residue pair(s) have more than one %s score for "
+                "model %s; only the last value for each pair is kept"
+                % (duplicates, self.metric_class.name, self.model._id))
+        return m
+
 
 class _QAMetricPairwiseHandler(Handler):
     category = '_ma_qa_metric_local_pairwise'
 
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Mapping from (model_id, metric_id) to _PairwiseMatrixBuilder
+        self._builders = {}
+
     def __call__(self, model_id, label_asym_id_1, label_seq_id_1: int,
                  label_asym_id_2, label_seq_id_2: int, metric_id,
                  metric_value: float):
+        if self.sysr.compact_qa_metrics:
+            k = (model_id, metric_id)
+            b = self._builders.get(k)
+            if b is None:
+                b = self._builders[k] = _PairwiseMatrixBuilder(
+                    self.sysr.models.get_by_id(model_id),
+                    self.sysr.qa_by_id[metric_id], self.sysr.residues)
+            b.add(self.sysr.asym_units.get_by_id(label_asym_id_1),
+                  label_seq_id_1,
+                  self.sysr.asym_units.get_by_id(label_asym_id_2),
+                  label_seq_id_2, metric_value)
+            return
         model = self.sysr.models.get_by_id(model_id)
         asym1 = self.sysr.asym_units.get_by_id(label_asym_id_1)
-        residue1 = asym1.residue(label_seq_id_1)
+        residue1 = self.sysr.residues.get(asym1, label_seq_id_1)
         asym2 = self.sysr.asym_units.get_by_id(label_asym_id_2)
-        residue2 = asym2.residue(label_seq_id_2)
+        residue2 = self.sysr.residues.get(asym2, label_seq_id_2)
         metric_class = self.sysr.qa_by_id[metric_id]
         model.qa_metrics.append(metric_class(residue1, residue2, metric_value))
 
+    def finalize(self):
+        for b in self._builders.values():
+            b.model.qa_metrics.append(b.get_matrix())
+
 
 class _QAMetricFeatureHandler(Handler):
     category = '_ma_qa_metric_feature'
@@ -1180,9 +1438,14 @@ class _QAMetricDihedralHandler(Handler):
         self._metrics.append(qa)
 
     def finalize(self):
+        atom_map = self.sysr.atom_id_to_model_num
+        model_by_id = {}
         for m in self._metrics:
-            model_id = self.sysr.atom_id_to_model_num.get(m.atom_id_1)
-            model = self.sysr.models.get_by_id(model_id)
+            model_id = atom_map.get(m.atom_id_1)
+            model = model_by_id.get(model_id)
+            if model is None:
+                model = self.sysr.models.get_by_id(model_id)
+                model_by_id[model_id] = model
             model.qa_metrics.append(m)
 
 
@@ -1218,7 +1481,7 @@ class ModelCIFVariant(Variant):
         _TargetTemplatePolyMappingHandler,
         _AssemblyHandler, _AssemblyDetailsHandler, _AtomSiteHandler,
         ihm.reader._PolySeqSchemeHandler, ihm.reader._NonPolySchemeHandler,
-        ihm.reader._BranchSchemeHandler, ihm.reader._EntityBranchListHandler,
+        _BranchSchemeHandler, ihm.reader._EntityBranchListHandler,
         ihm.reader._BranchDescriptorHandler, ihm.reader._BranchLinkHandler,
         _ModelListHandler, _ModelGroupHandler, _ModelGroupLinkHandler,
         _ProtocolHandler, _AssociatedHandler, _AssociatedArchiveHandler,
@@ -1228,17 +1491,385 @@ class ModelCIFVariant(Variant):
         _QAMetricPairwiseHandler, _QAMetricFeatureHandler,
         _QAMetricFeaturePairwiseHandler, _QAMetricDihedralHandler]
 
+    #: If True, read per-residue and pairwise QA metrics into compact
+    #: tables. See :func:`read`.
+    compact_qa_metrics = False
+
+    #: If not None, only read these mmCIF categories. See :func:`read`.
+    include_categories = None
+
+    #: If not None, skip these mmCIF categories. See :func:`read`.
+    exclude_categories = None
+
+    def _get_handler_classes(self):
+        handlers = self._handlers
+        if self.include_categories is not None:
+            include = frozenset(c.lower() for c in self.include_categories)
+            handlers = [h for h in handlers if h.category in include]
+        if self.exclude_categories is not None:
+            exclude = frozenset(c.lower() for c in self.exclude_categories)
+            handlers = [h for h in handlers if h.category not in exclude]
+        return handlers
+
     def get_handlers(self, sysr):
-        return [h(sysr) for h in self._handlers]
+        sysr.compact_qa_metrics = self.compact_qa_metrics
+        return [h(sysr) for h in self._get_handler_classes()]
 
     def get_audit_conform_handler(self, sysr):
         return _AuditConformHandler(sysr)
 
 
+class HandlerProfile:
+    """Timing and memory information for a single handler, as part of a
+       :class:`ReadProfile`. Values are totals over all data blocks read."""
+    def __init__(self, name, category):
+        #: The name of the handler class
+        self.name = name
+        #: The mmCIF category handled
+        self.category = category
+        #: The number of rows (calls to the handler) processed
+        self.calls = 0
+        #: Time, in seconds, spent processing rows
+        self.call_time = 0.
+        #: Time, in seconds, spent in the handler's ``finalize`` method
+        self.finalize_time = 0.
+        #: Net memory, in bytes, allocated by the handler (and still in use
+        #: after each call), or None if memory was not traced
+        self.memory = None
+        #: Peak memory, in bytes, allocated during any single call to the
+        #: handler (or its ``finalize`` method), including memory that
+        #: was later freed, or None if memory was not traced. (On Python
+        #: 3.8, the peak cannot be reset between calls, so only memory
+        #: still in use at the end of each call is counted.)
+        self.peak_memory = None
+
+    total_time = property(lambda self: self.call_time + self.finalize_time,
+                          doc="Total time spent in this handler")
+
+
+# tracemalloc.reset_peak is only available in Python 3.9 or later
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+class ReadProfile:
+    """A report of where time (and optionally memory) was spent by
+       :func:`read`.
+
+       Create an object of this class and pass it as the `profile` argument
+       to :func:`read`; it will then be populated with information, e.g.::
+
+           profile = modelcif.reader.ReadProfile(trace_memory=True)
+           systems = modelcif.reader.read(fh, profile=profile)
+           print(profile.tokenize_time, profile.peak_memory)
+           for h in profile.slowest(5):
+               print(h.category, h.total_time, h.peak_memory)
+
+       :param bool trace_memory: If True, also track memory usage with
+              Python's :mod:`tracemalloc` module. This slows down reading
+              considerably.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        #: :class:`HandlerProfile` objects, one for each handler
+        self.handlers = []
+        #: Total time, in seconds, spent in :func:`read`
+        self.total_time = 0.
+        #: Peak memory, in bytes, used while reading, or None if memory
+        #: was not traced
+        self.peak_memory = None
+        self._by_name = {}
+        self._peak = 0
+
+    def _get_handler(self, handler):
+        name = type(handler).__module__ + '.' + type(handler).__name__
+        if name not in self._by_name:
+            p = self._by_name[name] = HandlerProfile(name, handler.category)
+            if self.trace_memory:
+                p.memory = p.peak_memory = 0
+            self.handlers.append(p)
+        return self._by_name[name]
+
+    tokenize_time = property(
+        lambda self: self.total_time - sum(h.total_time
+                                           for h in self.handlers),
+        doc="Time spent outside of handlers; this is mostly the time "
+            "taken to tokenize the file")
+
+    def _start_memory(self):
+        """Start measuring the memory used by a single handler call.
+           Return the memory in use at the start."""
+        current, peak = tracemalloc.get_traced_memory()
+        if _reset_peak:
+            # Keep track of the overall peak, since we are about to reset it
+            self._peak = max(self._peak, peak)
+            _reset_peak()
+        return current
+
+    def _end_memory(self, handler_profile, start):
+        """Record memory used by a single handler call"""
+        current, peak = tracemalloc.get_traced_memory()
+        if not _reset_peak:
+            # Without reset_peak, the traced peak is that of the whole read
+            peak = current
+        handler_profile.memory += current - start
+        handler_profile.peak_memory = max(handler_profile.peak_memory,
+                                          peak - start)
+
+    @contextlib.contextmanager
+    def _run(self):
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            if _reset_peak:
+                _reset_peak()
+            self._peak = 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.total_time += time.perf_counter() - start
+            if self.trace_memory:
+                peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+                self.peak_memory = max(self.peak_memory or 0, peak)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def slowest(self, n=None):
+        """Get the `n` (or all, if not given) :class:`HandlerProfile`
+           objects that took the most time, slowest first."""
+        return sorted(self.handlers, key=operator.attrgetter('total_time'),
+                      reverse=True)[:n]
+
+    def log(self, logger=None, level=logging.INFO):
+        """Report the profile to a Python logger.
+
+           :param logger: The logger to use; if not given, the
+                  ``modelcif.reader`` logger is used.
+           :type logger: :class:`logging.Logger`
+           :param int level: The logging level for the report.
+        """
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        for h in self.slowest():
+            if h.calls == 0 and h.total_time < 1e-3:
+                continue
+            logger.log(level, "%s: %d rows, %.3fs, finalize %.3fs%s",
+                       h.category, h.calls, h.call_time, h.finalize_time,
+                       "" if h.memory is None
+                       else ", memory %d bytes (peak %d bytes)"
+                       % (h.memory, h.peak_memory))
+        logger.log(level, "Total time %.3fs, tokenize %.3fs%s",
+                   self.total_time, self.tokenize_time,
+                   "" if self.peak_memory is None
+                   else ", peak memory %d bytes" % self.peak_memory)
+
+
+class _ProfilingHandler:
+    """Wrapper around a Handler which records time and memory used"""
+    def __init__(self, handler, profile):
+        # Make sure _keys etc. are populated from the handler's own
+        # __call__ method, rather than that of this wrapper
+        r = ihm.format._Reader()
+        r.category_handler = {handler.category: handler}
+        r._add_category_keys()
+        self._handler = handler
+        self._read_profile = profile
+        self._profile = profile._get_handler(handler)
+        self._trace_memory = profile.trace_memory
+
+    def __getattr__(self, name):
+        # Pass through category, _keys, etc.
+        return getattr(self._handler, name)
+
+    def __call__(self, *args, **keys):
+        p = self._profile
+        if self._trace_memory:
+            mem = self._read_profile._start_memory()
+        start = time.perf_counter()
+        try:
+            return self._handler(*args, **keys)
+        finally:
+            p.call_time += time.perf_counter() - start
+            p.calls += 1
+            if self._trace_memory:
+                self._read_profile._end_memory(p, mem)
+
+    def finalize(self):
+        p = self._profile
+        if self._trace_memory:
+            mem = self._read_profile._start_memory()
+        start = time.perf_counter()
+        try:
+            return self._handler.finalize()
+        finally:
+            p.finalize_time += time.perf_counter() - start
+            if self._trace_memory:
+                self._read_profile._end_memory(p, mem)
+
+
+class _ProfilingVariant:
+    """Wrapper around a Variant which profiles all of its handlers"""
+    def __init__(self, variant, handlers, profile):
+        self._variant, self._handlers, self._profile = \
+            variant, handlers, profile
+
+    def __getattr__(self, name):
+        # Pass through system_reader, etc.
+        return getattr(self._variant, name)
+
+    def get_handlers(self, sysr):
+        return [_ProfilingHandler(h, self._profile)
+                for h in self._variant.get_handlers(sysr)
+                + [h(sysr) for h in self._handlers]]
+
+    def get_audit_conform_handler(self, sysr):
+        return _ProfilingHandler(
+            self._variant.get_audit_conform_handler(sysr), self._profile)
+
+
+# Categories that are not read in, but are regenerated by modelcif.dumper
+# from other data, so there is no need to keep them as unknown categories.
+# (Any other unknown category that a dumper writes is skipped on output by
+# modelcif.dumper._UnknownCategoryDumper.)
+_regenerated_categories = frozenset(['_atom_type', '_audit_conform',
+                                     '_entry', '_ma_target_entity_instance'])
+
+
+class _RawHandler:
+    """Handler for the low-level reader that simply stores all rows of
+       a category as raw strings"""
+    not_in_file = omitted = None
+    unknown = ihm.unknown
+    _int_keys = _float_keys = _bool_keys = frozenset()
+
+    def __init__(self, category, keys):
+        self.category = category
+        self._keys = keys
+        self.rows = []
+
+    def __call__(self, *args):
+        self.rows.append(args)
+
+
+class _UnknownCategoryReader:
+    """Read all categories not in `known` from the file handle `fh`, as
+       lists of :class:`modelcif.UnknownCategory` objects, one list per
+       data block.
+
+       Category names and keywords can only be determined by reading
+       the file, so the (C-accelerated) low-level reader is run up to three
+       times: once to find unknown category names, once to find their
+       keywords, and once to read the data."""
+
+    _reader_map = {'mmCIF': ihm.format.CifReader,
+                   'BCIF': ihm.format_bcif.BinaryCifReader}
+
+    def __init__(self, fh, format, known):
+        self.fh, self.format, self.known = fh, format, known
+        self._start = fh.tell()
+
+    def _read_blocks(self, handlers_for_block, **kwargs):
+        """Read every data block in the file, using the handlers returned
+           by `handlers_for_block(block_index)`"""
+        self.fh.seek(self._start)
+        r = self._reader_map[self.format](self.fh, {}, **kwargs)
+        block = 0
+        while True:
+            r.category_handler = handlers_for_block(block)
+            more_data = r.read_file()
+            block += 1
+            if not more_data:
+                return
+
+    def read(self):
+        # Find the names of all unknown categories in each block, as
+        # a mapping from lowercase name to name as given in the file
+        names = []
+
+        def add_name(category, line):
+            if category.lower() not in self.known:
+                names[-1].setdefault(category.lower(), category)
+
+        def new_name_block(block):
+            names.append({})
+            return {}
+        self._read_blocks(new_name_block, unknown_category_handler=add_name)
+        if not any(names):
+            return [[] for _ in names]
+
+        # Get all keywords of each unknown category
+        keywords = [dict((c, {}) for c in block_names)
+                    for block_names in names]
+        current = []
+
+        def add_keyword(category, keyword, line):
+            current[0][category.lower()].setdefault(keyword.lower(), keyword)
+
+        def keyword_handlers(block):
+            current[:] = [keywords[block]]
+            return dict((c, _RawHandler(c, [])) for c in names[block])
+        self._read_blocks(keyword_handlers,
+                          unknown_keyword_handler=add_keyword)
+
+        # Finally, read the data
+        handlers = []
+
+        def data_handlers(block):
+            handlers.append(dict((c, _RawHandler(c, list(keywords[block][c])))
+                                 for c in names[block]))
+            return handlers[-1]
+        self._read_blocks(data_handlers)
+        return [[modelcif.UnknownCategory(
+                 names[block][c], list(keywords[block][c].values()),
+                 [list(row) for row in handlers[block][c].rows])
+                 for c in names[block]] for block in range(len(names))]
+
+
+def _add_unknown_categories(system, categories):
+    """Add the given :class:`modelcif.UnknownCategory` objects to the
+       system. If the system already has a category of the same name (e.g.
+       from another data block, with ``add_to_system``) and it has the same
+       keywords, the rows are merged, since a category can only appear once
+       in a data block. Otherwise, the new category is dropped with a
+       warning."""
+    existing = dict((c.name.lower(), c) for c in system.unknown_categories)
+    for cat in categories:
+        old = existing.get(cat.name.lower())
+        if old is None:
+            existing[cat.name.lower()] = cat
+            system.unknown_categories.append(cat)
+            continue
+        old_keys = [k.lower() for k in old.keywords]
+        new_keys = [k.lower() for k in cat.keywords]
+        if sorted(old_keys) != sorted(new_keys):
+            warnings.warn(
+                "Category %s has different keywords (%s) to the category "
+                "of the same name already in the system (%s), so cannot be "
+                "merged; skipping it" % (cat.name, ", ".join(cat.keywords),
+                                         ", ".join(old.keywords)))
+            continue
+        # Put values in the same order as the existing keywords
+        order = [new_keys.index(k) for k in old_keys]
+        old.rows.extend([row[i] for i in order] for row in cat.rows)
+
+
+def _read_unknown(fh, format, variant, handlers):
+    """Read all categories in `fh` not handled by the reader. See
+       :class:`_UnknownCategoryReader`."""
+    known = set(h.category for h in variant._handlers)
+    known |= set(h.category for h in handlers)
+    known |= _regenerated_categories
+    return _UnknownCategoryReader(fh, format, known).read()
+
+
 def read(fh, model_class=modelcif.model.Model, format='mmCIF', handlers=[],
          warn_unknown_category=False, warn_unknown_keyword=False,
          reject_old_file=False, variant=ModelCIFVariant,
-         add_to_system=None):
+         add_to_system=None, compact_qa_metrics=False,
+         include_categories=None, exclude_categories=None, profile=None,
+         keep_unknown=False):
     """Read data from the file handle `fh`.
 
        See :func:`ihm.reader.read` for more information. The function
@@ -1249,6 +1880,10 @@ def read(fh, model_class=modelcif.model.Model, format='mmCIF', handlers=[],
        in the file will be returned as that type, regardless of their type
        stated in the mmCIF file (e.g. homology model, ab initio model).
        (However, the ``model_type`` attribute will be set appropriately.)
+       The exception is :class:`modelcif.model.ArrayModel` itself; each
+       model is then an ArrayModel that is also a subclass of the type
+       stated in the file (e.g. :class:`modelcif.model.HomologyModel`),
+       and atoms are stored directly in its arrays.
 
        If the input file references any associated files, they will be
        listed in :attr:`modelcif.System.repositories`. The files will not be
@@ -1256,11 +1891,253 @@ def read(fh, model_class=modelcif.model.Model, format='mmCIF', handlers=[],
        this in Python; see the
        `associated files example <https://github.com/ihmwg/python-ma/blob/main/examples/associated.py>`_.
 
+       If ``compact_qa_metrics`` is True, per-residue QA metrics
+       (``_ma_qa_metric_local``) are stored in
+       :class:`modelcif.qa_metric.LocalMetricTable` objects and pairwise
+       QA metrics (``_ma_qa_metric_local_pairwise``) in
+       :class:`modelcif.qa_metric.PairwiseMatrix` objects (one per model
+       and metric) rather than as individual
+       :class:`modelcif.qa_metric.Local` or
+       :class:`modelcif.qa_metric.LocalPairwise` objects. This uses much
+       less memory for large models.
+
+       To speed up reading when only part of the file is needed, a list of
+       mmCIF category names (e.g. ``['_struct', '_software']``) can be given
+       as ``include_categories`` to read only those categories, and/or as
+       ``exclude_categories`` to skip the given categories (for example
+       ``['_atom_site', '_ma_qa_metric_local_pairwise']`` to skip
+       coordinates and PAE scores). Skipped categories are still tokenized
+       but no Python objects are created for them. Note that objects
+       normally created from a skipped category may still be created as
+       placeholders if referenced by another category that is read.
+       These options do not affect any extra ``handlers`` given.
+
+       If ``fh`` is a file handle opened in binary mode, gzip, bz2, xz or
+       zstd compressed input is detected and decompressed on the fly
+       (zstd needs Python 3.14 or later, or the ``zstandard`` package).
+       For example, an AlphaFold DB file can be read directly with
+       ``read(open('model.cif.gz', 'rb'))``.
+
+       To find out where time (and memory) is spent when reading, pass a
+       :class:`ReadProfile` object as ``profile``.
+
+       Normally, any data in the file that python-modelcif does not
+       understand (e.g. custom categories) is ignored. If ``keep_unknown``
+       is True, any such categories are instead stored in
+       :attr:`modelcif.System.unknown_categories` so that they are written
+       out again by :func:`modelcif.dumper.write`. This requires additional
+       passes over the file; if ``fh`` is not seekable, the file is first
+       read into memory. If ``add_to_system`` is also given, rows of
+       categories with the same name in multiple data blocks are merged
+       (or, if their keywords differ, only the first is kept, with a
+       warning).
+
       :return: A list of :class:`modelcif.System` objects.
     """  # noqa: E501
-    return ihm.reader.read(
-        fh, model_class=model_class, format=format, handlers=handlers,
-        warn_unknown_category=warn_unknown_category,
-        warn_unknown_keyword=warn_unknown_keyword,
-        reject_old_file=reject_old_file, variant=variant,
-        add_to_system=add_to_system)
+    if isinstance(variant, type):
+        variant = variant()
+    elif (compact_qa_metrics or include_categories is not None
+          or exclude_categories is not None):
+        # Don't modify the caller's variant object
+        variant = copy.copy(variant)
+    if compact_qa_metrics:
+        variant.compact_qa_metrics = True
+    if include_categories is not None:
+        variant.include_categories = include_categories
+    if exclude_categories is not None:
+        variant.exclude_categories = exclude_categories
+    with contextlib.ExitStack() as stack:
+        fh = stack.enter_context(modelcif.util._decompressed(fh, format))
+        if keep_unknown:
+            if not (hasattr(fh, 'seekable') and fh.seekable()):
+                fh = (io.BytesIO if format == 'BCIF'
+                      else io.StringIO)(fh.read())
+            start = fh.tell()
+            unknown_variant, unknown_handlers = variant, handlers
+        if profile is not None:
+            variant = _ProfilingVariant(variant, handlers, profile)
+            handlers = []
+            stack.enter_context(profile._run())
+        systems = ihm.reader.read(
+            fh, model_class=model_class, format=format, handlers=handlers,
+            warn_unknown_category=warn_unknown_category,
+            warn_unknown_keyword=warn_unknown_keyword,
+            reject_old_file=reject_old_file, variant=variant,
+            add_to_system=add_to_system)
+        if keep_unknown:
+            fh.seek(start)
+            unknown = _read_unknown(fh, format, unknown_variant,
+                                    unknown_handlers)
+            # Note that with add_to_system, the same System is returned
+            # for every data block
+            for s, cats in zip(systems, unknown):
+                _add_unknown_categories(s, cats)
+        return systems
+
+
+def _read_path(path, format, reduce, kwargs, errors='raise'):
+    """Read a single file for read_many()"""
+    try:
+        if format is None:
+            format = modelcif.util._get_format(path)
+        # Open in binary mode so that compressed files can be detected
+        with open(path, 'rb') as fh:
+            systems = read(fh, format=format, **kwargs)
+        return path, systems if reduce is None else reduce(systems)
+    except Exception as exc:
+        if errors == 'return':
+            return path, exc
+        raise
+
+
+def _read_many_pool(func, paths, processes, ordered, chunksize):
+    with multiprocessing.Pool(processes) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(func, paths, chunksize):
+            yield result
+
+
+def read_many(paths, processes=None, reduce=None, ordered=True,
+              format=None, chunksize=1, errors='raise', **kwargs):
+    """Read data from many files, in parallel.
+
+       Each file is read using :func:`read` in a pool of worker processes,
+       and results are yielded as they become available.
+
+       By default, the :class:`modelcif.System` objects read from each file
+       are passed back from the worker processes. This can be expensive
+       for large systems, so if only some information is needed, a
+       ``reduce`` function can be given instead. This is called in the
+       worker process with the list of :class:`modelcif.System` objects
+       read from each file and should return some smaller, picklable,
+       result (e.g. a validation report or index entry). This must be a
+       module-level function so that it can be sent to the workers.
+
+       :param paths: Names of the files to read.
+       :param int processes: The number of worker processes to use (by
+              default, the number of CPUs). If 1, files are read one by
+              one in the current process.
+       :param reduce: A function to call on the systems read from each file.
+       :param bool ordered: If True, yield results in the same order as
+              ``paths``; otherwise, yield them as soon as each is complete.
+       :param str format: The format of all of the files ('mmCIF' or 'BCIF').
+              If not specified, it is guessed from each file name
+              (files ending in .bcif, optionally followed by a compression
+              extension such as .gz, are assumed to be BinaryCIF).
+              Compressed files are detected automatically; see :func:`read`.
+       :param int chunksize: The number of files to send to each
+              worker at a time. Larger values may improve throughput for
+              many small files.
+       :param str errors: What to do if a file cannot be read (or
+              ``reduce`` fails). If 'raise' (the default), the exception
+              is raised and no further results are returned. If 'return',
+              the exception object is returned as the result for that
+              file, and the remaining files are still read.
+       :param kwargs: Any other arguments are passed to :func:`read`.
+       :return: An iterator over (path, result) tuples, where ``result``
+                is either the list of :class:`modelcif.System` objects
+                read from the file or the result of ``reduce`` on that list
+                (or an exception; see ``errors``).
+    """
+    if errors not in ('raise', 'return'):
+        raise ValueError("errors should be 'raise' or 'return', not %r"
+                         % errors)
+    func = functools.partial(_read_path, format=format, reduce=reduce,
+                             errors=errors, kwargs=kwargs)
+    if processes == 1:
+        return map(func, paths)
+    return _read_many_pool(func, paths, processes, ordered, chunksize)
+
+
+class Coordinates:
+    """Atomic coordinates of a single model, as returned by
+       :func:`read_coordinates`.
+
+       Per-atom data are stored in parallel sequences, one entry per atom
+       in the order they appear in the file.
+    """
+    def __init__(self, model_id):
+        #: Model number (``_atom_site.pdbx_PDB_model_num``), or None
+        self.model_id = model_id
+        #: Asym (chain) ID of each atom
+        self.asym_ids = []
+        #: Residue index of each atom, as an array of ints (-1 if not
+        #: provided, e.g. for non-polymers)
+        self.seq_ids = array.array('i')
+        #: Name of each atom (e.g. CA)
+        self.atom_ids = []
+        #: Element of each atom (e.g. C)
+        self.type_symbols = []
+        #: Cartesian coordinates, as a flat array of floats
+        #: (x1, y1, z1, x2, y2, z2, ...)
+        self.xyz = array.array('d')
+        #: Isotropic temperature factor of each atom, as an array
+        #: of floats (NaN if not provided)
+        self.biso = array.array('d')
+
+    def __len__(self):
+        return len(self.seq_ids)
+
+    def __repr__(self):
+        return "<%s(model_id=%r, %d atoms)>" % (
+            type(self).__name__, self.model_id, len(self))
+
+
+class _CoordinateHandler(Handler):
+    """Read _atom_site into :class:`Coordinates` objects only"""
+    category = '_atom_site'
+
+    def __init__(self):
+        super().__init__(None)
+        self.models = {}
+        # Share a single Python string for each distinct asym/atom/element
+        self._strings = {}
+
+    def __call__(self, pdbx_pdb_model_num, label_asym_id,
+                 label_seq_id: int, label_atom_id, type_symbol,
+                 cartn_x: float, cartn_y: float, cartn_z: float,
+                 b_iso_or_equiv: float):
+        coords = self.models.get(pdbx_pdb_model_num)
+        if coords is None:
+            coords = self.models[pdbx_pdb_model_num] = Coordinates(
+                pdbx_pdb_model_num)
+        strs = self._strings
+        coords.asym_ids.append(strs.setdefault(label_asym_id, label_asym_id))
+        coords.seq_ids.append(-1 if label_seq_id is None else label_seq_id)
+        coords.atom_ids.append(strs.setdefault(label_atom_id, label_atom_id))
+        coords.type_symbols.append(strs.setdefault(type_symbol, type_symbol))
+        coords.xyz.extend((cartn_x, cartn_y, cartn_z))
+        coords.biso.append(
+            math.nan if b_iso_or_equiv is None else b_iso_or_equiv)
+
+
+def read_coordinates(fh, format='mmCIF'):
+    """Read only atomic coordinates from the file handle `fh`.
+
+       This is much faster and uses much less memory than :func:`read`,
+       as only the ``_atom_site`` table is parsed and no
+       :class:`modelcif.System` or :class:`modelcif.model.Atom` objects
+       are created. It is intended for applications (such as structure
+       indexing) that only need the coordinates.
+
+       :param file fh: The file handle to read from. See :func:`read`.
+       :param str format: The format of the file. This can be 'mmCIF' (the
+              default) for the (text-based) mmCIF format or 'BCIF' for
+              BinaryCIF.
+       :return: A list, with one entry per data block in the file, of lists
+                of :class:`Coordinates` objects (one per model, in the
+                order they are encountered in the file).
+    """
+    reader_map = {'mmCIF': ihm.format.CifReader,
+                  'BCIF': ihm.format_bcif.BinaryCifReader}
+    with modelcif.util._decompressed(fh, format) as fh:
+        r = reader_map[format](fh, {})
+        blocks = []
+        while True:
+            h = _CoordinateHandler()
+            r.category_handler = {h.category: h}
+            more_data = r.read_file()
+            blocks.append(list(h.models.values()))
+            if not more_data:
+                break
+    return blocks
@@ -0,0 +1,317 @@
+"""Utility functions to quickly summarize mmCIF or BinaryCIF files.
+
+   Unlike :func:`modelcif.reader.read`, the functions here do not build
+   a :class:`modelcif.System`. Instead, they extract only the basic
+   metadata needed to, for example, build a search index over a large
+   collection of ModelCIF files.
+"""
+
+import collections
+import re
+import ihm
+import ihm.format
+import ihm.format_bcif
+import modelcif.util
+
+
+#: A reference to a target sequence in an external database, as stored in
+#: :attr:`Summary.target_references`.
+TargetReference = collections.namedtuple(
+    'TargetReference', ['entity_id', 'db_name', 'db_code', 'db_accession'])
+
+#: A single global QA metric value, as stored in
+#: :attr:`Summary.global_qa_metrics`.
+GlobalQAMetric = collections.namedtuple(
+    'GlobalQAMetric', ['model_id', 'name', 'type', 'value'])
+
+
+class Summary:
+    """Basic information about a ModelCIF file, as returned by :func:`scan`.
+    """
+    def __init__(self):
+        #: Entry ID (``_entry.id``)
+        self.entry_id = None
+        #: Title of the entry (``_struct.title``)
+        self.title = None
+        #: Mapping from entity ID to one-letter polymer sequence
+        self.sequences = {}
+        #: List of :data:`TargetReference` objects
+        self.target_references = []
+        #: List of model types (e.g. "Homology model"), one per model
+        self.model_types = []
+        #: List of :data:`GlobalQAMetric` objects
+        self.global_qa_metrics = []
+        #: List of URLs of associated files
+        self.associated_file_urls = []
+        #: True if the scan stopped at a per-residue or pairwise QA table
+        #: before every optional category (target references and
+        #: associated files) was seen. Any of these categories that
+        #: follow the QA tables in the file are then missing from the
+        #: summary.
+        self.truncated = False
+
+    num_models = property(lambda self: len(self.model_types),
+                          doc="The number of models in the file.")
+
+    def _get_uniprot_accessions(self):
+        return [r.db_accession for r in self.target_references
+                if r.db_name == 'UNP' and r.db_accession is not None]
+    uniprot_accessions = property(
+        _get_uniprot_accessions,
+        doc="Accessions of all UniProt target references.")
+
+
+class _Handler:
+    """Minimal handler for a single category, passed to the low-level
+       mmCIF or BinaryCIF reader"""
+    not_in_file = omitted = None
+    unknown = ihm.unknown
+    _int_keys = _float_keys = _bool_keys = frozenset()
+
+    def __init__(self, summary):
+        self.summary = summary
+
+
+class _EntryHandler(_Handler):
+    category = '_entry'
+    _keys = ['id']
+
+    def __call__(self, id):
+        self.summary.entry_id = id
+
+
+class _StructHandler(_Handler):
+    category = '_struct'
+    _keys = ['title']
+
+    def __call__(self, title):
+        self.summary.title = title
+
+
+class _EntityPolyHandler(_Handler):
+    category = '_entity_poly'
+    _keys = ['entity_id', 'pdbx_seq_one_letter_code_can']
+
+    def __call__(self, entity_id, seq):
+        if seq is not None and seq is not ihm.unknown:
+            seq = ''.join(seq.split())
+        self.summary.sequences[entity_id] = seq
+
+
+class _TargetRefDBHandler(_Handler):
+    category = '_ma_target_ref_db_details'
+    _keys = ['target_entity_id', 'db_name', 'db_code', 'db_accession']
+
+    def __call__(self, entity_id, db_name, db_code, db_accession):
+        self.summary.target_references.append(
+            TargetReference(entity_id, db_name, db_code, db_accession))
+
+
+class _ModelListHandler(_Handler):
+    category = '_ma_model_list'
+    _keys = ['model_type']
+
+    def __call__(self, model_type):
+        self.summary.model_types.append(model_type)
+
+
+class _QAMetricHandler(_Handler):
+    category = '_ma_qa_metric'
+    _keys = ['id', 'name', 'type']
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.metrics = {}
+
+    def __call__(self, id, name, type):
+        self.metrics[id] = (name, type)
+
+
+class _QAMetricGlobalHandler(_Handler):
+    category = '_ma_qa_metric_global'
+    _keys = ['model_id', 'metric_id', 'metric_value']
+    _float_keys = frozenset(['metric_value'])
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.values = []
+
+    def __call__(self, model_id, metric_id, metric_value):
+        self.values.append((model_id, metric_id, metric_value))
+
+
+class _AssociatedHandler(_Handler):
+    category = '_ma_entry_associated_files'
+    _keys = ['file_url']
+
+    def __call__(self, file_url):
+        self.summary.associated_file_urls.append(file_url)
+
+
+# Categories that modelcif.dumper writes after all of those needed for
+# the summary. Since some of the wanted categories are optional, reading
+# stops at the first of these once every non-optional category was seen.
+_late_categories = frozenset([
+    '_ma_qa_metric_local', '_ma_qa_metric_local_pairwise',
+    '_ma_qa_metric_feature', '_ma_qa_metric_feature_pairwise',
+    '_ma_qa_metric_dihedral'])
+
+# Wanted categories that are often not present in a file at all
+_optional_categories = frozenset([
+    '_ma_target_ref_db_details', '_ma_entry_associated_files'])
+
+
+class _EarlyStopFile:
+    """Pass through mmCIF text from a file handle, but signal end-of-file
+       at the start of the first category that follows all of the
+       wanted categories, the first of the `late` categories that follows
+       all wanted categories that are not `optional`, or the
+       start of the second data block, whichever comes first.
+       This allows the mmCIF reader to finish cleanly without
+       tokenizing the rest of the file."""
+
+    _chunk_size = 1024 * 1024
+
+    def __init__(self, fh, wanted, late=frozenset(), optional=frozenset()):
+        self._fh = fh
+        self._wanted = wanted
+        self._late = late
+        self._required = wanted - optional
+        self._seen = set()
+        #: True if we stopped at a late category without seeing every
+        #: wanted category
+        self.truncated = False
+        self._buffer = None
+        self._carry = None
+        self._done = False
+        self._in_text = False
+        self._in_block = False
+        self._category = None
+        self._regex = None
+
+    def _get_regex(self, chunk):
+        # Find text fields, data blocks, loops, and keywords at line start
+        pattern = r'^(;|data_|loop_|_[^.\s]+)'
+        if isinstance(chunk, bytes):
+            pattern = pattern.encode('ascii')
+        return re.compile(pattern, re.MULTILINE | re.IGNORECASE)
+
+    def _scan(self, chunk):
+        """Return the part of the chunk to pass to the reader"""
+        if self._regex is None:
+            self._regex = self._get_regex(chunk)
+        loop_start = None
+        for m in self._regex.finditer(chunk):
+            token = m.group(1)
+            if isinstance(token, bytes):
+                token = token.decode('ascii')
+            token = token.lower()
+            if token == ';':
+                self._in_text = not self._in_text
+            elif self._in_text:
+                continue
+            elif token == 'data_':
+                if self._in_block:
+                    self._done = True
+                    return chunk[:m.start()]
+                self._in_block = True
+            elif token == 'loop_':
+                loop_start = m.start()
+            else:
+                start = m.start() if loop_start is None else loop_start
+                loop_start = None
+                if token != self._category:
+                    self._category = token
+                    if token in self._wanted:
+                        self._seen.add(token)
+                    elif len(self._seen) == len(self._wanted):
+                        self._done = True
+                        return chunk[:start]
+                    elif (token in self._late
+                          and self._required.issubset(self._seen)):
+                        self._done = True
+                        self.truncated = True
+                        return chunk[:start]
+        if loop_start is not None and not self._done:
+            # We don't know the category of this loop yet, so hold it back
+            self._carry = chunk[loop_start:]
+            return chunk[:loop_start]
+        return chunk
+
+    def _read_chunk(self):
+        chunk = self._fh.read(self._chunk_size)
+        if chunk:
+            # Always end on a line boundary
+            chunk += self._fh.readline()
+        else:
+            self._done = True
+        if self._carry is not None:
+            chunk = self._carry + chunk
+            self._carry = None
+        return chunk
+
+    def _fill(self):
+        while not self._buffer and not self._done:
+            chunk = self._read_chunk()
+            self._buffer = self._scan(chunk) if chunk else chunk
+        return self._buffer
+
+    def read(self, size=-1):
+        buf = self._fill()
+        if size < 0:
+            size = len(buf)
+        ret, self._buffer = buf[:size], buf[size:]
+        return ret
+
+    def readline(self):
+        buf = self._fill()
+        nl = buf.find(b'\n' if isinstance(buf, bytes) else '\n')
+        size = len(buf) if nl < 0 else nl + 1
+        ret, self._buffer = buf[:size], buf[size:]
+        return ret
+
+
+def scan(fh, format='mmCIF'):
+    """Extract basic information from the file handle `fh`.
+
+       This is much faster than :func:`modelcif.reader.read`, as only a
+       handful of categories are parsed and no :class:`modelcif.System`
+       is created. For mmCIF files, reading stops as soon as all of the
+       needed categories have been seen. Since target references and
+       associated files are often absent, reading also stops at the first
+       per-residue or pairwise QA score category (which follow the global
+       scores in files written by python-modelcif) once all other needed
+       categories have been seen, so these potentially large tables are
+       not read at all; :attr:`Summary.truncated` is then set. Otherwise,
+       the file is read to the end.
+
+       Only the first data block in the file is read.
+
+       :param file fh: The file handle to read from.
+              See :func:`modelcif.reader.read`.
+       :param str format: The format of the file. This can be 'mmCIF' (the
+              default) for the (text-based) mmCIF format or 'BCIF' for
+              BinaryCIF.
+       :return: A summary of the file.
+       :rtype: :class:`Summary`
+    """
+    s = Summary()
+    hs = [h(s) for h in (_EntryHandler, _StructHandler, _EntityPolyHandler,
+                         _TargetRefDBHandler, _ModelListHandler,
+                         _QAMetricHandler, _QAMetricGlobalHandler,
+                         _AssociatedHandler)]
+    reader_map = {'mmCIF': ihm.format.CifReader,
+                  'BCIF': ihm.format_bcif.BinaryCifReader}
+    with modelcif.util._decompressed(fh, format) as fh:
+        if format == 'mmCIF':
+            fh = _EarlyStopFile(fh, frozenset(h.category for h in hs),
+                                _late_categories, _optional_categories)
+        r = reader_map[format](fh, dict((h.category, h) for h in hs))
+        r.read_file()
+        s.truncated = getattr(fh, 'truncated', False)
+
+    qa, qa_global = hs[5], hs[6]
+    for model_id, metric_id, value in qa_global.values:
+        name, typ = qa.metrics.get(metric_id, (None, None))
+        s.global_qa_metrics.append(GlobalQAMetric(model_id, name, typ, value))
+    return s
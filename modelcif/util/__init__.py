@@ -1 +1,171 @@
-pass
+"""Utility classes and functions"""
+
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+
+try:
+    from compression import zstd as _zstd  # Python 3.14 or later
+except ImportError:
+    _zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _open_zstd(fh, mode):
+    if _zstd is not None:
+        return _zstd.ZstdFile(fh, mode)
+    elif zstandard is not None:
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(
+                fh, closefd=False)
+        else:
+            return zstandard.ZstdCompressor().stream_writer(
+                fh, closefd=False)
+    else:
+        raise ValueError("zstd compression requires Python 3.14 or later, "
+                         "or the zstandard package")
+
+
+# Functions to wrap a binary file handle with a (de)compressor; the
+# underlying file handle is not closed when the wrapper is closed
+_compressors = {
+    'gzip': lambda fh, mode: gzip.GzipFile(fileobj=fh, mode=mode),
+    'bz2': bz2.BZ2File,
+    'xz': lzma.LZMAFile,
+    'zstd': _open_zstd}
+
+_compression_magic = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'),
+                      (b'\xfd7zXZ\x00', 'xz'), (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+_compression_extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz',
+                           '.zst': 'zstd'}
+
+
+def _get_compression(path):
+    """Guess the compression type from a file name, or return None"""
+    for ext, compression in _compression_extensions.items():
+        if path.endswith(ext):
+            return compression
+
+
+def _read_import_umask():
+    # os.umask can only be read by setting it, which is not thread-safe,
+    # so do this only once, at import time
+    umask = os.umask(0o22)
+    os.umask(umask)
+    return umask
+
+
+_import_umask = _read_import_umask()
+
+
+def _get_umask():
+    """Get the current umask, without changing it if possible"""
+    try:
+        # Available on Linux 4.7 or later
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return _import_umask
+
+
+def _set_default_mode(path):
+    """Give a file created by :func:`tempfile.mkstemp` (which is only
+       readable by its owner) the permissions that a file created with
+       :func:`open` would have, respecting the umask"""
+    os.chmod(path, 0o666 & ~_get_umask())
+
+
+def _get_format(path):
+    """Guess the format ('mmCIF' or 'BCIF') from a file name"""
+    path = os.fspath(path)
+    for ext in _compression_extensions:
+        if path.endswith(ext):
+            path = path[:-len(ext)]
+            break
+    return 'BCIF' if path.endswith('.bcif') else 'mmCIF'
+
+
+def _peek(fh, size):
+    """Get the first bytes from a binary file handle without consuming them,
+       or None if this is not possible (e.g. for text file handles)"""
+    if isinstance(fh, io.TextIOBase):
+        return None
+    if hasattr(fh, 'peek'):
+        return fh.peek(size)[:size]
+    if hasattr(fh, 'seekable') and fh.seekable():
+        pos = fh.tell()
+        data = fh.read(size)
+        fh.seek(pos)
+        return data
+
+
+@contextlib.contextmanager
+def _decompressed(fh, format):
+    """Context manager which yields a file handle suitable for reading
+       `format` ('mmCIF' or 'BCIF') data. If `fh` is a binary file handle
+       for gzip, bz2, xz or zstd compressed data, it is decompressed on
+       the fly. Binary file handles are also converted to text for mmCIF.
+       `fh` itself is not closed."""
+    head = _peek(fh, 6)
+    if head is None or not isinstance(head, bytes):
+        yield fh
+        return
+    cfh = None
+    for magic, compression in _compression_magic:
+        if head.startswith(magic):
+            cfh = _compressors[compression](fh, 'rb')
+            break
+    inner = fh if cfh is None else cfh
+    tfh = io.TextIOWrapper(inner, encoding='utf-8') \
+        if format == 'mmCIF' else None
+    try:
+        yield inner if tfh is None else tfh
+    finally:
+        if tfh is not None:
+            tfh.detach()
+        if cfh is not None:
+            cfh.close()
+
+
+@contextlib.contextmanager
+def _compressed(fh, format, compression):
+    """Context manager which yields a file handle suitable for writing
+       `format` ('mmCIF' or 'BCIF') data that is compressed on the fly
+       to the binary file handle `fh`. If `compression` is None, it is
+       guessed from the name of the file (if any). `fh` itself is
+       not closed."""
+    if compression is None:
+        name = getattr(fh, 'name', None)
+        # Only guess for plain files, not (e.g.) an already-open GzipFile
+        if isinstance(fh, (io.BufferedWriter, io.FileIO)) \
+                and isinstance(name, str):
+            compression = _get_compression(name)
+    if compression is None:
+        yield fh
+        return
+    if compression not in _compressors:
+        raise ValueError("Unknown compression type %s; supported types "
+                         "are %s" % (compression, ", ".join(_compressors)))
+    if isinstance(fh, io.TextIOBase):
+        raise ValueError("Compressed output requires a file handle "
+                         "opened in binary mode")
+    cfh = _compressors[compression](fh, 'wb')
+    tfh = io.TextIOWrapper(cfh, encoding='utf-8') \
+        if format == 'mmCIF' else None
+    try:
+        yield cfh if tfh is None else tfh
+    finally:
+        if tfh is not None:
+            tfh.flush()
+            tfh.detach()
+        cfh.close()
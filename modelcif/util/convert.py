@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+"""
+Convert ModelCIF files between mmCIF and BinaryCIF formats.
+
+Given any number of files and/or directories as input, this script will
+convert every mmCIF or BinaryCIF file found (searching directories
+recursively) to the requested format, optionally compressing the output
+with gzip, bz2, xz or zstd. Input files may themselves be compressed.
+Files are converted in parallel using a pool of worker processes.
+
+Outputs that already exist and are newer than the corresponding input are
+skipped, so an interrupted batch can simply be rerun. Inputs that are
+already in the requested format and compression (such as the outputs of
+a previous run, if written alongside the inputs) are also skipped. A file
+that cannot be converted is reported but does not stop the rest of the
+batch.
+
+As with make_mmcif.py, each file is read in with python-modelcif and then
+written out again, so any data in the input file that is not understood by
+python-modelcif will be lost on output.
+"""
+
+
+import modelcif.reader
+import modelcif.dumper
+import modelcif.util
+import argparse
+import collections
+import functools
+import multiprocessing
+import os
+import sys
+import tempfile
+
+
+#: The result of converting a single file, as yielded by :func:`convert`.
+#: ``status`` is one of 'converted', 'skipped' (the output was already up
+#: to date) or 'failed', in which case ``error`` describes the problem.
+ConversionResult = collections.namedtuple(
+    'ConversionResult', ['input', 'output', 'status', 'error'])
+
+_format_extensions = {'mmCIF': '.cif', 'BCIF': '.bcif'}
+
+
+def _strip_extension(path):
+    """Remove any compression and mmCIF/BinaryCIF extension from path"""
+    for ext in modelcif.util._compression_extensions:
+        if path.endswith(ext):
+            path = path[:-len(ext)]
+            break
+    for ext in _format_extensions.values():
+        if path.endswith(ext):
+            return path[:-len(ext)], True
+    return path, False
+
+
+def _is_input_file(path):
+    return _strip_extension(path)[1]
+
+
+def _find_inputs(paths):
+    """Yield (path, root) for all input files. root is the directory that
+       the file was found in (used to preserve the directory tree in the
+       output) or None for files given explicitly."""
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for fname in sorted(filenames):
+                    if _is_input_file(fname):
+                        yield os.path.join(dirpath, fname), path
+        else:
+            yield path, None
+
+
+def get_output_path(path, format='BCIF', compression=None, output_dir=None,
+                    root=None):
+    """Get the name of the file that `path` should be converted to.
+
+       The extension of `path` is replaced with one suitable for `format`
+       and `compression`. If `output_dir` is given, the output is placed in
+       that directory, otherwise alongside the input. If `root` is also
+       given, the path of the input relative to `root` is preserved.
+    """
+    base = _strip_extension(path)[0]
+    ext = _format_extensions[format]
+    if compression is not None:
+        ext += dict((v, k) for (k, v)
+                    in modelcif.util._compression_extensions.items()
+                    )[compression]
+    if output_dir is not None:
+        if root is None:
+            base = os.path.basename(base)
+        else:
+            base = os.path.relpath(base, root)
+        base = os.path.join(output_dir, base)
+    return base + ext
+
+
+def _is_up_to_date(inp, out):
+    try:
+        return os.stat(out).st_mtime >= os.stat(inp).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def convert_file(inp, out, format='BCIF', compression=None):
+    """Convert a single file.
+
+       The input format is guessed from the name of the input file, and
+       compressed input is detected automatically.
+       The output is written first to a temporary file which is then
+       renamed, so an interrupted conversion never leaves a partial
+       output file behind.
+
+       :param str inp: The name of the input file.
+       :param str out: The name of the output file.
+       :param str format: The output format ('mmCIF' or 'BCIF').
+       :param str compression: If given, compress the output ('gzip',
+              'bz2', 'xz' or 'zstd').
+    """
+    if os.path.exists(out) and os.path.samefile(inp, out):
+        raise ValueError("Input and output are the same file")
+    systems = modelcif.reader._read_path(inp, None, None, {})[1]
+    outdir = os.path.dirname(out)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=outdir or '.', suffix='.tmp')
+    binary = format == 'BCIF' or compression is not None
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as fh:
+            modelcif.dumper.write(fh, systems, format=format,
+                                  compression=compression)
+        modelcif.util._set_default_mode(tmpname)
+        os.replace(tmpname, out)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def _convert_job(job, format, compression, force):
+    """Convert a single file in a worker process, catching any errors"""
+    inp, out = job
+    try:
+        # An input that is already in the requested format (e.g. the
+        # output of a previous run) is its own output, so needs no work
+        if os.path.exists(out) and os.path.samefile(inp, out):
+            return ConversionResult(inp, out, 'skipped', None)
+        if not force and _is_up_to_date(inp, out):
+            return ConversionResult(inp, out, 'skipped', None)
+        convert_file(inp, out, format, compression)
+    except Exception as exc:
+        return ConversionResult(inp, out, 'failed',
+                                "%s: %s" % (type(exc).__name__, exc))
+    return ConversionResult(inp, out, 'converted', None)
+
+
+def _convert_pool(func, jobs, processes, chunksize):
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(func, jobs, chunksize):
+            yield result
+
+
+def convert(paths, format='BCIF', compression=None, output_dir=None,
+            processes=None, force=False, chunksize=1):
+    """Convert many files, in parallel.
+
+       :param paths: Names of files and/or directories to convert.
+              Directories are searched recursively for files with
+              .cif or .bcif extensions (optionally followed by a
+              compression extension such as .gz).
+       :param str format: The output format ('mmCIF' or 'BCIF').
+       :param str compression: If given, compress the output ('gzip',
+              'bz2', 'xz' or 'zstd').
+       :param str output_dir: Directory in which to place the outputs,
+              preserving the directory structure of any input directories.
+              If not given, each output is placed alongside its input.
+       :param int processes: The number of worker processes to use (by
+              default, the number of CPUs). If 1, files are converted one
+              by one in the current process.
+       :param bool force: If True, convert files even if the output
+              already exists and is newer than the input.
+       :param int chunksize: The number of files to send to each
+              worker at a time.
+       :return: An iterator over :data:`ConversionResult` objects, one per
+                file, in the order the conversions complete.
+    """
+    if format not in _format_extensions:
+        raise ValueError("Unknown format %s; supported formats are %s"
+                         % (format, ", ".join(_format_extensions)))
+    if (compression is not None
+            and compression not in modelcif.util._compressors):
+        raise ValueError("Unknown compression type %s; supported types "
+                         "are %s" % (compression,
+                                     ", ".join(modelcif.util._compressors)))
+    jobs = ((inp, get_output_path(inp, format, compression, output_dir,
+                                  root))
+            for inp, root in _find_inputs(paths))
+    func = functools.partial(_convert_job, format=format,
+                             compression=compression, force=force)
+    if processes == 1:
+        return map(func, jobs)
+    return _convert_pool(func, jobs, processes, chunksize)
+
+
+def _read_file_list(fname):
+    fh = sys.stdin if fname == '-' else open(fname)
+    try:
+        return [line.strip() for line in fh if line.strip()]
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def get_args():
+    p = argparse.ArgumentParser(
+        description="Convert ModelCIF files between mmCIF and BinaryCIF "
+                    "formats.")
+    p.add_argument("inputs", metavar="input", nargs="*",
+                   help="input mmCIF or BinaryCIF file, or directory to "
+                        "search recursively for such files")
+    p.add_argument("-f", "--format", choices=sorted(_format_extensions),
+                   default="BCIF", help="output format (default: BCIF)")
+    p.add_argument("-c", "--compression",
+                   choices=sorted(modelcif.util._compressors),
+                   help="compress output files")
+    p.add_argument("-o", "--output-dir",
+                   help="directory in which to place output files "
+                        "(default: alongside each input file)")
+    p.add_argument("-j", "--jobs", type=int, default=None,
+                   help="number of worker processes (default: number "
+                        "of CPUs)")
+    p.add_argument("-l", "--file-list", metavar="FILE",
+                   help="file containing names of further inputs, one per "
+                        "line ('-' to read from standard input)")
+    p.add_argument("--force", action="store_true",
+                   help="convert files even if the output is up to date")
+    p.add_argument("-q", "--quiet", action="store_true",
+                   help="only report failures")
+    args = p.parse_args()
+    if args.file_list:
+        args.inputs.extend(_read_file_list(args.file_list))
+    if not args.inputs:
+        p.error("no input files given")
+    return args
+
+
+def main():
+    args = get_args()
+    counts = collections.Counter()
+    for r in convert(args.inputs, format=args.format,
+                     compression=args.compression,
+                     output_dir=args.output_dir, processes=args.jobs,
+                     force=args.force):
+        counts[r.status] += 1
+        if r.status == 'failed':
+            print("%s: FAILED: %s" % (r.input, r.error), file=sys.stderr)
+        elif not args.quiet:
+            print("%s -> %s (%s)" % (r.input, r.output, r.status))
+    if not args.quiet or counts['failed']:
+        print("%d converted, %d skipped, %d failed"
+              % (counts['converted'], counts['skipped'], counts['failed']),
+              file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,7 +10,9 @@ with the ModelCIF dictionary.
 This is done by simply reading in the original file with python-modelcif and
 then writing it out again, so
   a) any data in the input file that is not understood by python-modelcif
-     will be lost on output; and
+     will be lost on output (unless the --keep-unknown option is used,
+     in which case any categories that are not understood are copied
+     unchanged to the output); and
   b) input files that aren't compliant with the PDBx dictionary, or that
      contain syntax errors or other problems, may crash or otherwise confuse
      python-modelcif.
@@ -19,15 +21,36 @@ While a best effort is made, it is not guaranteed that the output file is
 valid. It is recommended that it is run through a validator such as
 examples/validate_mmcif.py and any errors corrected or reported as
 issues.
+
+Many files can be processed in parallel by giving input and output
+directories (or a manifest file listing input and output file names)
+rather than a single input file. Each successfully processed file is
+recorded in a completion log, so that if the run is interrupted, it can
+simply be restarted and will skip any files already done.
+
+For very large models, the --stream option avoids keeping all atoms in
+memory. The input is then read twice: first, all categories except
+_atom_site are read normally (for _atom_site, only the residues that
+have atoms are noted); then, while writing the output, _atom_site rows
+are copied straight from the input to the output.
 """
 
 
 import modelcif.reader
 import modelcif.dumper
 import modelcif.model
+import modelcif.util.convert
 import ihm.util
+import ihm.format
 import os
+import sys
+import time
 import argparse
+import contextlib
+import functools
+import itertools
+import multiprocessing
+import tempfile
 
 
 def add_modelcif_info(s):
@@ -49,56 +72,423 @@ def add_modelcif_info(s):
                     asym.entity.description = "target"
 
             model.not_modeled_residue_ranges.extend(
-                _get_not_modeled_residues(model))
+                model.compute_not_modeled_residue_ranges())
     return s
 
 
-def _get_not_modeled_residues(model):
-    """Yield NotModeledResidueRange objects for all residue ranges in the
-       Model that are not referenced by Atom objects"""
-    for assem in model.assembly:
-        asym = assem.asym if hasattr(assem, 'asym') else assem
-        if not asym.entity.is_polymeric():
-            continue
-        # Make a set of all residue indices of this asym "handled"
-        # by being modeled with Atom objects
-        handled_residues = set()
-        for atom in model._atoms:
-            if atom.asym_unit is asym:
-                handled_residues.add(atom.seq_id)
-        # Convert set to a list of residue ranges
-        handled_residues = ihm.util._make_range_from_list(
-            sorted(handled_residues))
-        # Return not-modeled for each non-handled range
-        for r in ihm.util._invert_ranges(handled_residues,
-                                         end=assem.seq_id_range[1],
-                                         start=assem.seq_id_range[0]):
-            yield modelcif.model.NotModeledResidueRange(asym, r[0], r[1])
+def _set_bit(bits, i):
+    """Set bit `i` in the bytearray `bits`, growing it if necessary"""
+    byte = i >> 3
+    if byte >= len(bits):
+        bits.extend(bytes(byte - len(bits) + 1))
+    bits[byte] |= 1 << (i & 7)
+
+
+def _get_bits(bits):
+    """Yield the indices of all set bits in the bytearray `bits`"""
+    for byte, val in enumerate(bits):
+        if val:
+            for i in range(8):
+                if val & (1 << i):
+                    yield (byte << 3) + i
+
+
+class _StreamedModel(modelcif.model.Model):
+    """A model that stores no atoms, only a bitset per asym of the
+       residue indices that have atoms"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._seq_id_bits = {}
+
+    def _get_modeled_seq_ids(self):
+        return dict((asym, set(_get_bits(bits)))
+                    for asym, bits in self._seq_id_bits.items())
+
+    def _get_other_details(self):
+        # This is a generic "other" model, like Model
+        return None
+
+    other_details = property(_get_other_details)
+
+
+class _StreamAtomSiteHandler(modelcif.reader._AtomSiteHandler):
+    """Note which residues have atoms in each model (see
+       :class:`_StreamedModel`) without creating any Atom objects"""
+
+    def __call__(self, pdbx_pdb_model_num, label_asym_id, label_seq_id: int,
+                 group_pdb, auth_seq_id, pdbx_pdb_ins_code, auth_asym_id,
+                 label_comp_id, id):
+        self.sysr.atom_id_to_model_num.add(id, pdbx_pdb_model_num)
+        seq_id = label_seq_id
+        model = self.sysr.models.get_by_id(pdbx_pdb_model_num)
+        if label_asym_id is None:
+            asym = self.sysr.asym_units.get_by_id(auth_asym_id)
+            self._missing_poly_sequence[asym][seq_id] = label_comp_id
+        else:
+            asym = self.sysr.asym_units.get_by_id(label_asym_id)
+        auth_seq_id = self.get_int_or_string(auth_seq_id)
+        if seq_id is None:
+            self._get_seq_id_from_auth(auth_seq_id, pdbx_pdb_ins_code, asym)
+        else:
+            bits = model._seq_id_bits.get(asym)
+            if bits is None:
+                bits = model._seq_id_bits[asym] = bytearray()
+            _set_bit(bits, seq_id)
+        if group_pdb not in (None, 'ATOM'):
+            self._missing_nonpoly_chem_comp[asym] = label_comp_id
+
+        # Note any residues that have different seq_id and auth_seq_id
+        if (auth_seq_id is not None and seq_id is not None and
+                (seq_id != auth_seq_id
+                 or pdbx_pdb_ins_code not in (None, ihm.unknown))):
+            if asym.auth_seq_id_map == 0:
+                asym.auth_seq_id_map = {}
+            asym.auth_seq_id_map[seq_id] = auth_seq_id, pdbx_pdb_ins_code
+
+
+class _AtomSiteCopier:
+    """Handler for the low-level mmCIF reader that copies each _atom_site
+       row, as-is, to an output loop. Only IDs (atom, model, asym,
+       entity) are changed to match those in the output file."""
+    category = '_atom_site'
+    not_in_file = omitted = None
+    unknown = ihm.unknown
+    _int_keys = _float_keys = _bool_keys = frozenset()
+    _keys = ['group_pdb', 'id', 'type_symbol', 'label_atom_id',
+             'label_alt_id', 'label_comp_id', 'label_seq_id', 'auth_seq_id',
+             'pdbx_pdb_ins_code', 'label_asym_id', 'cartn_x', 'cartn_y',
+             'cartn_z', 'occupancy', 'auth_asym_id', 'auth_comp_id',
+             'b_iso_or_equiv', 'pdbx_pdb_model_num']
+    # Output columns, as written by modelcif.dumper
+    _output_keys = ['group_PDB', 'id', 'type_symbol', 'label_atom_id',
+                    'label_alt_id', 'label_comp_id', 'label_seq_id',
+                    'auth_seq_id', 'pdbx_PDB_ins_code', 'label_asym_id',
+                    'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy',
+                    'label_entity_id', 'auth_asym_id', 'auth_comp_id',
+                    'B_iso_or_equiv', 'pdbx_PDB_model_num']
+
+    def __init__(self):
+        self.loop = None
+
+    def start(self, loop, models, asyms):
+        self.loop = loop
+        self.models, self.asyms = models, asyms
+        self.seen_types = {}
+        self.seen_asym_ids = {}
+        self.ordinal = itertools.count(1)
+
+    def __call__(self, group_pdb, id, type_symbol, label_atom_id,
+                 label_alt_id, label_comp_id, label_seq_id, auth_seq_id,
+                 pdbx_pdb_ins_code, label_asym_id, cartn_x, cartn_y,
+                 cartn_z, occupancy, auth_asym_id, auth_comp_id,
+                 b_iso_or_equiv, pdbx_pdb_model_num):
+        model = self.models[pdbx_pdb_model_num]
+        asym = self.asyms[auth_asym_id if label_asym_id is None
+                          else label_asym_id]
+        self.seen_types[type_symbol] = None
+        ids = self.seen_asym_ids.get(model)
+        if ids is None:
+            ids = self.seen_asym_ids[model] = set()
+        ids.add(asym._id)
+        self.loop.write(
+            group_PDB='ATOM' if group_pdb is None else group_pdb,
+            id=next(self.ordinal),
+            type_symbol=type_symbol, label_atom_id=label_atom_id,
+            label_alt_id=label_alt_id, label_comp_id=label_comp_id,
+            label_seq_id=label_seq_id,
+            auth_seq_id=label_seq_id if auth_seq_id is None else auth_seq_id,
+            pdbx_PDB_ins_code=pdbx_pdb_ins_code,
+            label_asym_id=asym._id, Cartn_x=cartn_x, Cartn_y=cartn_y,
+            Cartn_z=cartn_z, occupancy=occupancy,
+            label_entity_id=asym.entity._id, auth_asym_id=asym.strand_id,
+            auth_comp_id=label_comp_id if auth_comp_id is None
+            else auth_comp_id,
+            B_iso_or_equiv=b_iso_or_equiv, pdbx_PDB_model_num=model._id)
+
+
+class _AtomSiteSource:
+    """Read _atom_site rows from the input file, one data block at
+       a time, for :class:`_StreamModelDumper`"""
+
+    def __init__(self, fh):
+        self._copier = _AtomSiteCopier()
+        self._reader = ihm.format.CifReader(fh, {'_atom_site': self._copier})
+        self._ids = {}
+
+    def add_system(self, system):
+        """Remember the file IDs of all models and asyms in the system.
+           This must be called before the system is written out, as the
+           dumper assigns new IDs."""
+        models = dict((m._id, m) for g in system.model_groups for m in g)
+        asyms = dict((a._id, a) for a in system.asym_units)
+        self._ids[system] = (models, asyms)
+
+    def copy(self, system, loop):
+        """Copy all rows from the next data block to the loop.
+           Return a dict of all element names seen and a dict mapping
+           models to the set of asym IDs in that model."""
+        models, asyms = self._ids[system]
+        self._copier.start(loop, models, asyms)
+        self._reader.read_file()
+        return self._copier.seen_types, self._copier.seen_asym_ids
+
+
+class _StreamModelDumper(modelcif.dumper._ModelDumper):
+    """Write _atom_site by copying rows from the input file"""
+
+    def __init__(self, source):
+        super().__init__()
+        self._source = source
+
+    def dump_atoms(self, system, writer, add_ihm=False):
+        with writer.loop("_atom_site", _AtomSiteCopier._output_keys) as lp:
+            seen_types, seen_asym_ids = self._source.copy(system, lp)
+        for model, asym_ids in seen_asym_ids.items():
+            self._assembly_checker.add_model_asyms(model, asym_ids)
+        return seen_types
+
+
+class _StreamVariant(modelcif.dumper.ModelCIFVariant):
+    """ModelCIF output, but with _atom_site copied from the input file"""
+
+    def __init__(self, source):
+        self._source = source
+
+    def get_dumpers(self):
+        return [_StreamModelDumper(self._source)
+                if d is modelcif.dumper._ModelDumper else d()
+                for d in self._dumpers]
+
+
+def _write_streaming(input, fhout, keep_unknown):
+    """Add ModelCIF information to `input` and write to `fhout`, without
+       ever holding all of the atoms in memory"""
+    with open(input, 'rb') as fh:
+        systems = modelcif.reader.read(
+            fh, model_class=_StreamedModel,
+            exclude_categories=['_atom_site'],
+            handlers=[_StreamAtomSiteHandler], keep_unknown=keep_unknown)
+    with contextlib.ExitStack() as stack:
+        fh = stack.enter_context(open(input, 'rb'))
+        fh = stack.enter_context(modelcif.util._decompressed(fh, 'mmCIF'))
+        source = _AtomSiteSource(fh)
+        for s in systems:
+            source.add_system(s)
+        modelcif.dumper.write(fhout, [add_modelcif_info(s) for s in systems],
+                              variant=_StreamVariant(source))
+
+
+def process_file(input, output, stream=False, keep_unknown=False):
+    """Read the mmCIF file `input`, add ModelCIF information, and write
+       the result to `output`. The output is written first to a temporary
+       file which is then renamed, so a partial output file is never
+       left behind. If `stream` is True, atoms are copied directly from
+       input to output rather than being read into memory. If
+       `keep_unknown` is True, any categories not understood by
+       python-modelcif are copied to the output."""
+    if (os.path.exists(input) and os.path.exists(output)
+            and os.path.samefile(input, output)):
+        raise ValueError("Input and output are the same file")
+    if not stream:
+        systems = modelcif.reader._read_path(
+            input, 'mmCIF', None, {'keep_unknown': keep_unknown})[1]
+    outdir = os.path.dirname(output)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=outdir or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fhout:
+            if stream:
+                _write_streaming(input, fhout, keep_unknown)
+            else:
+                modelcif.dumper.write(
+                    fhout, [add_modelcif_info(s) for s in systems])
+        modelcif.util._set_default_mode(tmpname)
+        os.replace(tmpname, output)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def _batch_job(job, stream=False, keep_unknown=False):
+    """Process a single file in a worker process, catching any errors"""
+    input, output = job
+    try:
+        process_file(input, output, stream, keep_unknown)
+    except Exception as exc:
+        return input, output, "%s: %s" % (type(exc).__name__, exc)
+    return input, output, None
+
+
+def _get_directory_jobs(input_dir, output_dir):
+    """Get (input, output) pairs for all mmCIF files in a directory tree"""
+    for input, root in modelcif.util.convert._find_inputs([input_dir]):
+        if modelcif.util._get_format(input) == 'mmCIF':
+            yield input, modelcif.util.convert.get_output_path(
+                input, format='mmCIF', output_dir=output_dir, root=root)
+
+
+def _get_manifest_jobs(manifest):
+    """Get a list of (input, output) pairs from a manifest file.
+       The whole file is checked before any job is run, so that a
+       malformed line does not abort a batch part way through."""
+    jobs = []
+    with open(manifest) as fh:
+        for lineno, line in enumerate(fh, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                fields = [f.strip() for f in
+                          line.split('\t' if '\t' in line else None)]
+                if len(fields) != 2 or not all(fields):
+                    raise ValueError(
+                        "%s, line %d: expected an input and an output file "
+                        "name, separated by whitespace, but got %r"
+                        % (manifest, lineno, line))
+                jobs.append(tuple(fields))
+    return jobs
+
+
+def _read_completion_log(log):
+    """Get the set of all inputs already recorded as done in the log"""
+    try:
+        with open(log) as fh:
+            return frozenset(line.rstrip('\n').split('\t')[0]
+                             for line in fh)
+    except FileNotFoundError:
+        return frozenset()
+
+
+def run_batch(jobs, log, processes=None, out=None, stream=False,
+              keep_unknown=False):
+    """Process many files in parallel.
+
+       :param jobs: (input, output) file name pairs.
+       :param str log: Name of the completion log. Each successfully
+              processed input is appended to this file; inputs already
+              listed in the file are skipped.
+       :param int processes: The number of worker processes to use (by
+              default, the number of CPUs). If 1, files are processed one
+              by one in the current process.
+       :param out: File handle to write progress and a summary to
+              (by default, standard error).
+       :param bool stream: If True, copy atoms directly from input to
+              output rather than reading them into memory.
+       :param bool keep_unknown: If True, copy any categories not
+              understood by python-modelcif to the output.
+       :return: A list of (input, output, error) tuples for each file that
+                could not be processed.
+    """
+    if out is None:
+        out = sys.stderr
+    done = _read_completion_log(log)
+    all_jobs = list(jobs)
+    jobs = [job for job in all_jobs if job[0] not in done]
+    failures = []
+    start = time.time()
+    logdir = os.path.dirname(log)
+    if logdir:
+        os.makedirs(logdir, exist_ok=True)
+    with contextlib.ExitStack() as stack:
+        logfh = stack.enter_context(open(log, 'a'))
+        func = functools.partial(_batch_job, stream=stream,
+                                 keep_unknown=keep_unknown)
+        if processes == 1:
+            results = map(func, jobs)
+        else:
+            pool = stack.enter_context(multiprocessing.Pool(processes))
+            results = pool.imap_unordered(func, jobs)
+        for input, output, error in results:
+            if error is None:
+                # Record completion immediately, so that an interrupted
+                # run can be resumed
+                logfh.write("%s\t%s\n" % (input, output))
+                logfh.flush()
+            else:
+                failures.append((input, output, error))
+                print("%s: FAILED: %s" % (input, error), file=out)
+    elapsed = time.time() - start
+    processed = len(jobs) - len(failures)
+    print("%d processed, %d already done, %d failed in %.1f seconds "
+          "(%.1f files/second)"
+          % (processed, len(all_jobs) - len(jobs), len(failures), elapsed,
+             len(jobs) / elapsed if elapsed > 0. else 0.), file=out)
+    if failures:
+        print("Failed inputs:", file=out)
+        for input, output, error in failures:
+            print("  %s: %s" % (input, error), file=out)
+    return failures
 
 
 def get_args():
     p = argparse.ArgumentParser(
-        description="Add minimal ModelCIF-related tables to an mmCIF file.")
-    p.add_argument("input", metavar="input.cif", help="input mmCIF file name")
+        description="Add minimal ModelCIF-related tables to an mmCIF file, "
+                    "or to all mmCIF files in a directory.")
+    p.add_argument("input", metavar="input.cif", nargs="?",
+                   help="input mmCIF file name, or directory to search "
+                        "recursively for mmCIF files")
     p.add_argument("output", metavar="output.cif",
-                   help="output mmCIF file name",
-                   default="output.cif", nargs="?")
-    return p.parse_args()
+                   help="output mmCIF file name, or output directory if "
+                        "the input is a directory",
+                   default=None, nargs="?")
+    p.add_argument("-m", "--manifest",
+                   help="process the input and output file names listed "
+                        "in this file (one pair per line, separated by "
+                        "whitespace) rather than a single file")
+    p.add_argument("-j", "--jobs", type=int, default=None,
+                   help="number of worker processes in batch mode "
+                        "(default: number of CPUs)")
+    p.add_argument("-s", "--stream", action="store_true",
+                   help="copy atoms directly from input to output rather "
+                        "than reading them all into memory; use this for "
+                        "very large models")
+    p.add_argument("-k", "--keep-unknown", action="store_true",
+                   help="copy any categories in the input that are not "
+                        "understood by python-modelcif unchanged to "
+                        "the output")
+    p.add_argument("--log",
+                   help="completion log for batch mode; files already "
+                        "listed here are skipped (default: "
+                        "make_mmcif.log in the output directory, or "
+                        "the manifest name plus .log)")
+    args = p.parse_args()
+    if args.manifest:
+        if args.input:
+            p.error("input files cannot be given with --manifest")
+        if args.log is None:
+            args.log = args.manifest + '.log'
+    elif args.input is None:
+        p.error("an input file, directory, or --manifest is required")
+    elif os.path.isdir(args.input):
+        if args.output is None:
+            p.error("an output directory is required when the input "
+                    "is a directory")
+        if args.log is None:
+            args.log = os.path.join(args.output, 'make_mmcif.log')
+    elif args.output is None:
+        args.output = 'output.cif'
+    return args
 
 
 def main():
     args = get_args()
 
-    if (os.path.exists(args.input) and os.path.exists(args.output)
-            and os.path.samefile(args.input, args.output)):
-        raise ValueError("Input and output are the same file")
-
-    with open(args.input) as fh:
-        with open(args.output, 'w') as fhout:
-            modelcif.dumper.write(
-                fhout,
-                [add_modelcif_info(s) for s in modelcif.reader.read(fh)])
+    if args.manifest:
+        try:
+            jobs = _get_manifest_jobs(args.manifest)
+        except ValueError as exc:
+            print("make_mmcif: error: %s" % exc, file=sys.stderr)
+            return 2
+    elif os.path.isdir(args.input):
+        jobs = _get_directory_jobs(args.input, args.output)
+    else:
+        process_file(args.input, args.output, args.stream,
+                     args.keep_unknown)
+        return 0
+    failures = run_batch(jobs, args.log, args.jobs, stream=args.stream,
+                         keep_unknown=args.keep_unknown)
+    return 1 if failures else 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
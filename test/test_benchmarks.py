@@ -0,0 +1,60 @@
+import utils
+import os
+import unittest
+import sys
+import json
+import subprocess
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+import modelcif
+
+
+def get_benchmark_path(fname):
+    return os.path.join(TOPDIR, "benchmarks", fname)
+
+
+class Tests(unittest.TestCase):
+
+    @unittest.skipIf(msgpack is None, "BinaryCIF needs msgpack")
+    def test_benchmark(self):
+        """Test benchmark suite on a tiny synthetic system"""
+        with utils.temporary_directory() as tmpdir:
+            out = os.path.join(tmpdir, 'out.json')
+            subprocess.check_call(
+                [sys.executable, get_benchmark_path("benchmark.py"),
+                 "--residues", "10", "--chains", "2", "--template-atoms",
+                 "--alignments", "2", "--repeat", "1", "-o", out])
+            with open(out) as fh:
+                j = json.load(fh)
+            self.assertEqual(j['metadata']['python_modelcif_version'],
+                             modelcif.__version__)
+            r1, r2, qa = j['results']
+            self.assertEqual(r1['format'], 'mmCIF')
+            self.assertEqual(r2['format'], 'BCIF')
+            self.assertEqual(r1['parameters']['residues'], 10)
+            self.assertTrue(r1['parameters']['template_atoms'])
+            for r in r1, r2:
+                self.assertGreater(r['file_size'], 0)
+                self.assertGreater(r['write_time'], 0.)
+                self.assertGreater(r['read_peak_memory'], 0)
+            self.assertEqual(qa['benchmark'], 'qa_metric_dumper')
+            self.assertEqual(qa['parameters']['residues'], 10)
+            self.assertGreater(qa['finalize_time'], 0.)
+            self.assertGreater(qa['dump_time'], 0.)
+
+            # Compare against itself; no regression with a generous threshold
+            subprocess.check_call(
+                [sys.executable, get_benchmark_path("benchmark.py"),
+                 "--residues", "10", "--chains", "2", "--template-atoms",
+                 "--alignments", "2", "--repeat", "1", "--no-memory",
+                 "--compare", out, "--threshold", "1000",
+                 "-o", os.path.join(tmpdir, 'new.json')])
+
+
+if __name__ == '__main__':
+    unittest.main()
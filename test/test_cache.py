@@ -0,0 +1,86 @@
+import os
+import unittest
+import utils
+
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+import modelcif.cache
+
+
+def _write_cif(fname, entry_id):
+    with open(fname, 'w') as fh:
+        fh.write("data_model\n_struct.entry_id %s\n" % entry_id)
+
+
+class Tests(unittest.TestCase):
+    def test_read_cache(self):
+        """Test ReadCache.read"""
+        with utils.temporary_directory() as tmpdir:
+            cachedir = os.path.join(tmpdir, 'cache')
+            c = modelcif.cache.ReadCache(cachedir)
+            fname = os.path.join(tmpdir, 'test.cif')
+            _write_cif(fname, 'foo')
+            s, = c.read(fname)
+            self.assertEqual(s.id, 'foo')
+            entries = os.listdir(cachedir)
+            self.assertEqual(len(entries), 1)
+            # Second read should come from the cache
+            with open(os.path.join(cachedir, entries[0]), 'rb') as fh:
+                self.assertEqual(fh.read(2)[0], 0x80)
+            s, = c.read(fname)
+            self.assertEqual(s.id, 'foo')
+            self.assertEqual(len(os.listdir(cachedir)), 1)
+            # Different read arguments are cached separately
+            s, = c.read(fname, exclude_categories=['_software'])
+            self.assertEqual(len(os.listdir(cachedir)), 2)
+            # Modified file should not use cache
+            _write_cif(fname, 'bar')
+            s, = c.read(fname)
+            self.assertEqual(s.id, 'bar')
+            self.assertEqual(len(os.listdir(cachedir)), 3)
+            # Corrupt cache entries are ignored
+            for e in os.listdir(cachedir):
+                with open(os.path.join(cachedir, e), 'wb') as fh:
+                    fh.write(b'garbage')
+            s, = c.read(fname)
+            self.assertEqual(s.id, 'bar')
+            self.assertRaises(ValueError, c.read, fname, add_to_system=s)
+
+    def test_read_cache_lru(self):
+        """Test ReadCache removal of least recently used entries"""
+        with utils.temporary_directory() as tmpdir:
+            cachedir = os.path.join(tmpdir, 'cache')
+            c = modelcif.cache.ReadCache(cachedir)
+            fnames = []
+            for i in range(3):
+                fname = os.path.join(tmpdir, 'test%d.cif' % i)
+                _write_cif(fname, 'entry%d' % i)
+                fnames.append(fname)
+                c.read(fname)
+            size = max(os.stat(os.path.join(cachedir, e)).st_size
+                       for e in os.listdir(cachedir))
+            # Set modification times explicitly so that the test does
+            # not depend on filesystem timestamp resolution
+            c = modelcif.cache.ReadCache(cachedir, max_size=size * 2 + 10)
+            paths = []
+            for fname in fnames:
+                with open(fname, 'rb') as fh:
+                    key = c._get_key(fh.read(), {'format': 'mmCIF'})
+                path = os.path.join(cachedir, key + c._suffix)
+                self.assertTrue(os.path.exists(path))
+                paths.append(path)
+            os.utime(paths[0], (1000, 1000))
+            os.utime(paths[1], (100, 100))
+            os.utime(paths[2], (2000, 2000))
+            fname = os.path.join(tmpdir, 'test3.cif')
+            _write_cif(fname, 'entry3')
+            c.read(fname)
+            # Oldest entries should have been removed
+            self.assertFalse(os.path.exists(paths[1]))
+            self.assertFalse(os.path.exists(paths[0]))
+            self.assertTrue(os.path.exists(paths[2]))
+            self.assertEqual(len(os.listdir(cachedir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
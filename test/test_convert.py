@@ -0,0 +1,166 @@
+import utils
+import os
+import sys
+import gzip
+import shutil
+import unittest
+import subprocess
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+import modelcif.reader
+import modelcif.util.convert  # Script should also be importable
+
+
+CONVERT = os.path.join(TOPDIR, 'modelcif', 'util', 'convert.py')
+
+
+def _make_tree(tmpdir):
+    """Make a directory tree containing several input files"""
+    incif = utils.get_input_file_name(TOPDIR, 'struct_only.cif')
+    indir = os.path.join(tmpdir, 'in')
+    os.makedirs(os.path.join(indir, 'sub'))
+    shutil.copy(incif, os.path.join(indir, 'a.cif'))
+    with open(incif, 'rb') as fh:
+        with gzip.open(os.path.join(indir, 'sub', 'b.cif.gz'), 'wb') as fout:
+            fout.write(fh.read())
+    with open(os.path.join(indir, 'sub', 'bad.cif'), 'w') as fh:
+        fh.write("data_foo\n_entity.id 1\n;\nunterminated\n")
+    with open(os.path.join(indir, 'README.txt'), 'w') as fh:
+        fh.write("not a model\n")
+    return indir
+
+
+class Tests(unittest.TestCase):
+    def test_get_output_path(self):
+        """Test get_output_path function"""
+        g = modelcif.util.convert.get_output_path
+        self.assertEqual(g('foo.cif'), 'foo.bcif')
+        self.assertEqual(g('x/foo.cif.gz', format='mmCIF',
+                           compression='xz'), 'x/foo.cif.xz')
+        self.assertEqual(g('x/y/foo.bcif', format='mmCIF',
+                           output_dir='out'), 'out/foo.cif')
+        self.assertEqual(g('x/y/foo.bcif', format='mmCIF',
+                           output_dir='out', root='x'), 'out/y/foo.cif')
+
+    @unittest.skipIf(msgpack is None, "BinaryCIF needs msgpack")
+    def test_convert(self):
+        """Test convert function"""
+        with utils.temporary_directory() as tmpdir:
+            indir = _make_tree(tmpdir)
+            outdir = os.path.join(tmpdir, 'out')
+            res = sorted(modelcif.util.convert.convert(
+                [indir], output_dir=outdir, processes=1))
+            self.assertEqual([(os.path.relpath(r.output, outdir), r.status)
+                              for r in res],
+                             [('a.bcif', 'converted'),
+                              ('sub/b.bcif', 'converted'),
+                              ('sub/bad.bcif', 'failed')])
+            self.assertIsNone(res[0].error)
+            self.assertIsNotNone(res[2].error)
+            self.assertFalse(os.path.exists(res[2].output))
+            umask = os.umask(0o022)
+            os.umask(umask)
+            for r in res[:2]:
+                # Output should not be private to the user
+                self.assertEqual(os.stat(r.output).st_mode & 0o777,
+                                 0o666 & ~umask)
+                with open(r.output, 'rb') as fh:
+                    s, = modelcif.reader.read(fh, format='BCIF')
+                self.assertEqual(s.title[:16], 'Architecture of ')
+            # Outputs are now up to date, so should be skipped
+            res = sorted(modelcif.util.convert.convert(
+                [indir], output_dir=outdir, processes=2))
+            self.assertEqual([r.status for r in res],
+                             ['skipped', 'skipped', 'failed'])
+            # ... unless forced
+            res = sorted(modelcif.util.convert.convert(
+                [os.path.join(indir, 'a.cif')], output_dir=outdir,
+                processes=1, force=True))
+            self.assertEqual([r.status for r in res], ['converted'])
+
+    def test_convert_same_file(self):
+        """Test convert of a file that is already in the right format"""
+        with utils.temporary_directory() as tmpdir:
+            indir = _make_tree(tmpdir)
+            r, = modelcif.util.convert.convert(
+                [os.path.join(indir, 'a.cif')], format='mmCIF', processes=1)
+            self.assertEqual(r.status, 'skipped')
+            self.assertRaises(ValueError, modelcif.util.convert.convert_file,
+                              r.input, r.output, format='mmCIF')
+
+    @unittest.skipIf(msgpack is None, "BinaryCIF needs msgpack")
+    def test_convert_in_place_rerun(self):
+        """Test rerun of convert with outputs alongside inputs"""
+        with utils.temporary_directory() as tmpdir:
+            indir = _make_tree(tmpdir)
+            os.unlink(os.path.join(indir, 'sub', 'bad.cif'))
+            res = list(modelcif.util.convert.convert([indir], processes=1))
+            self.assertEqual([r.status for r in res],
+                             ['converted', 'converted'])
+            # Outputs of the first run are now picked up as inputs, but
+            # should not be converted or reported as failures
+            res = sorted(modelcif.util.convert.convert([indir],
+                                                       processes=1))
+            self.assertEqual([(os.path.relpath(r.input, indir), r.status)
+                              for r in res],
+                             [('a.bcif', 'skipped'), ('a.cif', 'skipped'),
+                              ('sub/b.bcif', 'skipped'),
+                              ('sub/b.cif.gz', 'skipped')])
+
+    def test_convert_bad_args(self):
+        """Test convert function with bad arguments"""
+        self.assertRaises(ValueError, modelcif.util.convert.convert,
+                          [], format='garbage')
+        self.assertRaises(ValueError, modelcif.util.convert.convert,
+                          [], compression='garbage')
+
+    def test_script(self):
+        """Test convert utility script"""
+        with utils.temporary_directory() as tmpdir:
+            indir = _make_tree(tmpdir)
+            outdir = os.path.join(tmpdir, 'out')
+            listfile = os.path.join(tmpdir, 'list')
+            with open(listfile, 'w') as fh:
+                fh.write(os.path.join(indir, 'sub', 'b.cif.gz') + '\n')
+            subprocess.check_call(
+                [sys.executable, CONVERT, '-q', '-f', 'mmCIF',
+                 '-c', 'gzip', '-o', outdir, '-l', listfile,
+                 os.path.join(indir, 'a.cif')])
+            for fname in ('a.cif.gz', 'b.cif.gz'):
+                with open(os.path.join(outdir, fname), 'rb') as fh:
+                    s, = modelcif.reader.read(fh)
+                self.assertEqual(s.title[:16], 'Architecture of ')
+            # Failure of one file should give a nonzero exit status
+            ret = subprocess.call(
+                [sys.executable, CONVERT, '-q', '-f', 'mmCIF', '-j', '2',
+                 '-o', outdir, indir], stderr=subprocess.DEVNULL)
+            self.assertEqual(ret, 1)
+            self.assertTrue(os.path.exists(
+                os.path.join(outdir, 'sub', 'b.cif')))
+
+    def test_bad_usage(self):
+        """Bad usage of convert utility script"""
+        ret = subprocess.call([sys.executable, CONVERT],
+                              stderr=subprocess.DEVNULL)
+        self.assertEqual(ret, 2)
+
+    def test_get_umask(self):
+        """Test reading the umask"""
+        old = os.umask(0o027)
+        try:
+            self.assertEqual(modelcif.util._get_umask() & 0o777,
+                             0o027 if os.path.exists('/proc/self/status')
+                             else modelcif.util._import_umask)
+            # umask should not have been changed
+            self.assertEqual(os.umask(0o027), 0o027)
+        finally:
+            os.umask(old)
+
+
+if __name__ == '__main__':
+    unittest.main()
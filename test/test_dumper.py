@@ -3,7 +3,7 @@ import warnings
 import utils
 import os
 import unittest
-from io import StringIO
+from io import StringIO, BytesIO
 try:
     import msgpack
 except ImportError:
@@ -417,6 +417,123 @@ _ma_qa_metric_dihedral.quality
 _ma_qa_metric_dihedral.smarts_pattern
 1 1 2 3 4 7 60.000 tolerable some-smarts
 #
+""")
+
+    def test_qa_metric_dumper_local_table(self):
+        """Test QAMetricDumper with LocalMetricTable"""
+        system = modelcif.System()
+
+        class MockObject:
+            pass
+
+        class LocalScore(modelcif.qa_metric.Local, modelcif.qa_metric.ZScore):
+            """custom local description"""
+            name = "custom local score"
+            software = None
+
+        class EmptyScore(modelcif.qa_metric.Local, modelcif.qa_metric.ZScore):
+            """empty score"""
+            software = None
+
+        e1 = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e1, 'foo')
+        asym._id = 'Z'
+        m1 = LocalScore(asym.residue(4), 10.)
+        t1 = modelcif.qa_metric.LocalMetricTable(LocalScore)
+        t1.add(asym, 2, 20.)
+        t1.add(asym, 3, 30.)
+        t2 = modelcif.qa_metric.LocalMetricTable(EmptyScore)
+        model = MockObject()
+        model._id = 18
+        model.qa_metrics = [t2, t1, m1]
+        mg = modelcif.model.ModelGroup((model,))
+        system.model_groups.append(mg)
+        dumper = modelcif.dumper._QAMetricDumper()
+        dumper.finalize(system)
+        out = _get_dumper_output(dumper, system)
+        self.assertEqual(out, """#
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.description
+_ma_qa_metric.type
+_ma_qa_metric.mode
+_ma_qa_metric.type_other_details
+_ma_qa_metric.software_group_id
+1 'custom local score' 'custom local description' zscore local . .
+#
+#
+loop_
+_ma_qa_metric_local.ordinal_id
+_ma_qa_metric_local.model_id
+_ma_qa_metric_local.label_asym_id
+_ma_qa_metric_local.label_seq_id
+_ma_qa_metric_local.label_comp_id
+_ma_qa_metric_local.metric_id
+_ma_qa_metric_local.metric_value
+1 18 Z 2 CYS 1 20.000
+2 18 Z 3 GLY 1 30.000
+3 18 Z 4 THR 1 10.000
+#
+""")
+
+    def test_qa_metric_dumper_pairwise_matrix(self):
+        """Test QAMetricDumper with PairwiseMatrix"""
+        system = modelcif.System()
+
+        class MockObject:
+            pass
+
+        class PairScore(modelcif.qa_metric.LocalPairwise,
+                        modelcif.qa_metric.PAE):
+            """custom pair description"""
+            name = "custom pair score"
+            software = None
+
+        e1 = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e1, 'foo')
+        asym._id = 'Z'
+        mat = modelcif.qa_metric.PairwiseMatrix(
+            PairScore, [asym.residue(1), asym.residue(3)])
+        mat[0, 1] = 1.0
+        mat[1, 0] = 2.0
+        mat[1, 1] = 3.0
+        empty = modelcif.qa_metric.PairwiseMatrix(PairScore, [])
+        model = MockObject()
+        model._id = 18
+        model.qa_metrics = [empty, mat]
+        mg = modelcif.model.ModelGroup((model,))
+        system.model_groups.append(mg)
+        dumper = modelcif.dumper._QAMetricDumper()
+        dumper.finalize(system)
+        out = _get_dumper_output(dumper, system)
+        self.assertEqual(out, """#
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.description
+_ma_qa_metric.type
+_ma_qa_metric.mode
+_ma_qa_metric.type_other_details
+_ma_qa_metric.software_group_id
+1 'custom pair score' 'custom pair description' PAE local-pairwise . .
+#
+#
+loop_
+_ma_qa_metric_local_pairwise.ordinal_id
+_ma_qa_metric_local_pairwise.model_id
+_ma_qa_metric_local_pairwise.label_asym_id_1
+_ma_qa_metric_local_pairwise.label_seq_id_1
+_ma_qa_metric_local_pairwise.label_comp_id_1
+_ma_qa_metric_local_pairwise.label_asym_id_2
+_ma_qa_metric_local_pairwise.label_seq_id_2
+_ma_qa_metric_local_pairwise.label_comp_id_2
+_ma_qa_metric_local_pairwise.metric_id
+_ma_qa_metric_local_pairwise.metric_value
+1 18 Z 1 ALA Z 3 GLY 1 1.000
+2 18 Z 3 GLY Z 1 ALA 1 2.000
+3 18 Z 3 GLY Z 3 GLY 1 3.000
+#
 """)
 
     def test_feature_dumper(self):
@@ -652,6 +769,59 @@ C
 #
 """)
 
+    def test_model_dumper_array_model(self):
+        """Test ModelDumper with ArrayModel"""
+        def make_system(model_class):
+            system = modelcif.System()
+            e1 = modelcif.Entity('ACGT')
+            e1._id = 9
+            system.entities.append(e1)
+            asym = modelcif.AsymUnit(e1, 'foo', auth_seq_id_map=10)
+            asym._id = 'A'
+            system.asym_units.append(asym)
+            asmb = modelcif.Assembly((asym,))
+            asmb._id = 2
+            model1 = model_class(assembly=asmb, name='model1')
+            model1._data_id = 42
+            model1.add_atom(modelcif.model.Atom(
+                asym_unit=asym, seq_id=1, atom_id='C', type_symbol='C',
+                x=1.0, y=2.0, z=3.0))
+            model1.add_atom(modelcif.model.Atom(
+                asym_unit=asym, seq_id=2, atom_id='CA', type_symbol='C',
+                x=4.0, y=5.0, z=6.0, het=True, biso=40., occupancy=0.5,
+                alt_id='A'))
+            # Regular model in the same system
+            model2 = modelcif.model.Model(assembly=asmb, name='model2')
+            model2._data_id = 43
+            model2.add_atom(modelcif.model.Atom(
+                asym_unit=asym, seq_id=4, atom_id='N', type_symbol='N',
+                x=7.0, y=8.0, z=9.0))
+            mg = modelcif.model.ModelGroup((model1, model2))
+            system.model_groups.append(mg)
+            return system, model1
+
+        system, model = make_system(modelcif.model.Model)
+        dumper = modelcif.dumper._ModelDumper()
+        dumper.finalize(system)
+        expected = _get_dumper_output(dumper, system)
+
+        system, model = make_system(modelcif.model.ArrayModel)
+        self.assertEqual(model.num_atoms, 2)
+        dumper = modelcif.dumper._ModelDumper()
+        dumper.finalize(system)
+        out = _get_dumper_output(dumper, system)
+        self.assertEqual(out, expected)
+        self.assertIn("HETATM 2 C CA A CYS 2 12 ? A 4.000 5.000 6.000 "
+                      "0.500 9 A CYS 40.000 1", out)
+
+        # Atoms are still checked against the assembly
+        model.add_atom(modelcif.model.Atom(
+            asym_unit=model.assembly[0], seq_id=10, atom_id='N',
+            type_symbol='N', x=7.0, y=8.0, z=9.0))
+        dumper = modelcif.dumper._ModelDumper()
+        dumper.finalize(system)
+        self.assertRaises(ValueError, _get_dumper_output, dumper, system)
+
     def test_poly_seq_scheme_dumper(self):
         """Test PolySeqSchemeDumper with ModelCIF models"""
         system = modelcif.System()
@@ -1288,6 +1458,135 @@ _ma_associated_archive_file_details.data_id
         self.assertIn('_audit_conform.dict_name', assoc_file)
         self.assertNotIn('_audit_conform.dict_name', main_file)
 
+    def test_write_associated_in_zip_archive(self):
+        """Test write() function with associated files written into a zip"""
+        import zipfile
+        s = modelcif.System(id='system1')
+
+        f = modelcif.associated.CIFFile(
+            path='assoc1.cif', categories=['struct'],
+            entry_details='test details', entry_id='testcif')
+        f2 = modelcif.associated.QAMetricsFile(
+            path='assoc2.cif', categories=['_AUDIT_CONFORM'],
+            entry_id='testcif2')
+        f3 = modelcif.associated.File(path='foo.txt', details='test file')
+        with utils.temporary_directory() as tmpdir:
+            zipname = os.path.join(tmpdir, 't.zip')
+            zf = modelcif.associated.ZipFile(path='t.zip',
+                                             files=[f, f2, f3],
+                                             local_path=zipname)
+            r = modelcif.associated.Repository(
+                url_root='https://example.com', files=[zf])
+            s.repositories.append(r)
+
+            fh = StringIO()
+            modelcif.dumper.write(fh, [s])
+            main_file = fh.getvalue()
+            # Associated files should not be written to the local disk
+            self.assertFalse(os.path.exists('assoc1.cif'))
+            self.assertEqual(os.listdir(tmpdir), ['t.zip'])
+            with zipfile.ZipFile(zipname) as z:
+                self.assertEqual(sorted(z.namelist()),
+                                 ['assoc1.cif', 'assoc2.cif'])
+                assoc1 = z.read('assoc1.cif').decode('utf-8')
+                assoc2 = z.read('assoc2.cif').decode('utf-8')
+        self.assertIn('_struct.title', assoc1)
+        self.assertNotIn('_struct.title', main_file)
+        self.assertIn('_audit_conform.dict_name', assoc2)
+        self.assertNotIn('_audit_conform.dict_name', main_file)
+        self.assertIn('t.zip', main_file)
+
+    def test_write_offload(self):
+        """Test write() function with an OffloadPolicy"""
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PLDDT):
+            """My score"""
+            software = None
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """My local score"""
+            software = None
+
+        s = modelcif.System(id='system1')
+        e = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e)
+        s.asym_units.append(asym)
+        m = modelcif.model.HomologyModel(assembly=modelcif.Assembly([asym]))
+        m.qa_metrics.append(MyScore(42.0))
+        m.qa_metrics.extend(MyLocalScore(asym.residue(i), 10.)
+                            for i in range(1, 5))
+        s.model_groups.append(modelcif.model.ModelGroup([m]))
+
+        with utils.temporary_directory() as tmpdir:
+            policy = modelcif.dumper.OffloadPolicy(
+                max_rows=3, url_root='https://example.com', binary=False,
+                local_dir=tmpdir)
+            fh = StringIO()
+            modelcif.dumper.write(fh, [s], offload=policy, check=False)
+            main_file = fh.getvalue()
+            with open(os.path.join(tmpdir, 'system1_qa.cif')) as fh:
+                assoc_file = fh.read()
+        # Repository should only be added while writing
+        self.assertEqual(s.repositories, [])
+        self.assertIn('https://example.com/system1_qa.cif', main_file)
+        self.assertNotIn('_ma_qa_metric_local.ordinal_id', main_file)
+        self.assertIn('_ma_qa_metric_global.ordinal_id', main_file)
+        self.assertIn('_ma_qa_metric_local.ordinal_id', assoc_file)
+
+        # No categories are large enough to offload
+        policy = modelcif.dumper.OffloadPolicy(max_rows=4)
+        fh = StringIO()
+        modelcif.dumper.write(fh, [s], offload=policy, check=False)
+        self.assertIn('_ma_qa_metric_local.ordinal_id', fh.getvalue())
+        self.assertNotIn('_ma_entry_associated_files', fh.getvalue())
+
+    def test_write_profile(self):
+        """Test write() function with a WriteProfile"""
+        class MyDumper(ihm.dumper.Dumper):
+            def dump(self, system, writer):
+                with writer.loop("_foo", ["bar"]) as lp:
+                    lp.write(bar=1)
+                    lp.write(bar=2)
+
+        s = modelcif.System(id='system1')
+        e = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e)
+        s.asym_units.append(asym)
+        m = modelcif.model.HomologyModel(assembly=modelcif.Assembly([asym]))
+        m.add_atom(modelcif.model.Atom(
+            asym_unit=asym, seq_id=1, atom_id='CA', type_symbol='C',
+            x=1.0, y=2.0, z=3.0))
+        m.add_atom(modelcif.model.Atom(
+            asym_unit=asym, seq_id=2, atom_id='CA', type_symbol='C',
+            x=1.0, y=2.0, z=3.0))
+        s.model_groups.append(modelcif.model.ModelGroup([m]))
+        profile = modelcif.dumper.WriteProfile()
+        fh = StringIO()
+        modelcif.dumper.write(fh, [s], dumpers=[MyDumper], profile=profile,
+                              check=False)
+        self.assertIn('_foo.bar', fh.getvalue())
+        self.assertIn('_atom_site.id', fh.getvalue())
+        names = [d.name for d in profile.dumpers]
+        self.assertEqual(names[0], 'ihm.dumper._EntryDumper')
+        self.assertIn('modelcif.dumper._QAMetricDumper', names)
+        self.assertTrue(names[-1].endswith('MyDumper'))
+        self.assertEqual(profile.dumpers[-1].rows, {'_foo': 2})
+        md, = [d for d in profile.dumpers if d.name.endswith('_ModelDumper')]
+        self.assertEqual(md.rows['_atom_site'], 2)
+        self.assertEqual(profile.categories['_atom_site'], 2)
+        self.assertEqual(profile.categories['_entry'], 1)
+        self.assertGreaterEqual(md.total_time, md.dump_time)
+        self.assertAlmostEqual(profile.total_time,
+                               sum(d.total_time for d in profile.dumpers),
+                               delta=1e-6)
+        slowest = profile.slowest(2)
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0].total_time,
+                                slowest[1].total_time)
+        with self.assertLogs('modelcif.dumper', level='INFO') as cm:
+            profile.log()
+        self.assertIn('_atom_site=2', "\n".join(cm.output))
+
     def test_write_associated_copy(self):
         """Test write() function with associated files, copy_categories"""
         s = modelcif.System(id='system1')
@@ -1621,6 +1920,138 @@ _struct_ref_seq_dif.details
         self.assertIn('_pdbx_entity_branch_descriptor.ordinal', output)
         self.assertIn('_pdbx_entity_branch_link.comp_id_1', output)
 
+    def test_stream_writer(self):
+        """Test StreamWriter class"""
+        import modelcif.reader
+
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PLDDT):
+            """My score"""
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """My local score"""
+            software = None
+
+        class MyFeatureScore(modelcif.qa_metric.Feature,
+                             modelcif.qa_metric.Energy):
+            """My feature score"""
+            software = None
+
+        def make_system():
+            s = modelcif.System(id='test_stream')
+            e = modelcif.Entity('ACG')
+            asym = modelcif.AsymUnit(e, id='A')
+            s.asym_units.append(asym)
+            soft = modelcif.Software(
+                name='test', classification='test', description='test',
+                location='test', type='program', version='1')
+            s.software_groups.append(soft)
+            MyScore.software = soft
+            return s, asym
+
+        def make_model(asym, n):
+            m = modelcif.model.HomologyModel(
+                assembly=modelcif.Assembly([asym]), name='model%d' % n)
+            for seq_id in range(1, 4):
+                m.add_atom(modelcif.model.Atom(
+                    asym_unit=asym, seq_id=seq_id, atom_id='CA',
+                    type_symbol='C', x=float(n), y=2.0, z=3.0))
+            m.qa_metrics.append(MyScore(float(n)))
+            m.qa_metrics.extend(MyLocalScore(asym.residue(i), float(i + n))
+                                for i in range(1, 4))
+            m.qa_metrics.append(MyFeatureScore(
+                modelcif.EntityInstanceFeature([asym]), float(n)))
+            return m
+
+        s, asym = make_system()
+        group = modelcif.model.ModelGroup(name='all models')
+        fh = StringIO()
+        with modelcif.dumper.StreamWriter(fh, s) as w:
+            for n in (1, 2):
+                w.add_model(make_model(asym, n), group)
+        self.assertEqual(len(group), 0)
+        out = fh.getvalue()
+        # Each category should occur only once
+        self.assertEqual(out.count('_atom_site.id'), 1)
+        self.assertEqual(out.count('_ma_qa_metric_local.ordinal_id'), 1)
+
+        # Result should be the same as writing all models at once
+        s2, asym2 = make_system()
+        s2.model_groups.append(modelcif.model.ModelGroup(
+            [make_model(asym2, n) for n in (1, 2)], name='all models'))
+        fh2 = StringIO()
+        modelcif.dumper.write(fh2, [s2])
+        for out in fh.getvalue(), fh2.getvalue():
+            rs, = modelcif.reader.read(StringIO(out))
+            rg, = rs.model_groups
+            self.assertEqual(rg.name, 'all models')
+            m1, m2 = rg
+            self.assertEqual([m1.name, m2.name], ['model1', 'model2'])
+            self.assertEqual([a.x for a in m2.get_atoms()], [2.0] * 3)
+            self.assertEqual([q.value for q in m2.qa_metrics],
+                             [2.0, 3.0, 4.0, 5.0, 2.0])
+            self.assertEqual(len(rs.software_groups), 1)
+            self.assertEqual([type(q).__name__ for q in m1.qa_metrics],
+                             ['MyScore'] + ['MyLocalScore'] * 3
+                             + ['MyFeatureScore'])
+
+    def test_stream_writer_errors(self):
+        """Test StreamWriter with invalid input"""
+        s = modelcif.System()
+        e = modelcif.Entity('ACG')
+        asym = modelcif.AsymUnit(e)
+        m = modelcif.model.HomologyModel(assembly=modelcif.Assembly([asym]))
+        s.model_groups.append(modelcif.model.ModelGroup([m]))
+        self.assertRaises(ValueError, modelcif.dumper.StreamWriter,
+                          StringIO(), s)
+
+        s = modelcif.System()
+        w = modelcif.dumper.StreamWriter(StringIO(), s)
+        # asym is not in the System
+        self.assertRaises(ValueError, w.add_model, m,
+                          modelcif.model.ModelGroup())
+
+    def test_write_compressed(self):
+        """Test write() function with compression"""
+        import gzip
+        import lzma
+        system = modelcif.System(id='system1')
+        fh = BytesIO()
+        modelcif.dumper.write(fh, [system], compression='gzip')
+        self.assertIn(b'data_system1', gzip.decompress(fh.getvalue()))
+        self.assertRaises(ValueError, modelcif.dumper.write, BytesIO(),
+                          [system], compression='foo')
+        self.assertRaises(ValueError, modelcif.dumper.write, StringIO(),
+                          [system], compression='gzip')
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.cif.xz')
+            # Compression should be guessed from the file extension
+            with open(fname, 'wb') as fh:
+                modelcif.dumper.write(fh, [system])
+            with open(fname, 'rb') as fh:
+                self.assertIn(b'data_system1', lzma.decompress(fh.read()))
+
+    def test_unknown_category_dumper(self):
+        """Test UnknownCategoryDumper"""
+        system = modelcif.System()
+        system.unknown_categories.extend([
+            modelcif.UnknownCategory('_my_vendor', ['id', 'note'],
+                                     [['42', 'two words']]),
+            modelcif.UnknownCategory('_other_vendor', ['a', 'b[1]'],
+                                     [['1', None], ['2', ihm.unknown]])])
+        dumper = modelcif.dumper._UnknownCategoryDumper()
+        out = _get_dumper_output(dumper, system)
+        self.assertEqual(out, """_my_vendor.id 42
+_my_vendor.note 'two words'
+#
+loop_
+_other_vendor.a
+_other_vendor.b[1]
+1 .
+2 ?
+#
+""")
+
 
 if __name__ == '__main__':
     unittest.main()
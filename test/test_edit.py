@@ -7,6 +7,10 @@ TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 utils.set_search_paths(TOPDIR)
 import modelcif.reader
 import modelcif.dumper
+import modelcif.edit
+import modelcif.qa_metric
+import ihm
+import datetime
 
 
 class Tests(unittest.TestCase):
@@ -145,6 +149,225 @@ ATOM 1 C CA . ALA 1 1 ? A 1.000 2.000 3.000 . 1 A . 1
         sout = io.StringIO()
         modelcif.dumper.write(sout, [s])
 
+    def _write_mini(self, tmpdir):
+        """Write test file using python-modelcif, so that IDs match"""
+        with open(utils.get_input_file_name(TOPDIR, 'mini.cif')) as fh:
+            s, = modelcif.reader.read(fh)
+        fname = os.path.join(tmpdir, 'mini.cif')
+        with open(fname, 'w') as fh:
+            modelcif.dumper.write(fh, [s])
+        return fname
+
+    def _edit_full(self, fname, func):
+        """Edit by reading and writing the entire file, for comparison"""
+        with open(fname) as fh:
+            systems = modelcif.reader.read(fh)
+        for s in systems:
+            func(s)
+        sout = io.StringIO()
+        modelcif.dumper.write(sout, systems)
+        return sout.getvalue()
+
+    def test_find_categories(self):
+        """Test find_categories()"""
+        cif = """# comment
+data_foo
+_entry.id foo
+_struct.title
+;Title with
+_fake.keyword
+loop_
+data_fake
+;
+_struct.pdbx_descriptor x
+#
+loop_
+_foo.a
+_foo.b
+1 2
+3 4
+#
+_bar.x 1
+data_two
+_entry.id two
+"""
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.cif')
+            with open(fname, 'w') as fh:
+                fh.write(cif)
+            ranges = modelcif.edit.find_categories(fname)
+            self.assertEqual([(r.block, r.name) for r in ranges],
+                             [(0, '_entry'), (0, '_struct'), (0, '_foo'),
+                              (0, '_bar'), (1, '_entry')])
+            self.assertEqual([cif[r.start:r.end] for r in ranges],
+                             ['_entry.id foo\n',
+                              cif[cif.index('_struct.title'):
+                                  cif.index('#\nloop_')],
+                              'loop_\n_foo.a\n_foo.b\n1 2\n3 4\n',
+                              '_bar.x 1\n', '_entry.id two\n'])
+
+            fname = os.path.join(tmpdir, 'test.bcif')
+            self.assertRaises(ValueError, modelcif.edit.find_categories,
+                              fname)
+            fname = os.path.join(tmpdir, 'test.cif.gz')
+            self.assertRaises(ValueError, modelcif.edit.find_categories,
+                              fname)
+
+    def test_find_categories_no_block(self):
+        """Test find_categories() with a category outside a data block"""
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.cif')
+            with open(fname, 'w') as fh:
+                fh.write("_entry.id foo\n")
+            self.assertRaises(ValueError, modelcif.edit.find_categories,
+                              fname)
+
+    def test_edit(self):
+        """Test edit() adding, changing and removing categories"""
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PTM):
+            """test score"""
+            software = None
+
+        def add_score_revision(s):
+            model = s.model_groups[0][0]
+            model.qa_metrics.append(MyScore(0.5))
+            s.revisions.append(ihm.Revision(
+                data_content_type='Structure model', major=1, minor=1,
+                date=datetime.date(2026, 1, 1)))
+
+        def change_score(s):
+            s.model_groups[0][0].qa_metrics[0].value = 0.75
+
+        def remove_revision(s):
+            del s.revisions[:]
+
+        categories = ['_ma_qa_metric', '_ma_qa_metric_global',
+                      '_pdbx_audit_revision_history']
+        with utils.temporary_directory() as tmpdir:
+            fname = self._write_mini(tmpdir)
+            with open(fname) as fh:
+                orig = fh.read()
+            for func in (add_score_revision, change_score, remove_revision):
+                expected = self._edit_full(fname, func)
+                modelcif.edit.edit(fname, categories, func)
+                with open(fname) as fh:
+                    self.assertEqual(fh.read(), expected)
+            with open(fname) as fh:
+                edited = fh.read()
+            self.assertNotIn('_pdbx_audit_revision_history', edited)
+            self.assertTrue(edited.endswith(
+                '_ma_qa_metric_global.metric_value\n1 1 1 0.750\n#\n'))
+
+            # Atoms should have been copied unchanged
+            def get_atoms(cif):
+                return cif[cif.index('loop_\n_atom_site'):
+                           cif.index('loop_\n_atom_type')]
+            self.assertEqual(get_atoms(edited), get_atoms(orig))
+
+    def test_edit_output(self):
+        """Test edit() of multiple blocks to a new output file"""
+        with utils.temporary_directory() as tmpdir:
+            fname = self._write_mini(tmpdir)
+            with open(fname) as fh:
+                orig = fh.read()
+            with open(fname, 'w') as fh:
+                fh.write(orig + orig.replace('data_model', 'data_model2'))
+            with open(fname) as fh:
+                orig = fh.read()
+            out = os.path.join(tmpdir, 'out.cif')
+            # Regenerating unchanged categories should not change the file
+            modelcif.edit.edit(fname, ['_struct', '_entity'], output=out)
+            with open(out) as fh:
+                self.assertEqual(fh.read(), orig)
+
+            def set_title(s):
+                s.title = 'New title'
+            modelcif.edit.edit(fname, ['_struct'], set_title, output=out)
+            with open(out) as fh:
+                edited = fh.read()
+            self.assertEqual(edited.count("_struct.title 'New title'"), 2)
+            self.assertEqual(edited,
+                             orig.replace("_struct.title .",
+                                          "_struct.title 'New title'"))
+
+    def test_edit_qa_tables(self):
+        """Test edit() of a file with per-residue QA metrics"""
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PTM):
+            """test score"""
+            software = None
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """test local score"""
+            software = None
+
+        def add_scores(s):
+            model = s.model_groups[0][0]
+            model.qa_metrics.append(MyScore(0.5))
+            asym = s.asym_units[0]
+            model.qa_metrics.extend(MyLocalScore(asym.residue(i), 10. * i)
+                                    for i in range(1, 5))
+
+        def change_score(s):
+            metric, table = s.model_groups[0][0].qa_metrics
+            # Per-residue scores are not being edited, so should have been
+            # read into a compact table
+            self.assertIsInstance(table, modelcif.qa_metric.LocalMetricTable)
+            metric.value = 0.75
+
+        def set_title(s):
+            # QA metrics are not being edited, so should not have been read
+            self.assertEqual(s.model_groups[0][0].qa_metrics, [])
+            s.title = 'New title'
+
+        with utils.temporary_directory() as tmpdir:
+            fname = self._write_mini(tmpdir)
+            modelcif.edit.edit(fname, ['_ma_qa_metric', '_ma_qa_metric_global',
+                                       '_ma_qa_metric_local'], add_scores)
+            with open(fname) as fh:
+                orig = fh.read()
+            self.assertIn('_ma_qa_metric_local.metric_value', orig)
+            modelcif.edit.edit(fname, ['_ma_qa_metric_global'], change_score)
+            with open(fname) as fh:
+                self.assertEqual(fh.read(),
+                                 orig.replace('1 1 1 0.500', '1 1 1 0.750'))
+            modelcif.edit.edit(fname, ['_struct'], set_title)
+            with open(fname) as fh:
+                self.assertEqual(fh.read(),
+                                 orig.replace('1 1 1 0.500', '1 1 1 0.750')
+                                 .replace("_struct.title .",
+                                          "_struct.title 'New title'"))
+
+    def test_edit_feature_tables(self):
+        """Test edit() of feature categories"""
+        class MyFeatureScore(modelcif.qa_metric.Feature,
+                             modelcif.qa_metric.Energy):
+            """test feature score"""
+            software = None
+
+        def add_scores(s):
+            model = s.model_groups[0][0]
+            f = modelcif.EntityInstanceFeature(s.asym_units)
+            model.qa_metrics.append(MyFeatureScore(f, 42.))
+
+        with utils.temporary_directory() as tmpdir:
+            fname = self._write_mini(tmpdir)
+            modelcif.edit.edit(fname, ['_ma_qa_metric',
+                                       '_ma_qa_metric_feature',
+                                       '_ma_feature_list',
+                                       '_ma_entity_instance_feature'],
+                               add_scores)
+            with open(fname) as fh:
+                orig = fh.read()
+            self.assertIn('_ma_feature_list.feature_id', orig)
+            self.assertIn('_ma_entity_instance_feature.feature_id', orig)
+            # Features are only reachable via QA metrics, so regenerating
+            # them without changes should leave the file unchanged
+            for cat in ('_ma_feature_list', '_ma_entity_instance_feature'):
+                modelcif.edit.edit(fname, [cat])
+                with open(fname) as fh:
+                    self.assertEqual(fh.read(), orig)
+
 
 if __name__ == '__main__':
     unittest.main()
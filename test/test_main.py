@@ -225,6 +225,73 @@ class Tests(unittest.TestCase):
         f = modelcif.Feature()
         self.assertIs(f._get_entity_type(), ihm.unknown)
 
+    def test_load_associated(self):
+        """Test System.load_associated()"""
+        import io
+        import zipfile
+        import modelcif.model
+        import modelcif.qa_metric
+        import modelcif.dumper
+        import modelcif.reader
+
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PLDDT):
+            """My score"""
+            software = None
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """My local score"""
+            software = None
+
+        s = modelcif.System(id='system1')
+        e = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e)
+        s.asym_units.append(asym)
+        m = modelcif.model.HomologyModel(assembly=modelcif.Assembly([asym]))
+        m.qa_metrics.append(MyScore(42.0))
+        m.qa_metrics.extend(MyLocalScore(asym.residue(i), 10.)
+                            for i in range(1, 5))
+        s.model_groups.append(modelcif.model.ModelGroup([m]))
+        with utils.temporary_directory() as tmpdir:
+            f = modelcif.associated.QAMetricsFile(
+                path='qa.cif', categories=['_ma_qa_metric_local'])
+            zf = modelcif.associated.ZipFile(
+                path='qa.zip', files=[f],
+                local_path=os.path.join(tmpdir, 'qa.zip'))
+            s.repositories.append(modelcif.associated.Repository(
+                url_root='https://example.com', files=[zf]))
+            fh = io.StringIO()
+            modelcif.dumper.write(fh, [s], check=False)
+            main_file = fh.getvalue()
+
+            def get_model():
+                rs, = modelcif.reader.read(io.StringIO(main_file))
+                rm, = rs.model_groups[0]
+                return rs, rm
+
+            rs, rm = get_model()
+            self.assertEqual(len(rm.qa_metrics), 1)
+            # Read from zip file in a directory, lazily
+            rs, rm = get_model()
+            rs.load_associated(tmpdir)
+            self.assertEqual(len(rm._qa_metrics), 1)
+            self.assertEqual(len(rm.qa_metrics), 5)
+            self.assertEqual(rs.id, 'system1')
+            # Read from zip file directly, immediately
+            rs, rm = get_model()
+            rs.load_associated(os.path.join(tmpdir, 'qa.zip'), lazy=False)
+            self.assertEqual(len(rm._qa_metrics), 5)
+            # Read from directory containing the extracted file
+            with zipfile.ZipFile(os.path.join(tmpdir, 'qa.zip')) as z:
+                z.extractall(os.path.join(tmpdir, 'extract'))
+            rs, rm = get_model()
+            rs.load_associated(os.path.join(tmpdir, 'extract'))
+            self.assertEqual(len(rm.qa_metrics), 5)
+            # Files that can't be found are ignored
+            rs, rm = get_model()
+            rs.load_associated(os.path.join(tmpdir, 'not-exist'))
+            self.assertEqual(len(rm.qa_metrics), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,7 @@
 import utils
 import os
 import sys
+import shutil
 import unittest
 import subprocess
 
@@ -30,6 +31,11 @@ class Tests(unittest.TestCase):
         incif = utils.get_input_file_name(TOPDIR, 'struct_only.cif')
         subprocess.check_call([sys.executable, MAKE_MMCIF, incif,
                                'non-default-output.cif'])
+        # Output should have the usual permissions, not be private
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertEqual(os.stat('non-default-output.cif').st_mode & 0o777,
+                         0o666 & ~umask)
         with open('non-default-output.cif') as fh:
             s, = modelcif.reader.read(fh)
         self.assertEqual(s.title,
@@ -92,6 +98,129 @@ B 2 2 GLU 2 ? ? ? B .
 """)
         os.unlink('output.cif')
 
+    def test_directory(self):
+        """Check make_mmcif directory mode with resume"""
+        incif = utils.get_input_file_name(TOPDIR, 'no_title.cif')
+        with utils.temporary_directory() as tmpdir:
+            indir = os.path.join(tmpdir, 'in')
+            outdir = os.path.join(tmpdir, 'out')
+            os.makedirs(os.path.join(indir, 'sub'))
+            shutil.copy(incif, os.path.join(indir, 'a.cif'))
+            shutil.copy(incif, os.path.join(indir, 'sub', 'b.cif'))
+            with open(os.path.join(indir, 'bad.cif'), 'w') as fh:
+                fh.write("data_foo\n_entity.id 1\n;\nunterminated\n")
+            p = subprocess.run([sys.executable, MAKE_MMCIF, '-j', '2',
+                                indir, outdir], stderr=subprocess.PIPE,
+                               universal_newlines=True)
+            self.assertEqual(p.returncode, 1)
+            self.assertIn('2 processed, 0 already done, 1 failed',
+                          p.stderr)
+            self.assertIn('bad.cif: CifParserError', p.stderr)
+            for fname in ('a.cif', os.path.join('sub', 'b.cif')):
+                with open(os.path.join(outdir, fname)) as fh:
+                    s, = modelcif.reader.read(fh)
+                self.assertEqual(s.title, 'Auto-generated system')
+            self.assertFalse(os.path.exists(os.path.join(outdir, 'bad.cif')))
+            with open(os.path.join(outdir, 'make_mmcif.log')) as fh:
+                self.assertEqual(len(fh.readlines()), 2)
+
+            # Rerun should skip files that were already done
+            os.unlink(os.path.join(indir, 'bad.cif'))
+            p = subprocess.run([sys.executable, MAKE_MMCIF, '-j', '1',
+                                indir, outdir], stderr=subprocess.PIPE,
+                               universal_newlines=True, check=True)
+            self.assertIn('0 processed, 2 already done, 0 failed',
+                          p.stderr)
+
+    def test_manifest(self):
+        """Check make_mmcif manifest mode"""
+        incif = utils.get_input_file_name(TOPDIR, 'no_title.cif')
+        with utils.temporary_directory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'manifest')
+            out1 = os.path.join(tmpdir, 'out1.cif')
+            out2 = os.path.join(tmpdir, 'out', 'out2.cif')
+            with open(manifest, 'w') as fh:
+                fh.write("# input output\n%s %s\n\n%s\t%s\n"
+                         % (incif, out1, incif, out2))
+            subprocess.check_call([sys.executable, MAKE_MMCIF, '-j', '1',
+                                   '--manifest', manifest],
+                                  stderr=subprocess.DEVNULL)
+            for fname in (out1, out2):
+                with open(fname) as fh:
+                    s, = modelcif.reader.read(fh)
+                self.assertEqual(s.title, 'Auto-generated system')
+            self.assertTrue(os.path.exists(manifest + '.log'))
+
+    def test_manifest_bad_line(self):
+        """Check make_mmcif manifest mode with a malformed line"""
+        incif = utils.get_input_file_name(TOPDIR, 'no_title.cif')
+        with utils.temporary_directory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'manifest')
+            out1 = os.path.join(tmpdir, 'out1.cif')
+            for bad in ("%s" % incif, "%s\t\t%s" % (incif, out1),
+                        "%s a b" % incif):
+                with open(manifest, 'w') as fh:
+                    fh.write("%s %s\n%s\n" % (incif, out1, bad))
+                p = subprocess.run([sys.executable, MAKE_MMCIF, '-j', '1',
+                                    '--manifest', manifest],
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+                self.assertEqual(p.returncode, 2)
+                self.assertIn('line 2: expected an input and an output',
+                              p.stderr)
+                # No jobs should have been run
+                self.assertFalse(os.path.exists(out1))
+
+    def test_batch_bad_usage(self):
+        """Bad usage of make_mmcif batch mode"""
+        with utils.temporary_directory() as tmpdir:
+            # Output directory is required
+            ret = subprocess.call([sys.executable, MAKE_MMCIF, tmpdir],
+                                  stderr=subprocess.DEVNULL)
+            self.assertEqual(ret, 2)
+            # Cannot give both input and manifest
+            ret = subprocess.call([sys.executable, MAKE_MMCIF, '-m', 'foo',
+                                   tmpdir], stderr=subprocess.DEVNULL)
+            self.assertEqual(ret, 2)
+
+    def test_stream(self):
+        """Check that streaming mode gives the same output"""
+        for name in ('not_modeled.cif', 'mini_branched.cif'):
+            incif = utils.get_input_file_name(TOPDIR, name)
+            with utils.temporary_directory() as tmpdir:
+                # Two data blocks
+                twoblock = os.path.join(tmpdir, 'in.cif')
+                with open(incif) as fh:
+                    contents = fh.read()
+                with open(twoblock, 'w') as fh:
+                    fh.write(contents + "\n" + contents.replace(
+                        "data_", "data_second", 1))
+                out = os.path.join(tmpdir, 'out.cif')
+                stream_out = os.path.join(tmpdir, 'stream.cif')
+                subprocess.check_call([sys.executable, MAKE_MMCIF,
+                                       twoblock, out])
+                subprocess.check_call([sys.executable, MAKE_MMCIF,
+                                       '--stream', twoblock, stream_out])
+                with open(out) as fh:
+                    expected = fh.read()
+                with open(stream_out) as fh:
+                    self.assertEqual(fh.read(), expected)
+                self.assertEqual(expected.count("_atom_site.id"), 2)
+
+    def test_keep_unknown(self):
+        """Check that make_mmcif can keep unknown categories"""
+        incif = utils.get_input_file_name(TOPDIR, 'not_modeled.cif')
+        with utils.temporary_directory() as tmpdir:
+            for args in ([], ['--stream']):
+                out = os.path.join(tmpdir, 'out.cif')
+                subprocess.check_call([sys.executable, MAKE_MMCIF, '-k']
+                                      + args + [incif, out])
+                with open(out) as fh:
+                    s, = modelcif.reader.read(fh, keep_unknown=True)
+                self.assertEqual([c.name for c in s.unknown_categories],
+                                 ['_exptl', '_modeller'])
+                self.assertEqual(s.unknown_categories[1].rows, [['9.24']])
+
 
 if __name__ == '__main__':
     unittest.main()
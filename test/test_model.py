@@ -4,6 +4,8 @@ import unittest
 
 TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 utils.set_search_paths(TOPDIR)
+import ihm
+import modelcif
 import modelcif.model
 
 
@@ -28,6 +30,84 @@ class Tests(unittest.TestCase):
         self.assertEqual(m.model_type, "Other")
         self.assertEqual(m.other_details, "foo")
 
+    def test_array_model(self):
+        """Test ArrayModel class"""
+        e1 = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e1, 'foo')
+        m = modelcif.model.ArrayModel([asym])
+        self.assertEqual(m.model_type, "Other")
+        self.assertIsNone(m.other_details)
+        self.assertEqual(m.num_atoms, 0)
+        m.add_atom(modelcif.model.Atom(
+            asym_unit=asym, seq_id=1, atom_id='CA', type_symbol='C',
+            x=1.0, y=2.0, z=3.0, het=True, biso=4.0, occupancy=0.5,
+            alt_id='B'))
+        m.add_atoms(asym, [2, 3], ['N', 'CA'], ['N', 'C'],
+                    [(4., 5., 6.), (7., 8., 9.)], biso=[10., 20.])
+        self.assertRaises(ValueError, m.add_atoms, asym, [1], [], [], [])
+        self.assertEqual(m.num_atoms, 3)
+        a1, a2, a3 = m.get_atoms()
+        self.assertIs(a1.asym_unit, asym)
+        self.assertEqual(a1.seq_id, 1)
+        self.assertEqual(a1.atom_id, 'CA')
+        self.assertEqual(a1.type_symbol, 'C')
+        self.assertAlmostEqual(a1.x, 1.0, delta=1e-6)
+        self.assertAlmostEqual(a1.z, 3.0, delta=1e-6)
+        self.assertTrue(a1.het)
+        self.assertAlmostEqual(a1.biso, 4.0, delta=1e-6)
+        self.assertAlmostEqual(a1.occupancy, 0.5, delta=1e-6)
+        self.assertEqual(a1.alt_id, 'B')
+        self.assertEqual(a2.seq_id, 2)
+        self.assertEqual(a2.atom_id, 'N')
+        self.assertFalse(a2.het)
+        self.assertAlmostEqual(a2.y, 5.0, delta=1e-6)
+        self.assertIsNone(a2.occupancy)
+        self.assertIsNone(a2.alt_id)
+        self.assertAlmostEqual(a3.biso, 20.0, delta=1e-6)
+        # Reused atoms should have the same contents, but be one object
+        reused = [(a, a.seq_id, a.atom_id) for a in m._get_reused_atoms()]
+        self.assertEqual([r[1:] for r in reused],
+                         [(1, 'CA'), (2, 'N'), (3, 'CA')])
+        self.assertIs(reused[0][0], reused[2][0])
+
+        # Custom subclasses get other_details as usual
+        class CustomModel(modelcif.model.ArrayModel):
+            """foo
+               bar"""
+        m = CustomModel([])
+        self.assertEqual(m.other_details, "foo")
+
+        class ArrayHomologyModel(modelcif.model.ArrayModel,
+                                 modelcif.model.HomologyModel):
+            pass
+        m = ArrayHomologyModel([])
+        self.assertEqual(m.model_type, "Homology model")
+        self.assertIsNone(m.other_details)
+
+    def test_compute_not_modeled_residue_ranges(self):
+        """Test Model.compute_not_modeled_residue_ranges()"""
+        e1 = modelcif.Entity('ACGTACGT')
+        e2 = modelcif.Entity('ACG')
+        heme = modelcif.Entity([ihm.NonPolymerChemComp('HEM')])
+        asym1 = modelcif.AsymUnit(e1)
+        asym2 = modelcif.AsymUnit(e2)
+        asym3 = modelcif.AsymUnit(e1)
+        asym4 = modelcif.AsymUnit(heme)
+        assembly = modelcif.Assembly([asym1, asym2, asym3(2, 6), asym4])
+        for cls in modelcif.model.Model, modelcif.model.ArrayModel:
+            m = cls(assembly)
+            for asym, seq_id in ((asym1, 1), (asym1, 1), (asym1, 2),
+                                 (asym1, 5), (asym3, 1), (asym3, 4),
+                                 (asym4, None)):
+                m.add_atom(modelcif.model.Atom(
+                    asym_unit=asym, seq_id=seq_id, atom_id='CA',
+                    type_symbol='C', x=1.0, y=2.0, z=3.0))
+            r = [(x.asym_unit, x.seq_id_begin, x.seq_id_end)
+                 for x in m.compute_not_modeled_residue_ranges()]
+            self.assertEqual(r, [(asym1, 3, 4), (asym1, 6, 8),
+                                 (asym2, 1, 3),
+                                 (asym3, 2, 3), (asym3, 5, 6)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import os
+import math
 import unittest
 import utils
 
@@ -64,6 +65,32 @@ class Tests(unittest.TestCase):
         q = MyScore(asym.residue(2), 42)
         _ = repr(q)
 
+    def test_local_metric_table(self):
+        """Test LocalMetricTable"""
+        class MyScore(modelcif.qa_metric.Local, modelcif.qa_metric.Energy):
+            software = None
+
+        e1 = modelcif.Entity('ACGT')
+        asym1 = modelcif.AsymUnit(e1, 'foo')
+        asym2 = modelcif.AsymUnit(e1, 'bar')
+        t = modelcif.qa_metric.LocalMetricTable(MyScore)
+        self.assertEqual(len(t), 0)
+        t.add(asym1, 1, 10.)
+        t.add(asym2, 4, 20.)
+        t.add(asym1, 2, 30.)
+        self.assertEqual(len(t), 3)
+        self.assertIsNone(t.software)
+        _ = repr(t)
+        q1, q2, q3 = t
+        self.assertIsInstance(q1, MyScore)
+        self.assertIs(q1.residue.asym, asym1)
+        self.assertEqual(q1.residue.seq_id, 1)
+        self.assertAlmostEqual(q1.value, 10., delta=1e-6)
+        self.assertIs(q2.residue.asym, asym2)
+        self.assertEqual(q2.residue.seq_id, 4)
+        self.assertIs(q3.residue.asym, asym1)
+        self.assertAlmostEqual(q3.value, 30., delta=1e-6)
+
     def test_local_pairwise_metric(self):
         """Test LocalPairwise MetricMode"""
         class MyScore(modelcif.qa_metric.LocalPairwise,
@@ -75,6 +102,41 @@ class Tests(unittest.TestCase):
         q = MyScore(asym.residue(2), asym.residue(3), 42)
         _ = repr(q)
 
+    def test_pairwise_matrix(self):
+        """Test PairwiseMatrix"""
+        class MyScore(modelcif.qa_metric.LocalPairwise,
+                      modelcif.qa_metric.PAE):
+            software = None
+
+        e1 = modelcif.Entity('ACGT')
+        asym = modelcif.AsymUnit(e1, 'foo')
+        residues = [asym.residue(1), asym.residue(2)]
+        m = modelcif.qa_metric.PairwiseMatrix(MyScore, residues)
+        self.assertEqual(len(m), 0)
+        self.assertEqual(list(m), [])
+        self.assertEqual(m.index(asym.residue(2)), 1)
+        self.assertIsNone(m.index(asym.residue(3)))
+        m[0, 1] = 4.0
+        m[1, 0] = 8.0
+        self.assertEqual(len(m), 2)
+        # Overwriting or removing a score should update the count
+        m[1, 0] = 6.0
+        self.assertEqual(len(m), 2)
+        m[1, 0] = math.nan
+        self.assertEqual(len(m), 1)
+        m[1, 0] = 8.0
+        self.assertEqual(len(m), 2)
+        self.assertAlmostEqual(m[0, 1], 4.0, delta=1e-6)
+        self.assertIsNone(m.software)
+        _ = repr(m)
+        q1, q2 = m
+        self.assertIsInstance(q1, MyScore)
+        self.assertIs(q1.residue1, residues[0])
+        self.assertIs(q1.residue2, residues[1])
+        self.assertAlmostEqual(q1.value, 4.0, delta=1e-6)
+        self.assertIs(q2.residue1, residues[1])
+        self.assertAlmostEqual(q2.value, 8.0, delta=1e-6)
+
     def test_feature_metric(self):
         """Test Feature MetricMode"""
         class MyScore(modelcif.qa_metric.Feature, modelcif.qa_metric.Energy):
@@ -2,12 +2,17 @@ from datetime import date
 import unittest
 import utils
 import os
+import pathlib
 import datetime
-from io import StringIO
+import math
+import pickle
+import warnings
+from io import StringIO, BytesIO
 
 TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 utils.set_search_paths(TOPDIR)
 import modelcif.reader
+import modelcif.edit
 import modelcif.reference
 import ihm
 import ihm.reader
@@ -32,6 +37,11 @@ A 1 foo
 """
 
 
+def _get_entry_id(systems):
+    """Reduce function for read_many tests"""
+    return [s.id for s in systems]
+
+
 class Tests(unittest.TestCase):
 
     def test_old_file_read_default(self):
@@ -140,6 +150,32 @@ _ma_software_group.parameter_group_id
         self.assertEqual(m.get(34), '1')
         self.assertRaises(ValueError, m.get, 99)
 
+    def test_atom_id_map_overlap(self):
+        """Test _AtomIDMap with overlapping and non-sequential ranges"""
+        m = modelcif.reader._AtomIDMap()
+        for atom_id in (50, 60, 10, 20):
+            m.add(atom_id=str(atom_id), model_num='1')
+        for atom_id in (100, 15, 55):
+            m.add(atom_id=str(atom_id), model_num='2')
+        m.add(atom_id='200', model_num='3')
+        m.add(atom_id='300', model_num='3')
+        m.add(atom_id='5', model_num='4')
+        # Model 1 covers 10-60, model 2 15-100, model 3 200-300, model 4 5-5;
+        # where ranges overlap, the first-added model wins
+        self.assertEqual(m.get(5), '4')
+        self.assertEqual(m.get(10), '1')
+        self.assertEqual(m.get(15), '1')
+        self.assertEqual(m.get(60), '1')
+        self.assertEqual(m.get(61), '2')
+        self.assertEqual(m.get(100), '2')
+        self.assertEqual(m.get(250), '3')
+        self.assertRaises(ValueError, m.get, 4)
+        self.assertRaises(ValueError, m.get, 101)
+        self.assertRaises(ValueError, m.get, 301)
+        # Adding more atoms should update the index
+        m.add(atom_id='150', model_num='2')
+        self.assertEqual(m.get(120), '2')
+
     def test_enumeration_mapper(self):
         """Test EnumerationMapper class"""
         m = modelcif.reader._EnumerationMapper(
@@ -765,6 +801,199 @@ _ma_model_group_link.group_id
         self.assertEqual(m4.model_type, 'Other')
         self.assertEqual(m5.model_type, 'Other')
 
+    def test_model_list_handler_array_model(self):
+        """Test _ModelListHandler with ArrayModel class"""
+        cif = self._get_models_cif()
+        s, = modelcif.reader.read(StringIO(cif),
+                                  model_class=modelcif.model.ArrayModel)
+        mg1, mg2, mg3 = s.model_groups
+        m1, m2 = list(mg1)
+        m3, = list(mg2)
+        # Model types from the file should be kept
+        for m in m1, m2, m3:
+            self.assertIsInstance(m, modelcif.model.ArrayModel)
+        self.assertIsInstance(m1, modelcif.model.HomologyModel)
+        self.assertIsInstance(m2, modelcif.model.AbInitioModel)
+        self.assertEqual(m1.model_type, 'Homology model')
+        self.assertIsNone(m1.other_details)
+        self.assertEqual(m3.model_type, 'Other')
+        self.assertEqual(m3.other_details, 'Custom other model')
+        # Check that classes can be pickled
+        m3c = pickle.loads(pickle.dumps(m3))
+        self.assertEqual(m3c.other_details, 'Custom other model')
+        m4, m5 = list(mg3)
+        self.assertIsInstance(m4, modelcif.model.ArrayModel)
+        self.assertEqual(m4.num_atoms, 1)
+        a, = m4.get_atoms()
+        self.assertEqual(a.atom_id, 'CA')
+        self.assertEqual(a.seq_id, 1)
+        self.assertAlmostEqual(a.y, 2.0, delta=1e-6)
+
+    def test_atom_site_handler_array_model(self):
+        """Test AtomSiteHandler filling ArrayModels directly"""
+        def get_atoms(s):
+            return [[(a.asym_unit._id, a.seq_id, a.atom_id, a.type_symbol,
+                      a.x, a.y, a.z, a.het, a.biso, a.occupancy, a.alt_id)
+                     for a in m.get_atoms()]
+                    for g in s.model_groups for m in g]
+
+        def no_atoms(*args, **kwargs):
+            raise AssertionError("Atom object created")
+
+        for fname in ('mini.cif', 'mini_branched.cif'):
+            with open(utils.get_input_file_name(TOPDIR, fname)) as fh:
+                s, = modelcif.reader.read(fh)
+            old_atom = ihm.model.Atom
+            ihm.model.Atom = no_atoms
+            try:
+                with open(utils.get_input_file_name(TOPDIR, fname)) as fh:
+                    arr, = modelcif.reader.read(
+                        fh, model_class=modelcif.model.ArrayModel)
+            finally:
+                ihm.model.Atom = old_atom
+            self.assertEqual(get_atoms(arr), get_atoms(s))
+            self.assertEqual([a.auth_seq_id_map for a in arr.asym_units],
+                             [a.auth_seq_id_map for a in s.asym_units])
+
+    def test_read_include_exclude_categories(self):
+        """Test read with include_categories and exclude_categories"""
+        cif = self._get_models_cif()
+        s, = modelcif.reader.read(StringIO(cif),
+                                  exclude_categories=['_ATOM_SITE'])
+        # No atoms read, so no implicitly-created models
+        mg1, mg2 = s.model_groups
+        self.assertEqual([m._id for m in mg1], ['1', '2'])
+        self.assertEqual([len(m._atoms) for m in mg1], [0, 0])
+
+        s, = modelcif.reader.read(
+            StringIO(cif), include_categories=['_ma_model_list',
+                                               '_ma_model_group',
+                                               '_ma_model_group_link'])
+        self.assertEqual(len(s.model_groups), 2)
+
+        s, = modelcif.reader.read(StringIO(cif),
+                                  include_categories=['_software'])
+        self.assertEqual(s.model_groups, [])
+
+        # Options should not persist in a reused variant object
+        variant = modelcif.reader.ModelCIFVariant()
+        s, = modelcif.reader.read(StringIO(cif), variant=variant,
+                                  exclude_categories=['_atom_site'])
+        self.assertEqual(len(s.model_groups), 2)
+        s, = modelcif.reader.read(StringIO(cif), variant=variant,
+                                  include_categories=['_software'])
+        self.assertEqual(s.model_groups, [])
+        s, = modelcif.reader.read(StringIO(cif), variant=variant)
+        self.assertEqual(len(s.model_groups), 3)
+
+    def test_read_keep_unknown(self):
+        """Test read with keep_unknown"""
+        cif = """data_model
+_struct.title 'My title'
+_my_vendor.id 42
+_my_vendor.Note 'two words'
+#
+loop_
+_other_vendor.a
+_other_vendor.b
+1 .
+2 ?
+3
+;multi
+line
+;
+#
+data_second
+_entry.id second
+loop_
+_other_vendor.c
+x
+y
+"""
+        s1, s2 = modelcif.reader.read(StringIO(cif))
+        self.assertEqual(s1.unknown_categories, [])
+
+        class NonSeekable(StringIO):
+            def seekable(self):
+                return False
+
+        for fh in StringIO(cif), BytesIO(cif.encode('utf-8')), \
+                NonSeekable(cif):
+            s1, s2 = modelcif.reader.read(fh, keep_unknown=True)
+            self.assertEqual(s1.title, 'My title')
+            c1, c2 = s1.unknown_categories
+            self.assertEqual(c1.name, '_my_vendor')
+            self.assertEqual(c1.keywords, ['id', 'Note'])
+            self.assertEqual(c1.rows, [['42', 'two words']])
+            self.assertEqual(c2.name, '_other_vendor')
+            self.assertEqual(c2.keywords, ['a', 'b'])
+            self.assertEqual(c2.rows, [['1', None], ['2', ihm.unknown],
+                                       ['3', 'multi\nline']])
+            # _entry is regenerated by the dumper, so not kept
+            c3, = s2.unknown_categories
+            self.assertEqual(c3.name, '_other_vendor')
+            self.assertEqual(c3.keywords, ['c'])
+            self.assertEqual(c3.rows, [['x'], ['y']])
+
+        # Categories read by custom handlers are not unknown
+        class MyHandler(ihm.reader.Handler):
+            category = '_my_vendor'
+
+            def __call__(self, id):
+                pass
+
+        s1, s2 = modelcif.reader.read(StringIO(cif), keep_unknown=True,
+                                      handlers=[MyHandler])
+        self.assertEqual([c.name for c in s1.unknown_categories],
+                         ['_other_vendor'])
+
+    def test_read_keep_unknown_add_to_system(self):
+        """Test read with keep_unknown and add_to_system"""
+        cif = """data_a
+_vend.x 1
+_vend.y a
+_other.z 1
+data_b
+_vend.y b
+_vend.x 2
+_other.w 2
+"""
+        s = modelcif.System()
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            s1, s2 = modelcif.reader.read(StringIO(cif), keep_unknown=True,
+                                          add_to_system=s)
+        self.assertIs(s1, s)
+        self.assertIs(s2, s)
+        # _vend has the same keywords in each block, so can be merged
+        vend, other = s.unknown_categories
+        self.assertEqual(vend.keywords, ['x', 'y'])
+        self.assertEqual(vend.rows, [['1', 'a'], ['2', 'b']])
+        # _other has different keywords, so the second is dropped
+        self.assertEqual(other.keywords, ['z'])
+        self.assertEqual(other.rows, [['1']])
+        self.assertEqual(len(w), 1)
+        self.assertIn('_other has different keywords', str(w[0].message))
+        sio = StringIO()
+        modelcif.dumper.write(sio, [s])
+        self.assertIn("loop_\n_vend.x\n_vend.y\n1 a\n2 b\n",
+                      sio.getvalue())
+
+    def test_read_keep_unknown_round_trip(self):
+        """Test that unknown categories are not duplicated on output"""
+        fname = utils.get_input_file_name(TOPDIR, 'mini_branched.cif')
+        with open(fname) as fh:
+            s, = modelcif.reader.read(fh, keep_unknown=True)
+        # _pdbx_entity_branch is not read, but is written by the dumper
+        self.assertIn('_pdbx_entity_branch',
+                      [c.name for c in s.unknown_categories])
+        sio = StringIO()
+        modelcif.dumper.write(sio, [s])
+        categories = [r.name for r in modelcif.edit._scan(
+            sio.getvalue().encode('utf-8'))[1]]
+        self.assertEqual(len(categories), len(set(categories)))
+        self.assertIn('_pdbx_entity_branch', categories)
+
     def test_assembly_handler(self):
         """Test _AssemblyHandler and _AssemblyDetailsHandler"""
         cif = """
@@ -1141,6 +1370,73 @@ _ma_qa_metric_local.metric_value
         self.assertEqual(q1.residue.seq_id, 2)
         self.assertAlmostEqual(q1.value, 1.0, delta=1e-6)
 
+    def test_qa_metric_local_handler_compact(self):
+        """Test _QAMetricLocalHandler with compact_qa_metrics"""
+        cif = """
+loop_
+_ma_model_list.ordinal_id
+_ma_model_list.model_id
+_ma_model_list.model_group_id
+_ma_model_list.model_name
+_ma_model_list.model_group_name
+_ma_model_list.assembly_id
+_ma_model_list.data_id
+_ma_model_list.model_type
+_ma_model_list.model_type_other_details
+1 1 1 'Best scoring model' 'All models' 1 4 'Homology model' .
+#
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.description
+_ma_qa_metric.type
+_ma_qa_metric.mode
+_ma_qa_metric.type_other_details
+_ma_qa_metric.software_group_id
+1 'test local' 'some local score' 'normalized score' local . .
+2 'other local' 'other local score' zscore local . .
+#
+loop_
+_ma_qa_metric_local.ordinal_id
+_ma_qa_metric_local.model_id
+_ma_qa_metric_local.label_asym_id
+_ma_qa_metric_local.label_seq_id
+_ma_qa_metric_local.label_comp_id
+_ma_qa_metric_local.metric_id
+_ma_qa_metric_local.metric_value
+1 1 A 2 CYS 1 1.0
+2 1 A 3 GLY 1 2.0
+3 1 B 1 ALA 2 3.0
+"""
+        s, = modelcif.reader.read(StringIO(cif), compact_qa_metrics=True)
+        mg, = s.model_groups
+        m, = mg
+        t1, t2 = m.qa_metrics
+        self.assertIsInstance(t1, modelcif.qa_metric.LocalMetricTable)
+        self.assertEqual(len(t1), 2)
+        self.assertEqual(len(t2), 1)
+        self.assertIsNone(t1.software)
+        q1, q2 = t1
+        self.assertIsInstance(q1, modelcif.qa_metric.Local)
+        self.assertIsInstance(q1, modelcif.qa_metric.NormalizedScore)
+        self.assertEqual(q1.name, "test local")
+        self.assertEqual(q1.residue.asym._id, 'A')
+        self.assertEqual(q1.residue.seq_id, 2)
+        self.assertAlmostEqual(q1.value, 1.0, delta=1e-6)
+        self.assertEqual(q2.residue.seq_id, 3)
+        q3, = t2
+        self.assertIsInstance(q3, modelcif.qa_metric.ZScore)
+        self.assertEqual(q3.residue.asym._id, 'B')
+
+        # The option should not persist in a reused variant object
+        variant = modelcif.reader.ModelCIFVariant()
+        s, = modelcif.reader.read(StringIO(cif), variant=variant,
+                                  compact_qa_metrics=True)
+        self.assertIsInstance(s.model_groups[0][0].qa_metrics[0],
+                              modelcif.qa_metric.LocalMetricTable)
+        s, = modelcif.reader.read(StringIO(cif), variant=variant)
+        self.assertEqual(len(s.model_groups[0][0].qa_metrics), 3)
+
     def test_qa_metric_pairwise_handler(self):
         """Test _QAMetricPairwiseHandler"""
         cif = """
@@ -1178,11 +1474,12 @@ _ma_qa_metric_local_pairwise.label_comp_id_2
 _ma_qa_metric_local_pairwise.metric_id
 _ma_qa_metric_local_pairwise.metric_value
 1 1 A 2 CYS B 4 GLY 1 1.0
+2 1 B 4 GLY A 2 CYS 1 2.0
 """
         s, = modelcif.reader.read(StringIO(cif))
         mg, = s.model_groups
         m, = mg
-        q1, = m.qa_metrics
+        q1, q2 = m.qa_metrics
         self.assertIsInstance(q1, modelcif.qa_metric.LocalPairwise)
         self.assertIsInstance(q1, modelcif.qa_metric.NormalizedScore)
         self.assertEqual(q1.type, "normalized score")
@@ -1194,6 +1491,85 @@ _ma_qa_metric_local_pairwise.metric_value
         self.assertEqual(q1.residue2.asym._id, 'B')
         self.assertEqual(q1.residue2.seq_id, 4)
         self.assertAlmostEqual(q1.value, 1.0, delta=1e-6)
+        # Residue objects should be shared between metrics
+        self.assertIs(q2.residue1, q1.residue2)
+        self.assertIs(q2.residue2, q1.residue1)
+
+    def test_qa_metric_pairwise_handler_compact(self):
+        """Test _QAMetricPairwiseHandler with compact_qa_metrics"""
+        cif = """
+loop_
+_ma_model_list.ordinal_id
+_ma_model_list.model_id
+_ma_model_list.model_group_id
+_ma_model_list.model_name
+_ma_model_list.model_group_name
+_ma_model_list.assembly_id
+_ma_model_list.data_id
+_ma_model_list.model_type
+_ma_model_list.model_type_other_details
+1 1 1 'Best scoring model' 'All models' 1 4 'Homology model' .
+#
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.description
+_ma_qa_metric.type
+_ma_qa_metric.mode
+_ma_qa_metric.type_other_details
+_ma_qa_metric.software_group_id
+1 'test pair' 'some pair score' 'normalized score' local-pairwise . .
+#
+loop_
+_ma_qa_metric_local_pairwise.ordinal_id
+_ma_qa_metric_local_pairwise.model_id
+_ma_qa_metric_local_pairwise.label_asym_id_1
+_ma_qa_metric_local_pairwise.label_seq_id_1
+_ma_qa_metric_local_pairwise.label_comp_id_1
+_ma_qa_metric_local_pairwise.label_asym_id_2
+_ma_qa_metric_local_pairwise.label_seq_id_2
+_ma_qa_metric_local_pairwise.label_comp_id_2
+_ma_qa_metric_local_pairwise.metric_id
+_ma_qa_metric_local_pairwise.metric_value
+1 1 A 2 CYS A 2 CYS 1 1.0
+2 1 A 2 CYS B 4 GLY 1 2.0
+3 1 B 4 GLY A 2 CYS 1 3.0
+"""
+        s, = modelcif.reader.read(StringIO(cif), compact_qa_metrics=True)
+        mg, = s.model_groups
+        m, = mg
+        q, = m.qa_metrics
+        self.assertIsInstance(q, modelcif.qa_metric.PairwiseMatrix)
+        self.assertEqual(len(q), 3)
+        r1, r2 = q.residues
+        self.assertEqual(r1.asym._id, 'A')
+        self.assertEqual(r1.seq_id, 2)
+        self.assertEqual(r2.asym._id, 'B')
+        self.assertEqual(r2.seq_id, 4)
+        self.assertAlmostEqual(q[0, 1], 2.0, delta=1e-6)
+        self.assertAlmostEqual(q[1, 0], 3.0, delta=1e-6)
+        # No value for B4-B4
+        self.assertNotEqual(q[1, 1], q[1, 1])
+        q1, q2, q3 = q
+        self.assertIsInstance(q1, modelcif.qa_metric.LocalPairwise)
+        self.assertEqual(q1.name, "test pair")
+        self.assertIs(q2.residue1, r1)
+        self.assertIs(q2.residue2, r2)
+        self.assertAlmostEqual(q2.value, 2.0, delta=1e-6)
+
+        # Duplicate pairs cannot be stored in the matrix
+        dup = cif + "4 1 A 2 CYS B 4 GLY 1 5.0\n"
+        s, = modelcif.reader.read(StringIO(dup))
+        self.assertEqual(len(s.model_groups[0][0].qa_metrics), 4)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            s, = modelcif.reader.read(StringIO(dup), compact_qa_metrics=True)
+        self.assertEqual(len(w), 1)
+        self.assertIn('1 residue pair(s) have more than one',
+                      str(w[0].message))
+        q, = s.model_groups[0][0].qa_metrics
+        self.assertEqual(len(q), 3)
+        self.assertAlmostEqual(q[0, 1], 5.0, delta=1e-6)
 
     def test_qa_metric_feature_handler(self):
         """Test _QAMetricFeatureHandler"""
@@ -2116,6 +2492,222 @@ A 1 4 9A 48A ? .
         lnk1, = e.branch_links
         self.assertEqual(lnk1.atom_id1, 'CA')
 
+    def test_read_coordinates(self):
+        """Test read_coordinates function"""
+        cif = """
+data_model
+_entry.id foo
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.label_atom_id
+_atom_site.label_alt_id
+_atom_site.label_comp_id
+_atom_site.label_seq_id
+_atom_site.auth_seq_id
+_atom_site.pdbx_PDB_ins_code
+_atom_site.label_asym_id
+_atom_site.Cartn_x
+_atom_site.Cartn_y
+_atom_site.Cartn_z
+_atom_site.occupancy
+_atom_site.label_entity_id
+_atom_site.auth_asym_id
+_atom_site.B_iso_or_equiv
+_atom_site.pdbx_PDB_model_num
+ATOM 1 N N . ASP 1 1 ? A 1.000 2.000 3.000 . 1 A 10.0 1
+ATOM 2 C CA . ASP 1 1 ? A 4.000 5.000 6.000 . 1 A 20.0 1
+HETATM 3 ZN ZN . ZN . 1 ? B 7.000 8.000 9.000 . 2 B . 1
+ATOM 4 C CA . ASP 1 1 ? A 1.500 2.500 3.500 . 1 A 30.0 2
+data_second
+_entry.id bar
+"""
+        (c1, c2), b2 = modelcif.reader.read_coordinates(StringIO(cif))
+        self.assertEqual(b2, [])
+        self.assertEqual(c1.model_id, '1')
+        self.assertEqual(len(c1), 3)
+        self.assertEqual(c1.asym_ids, ['A', 'A', 'B'])
+        self.assertEqual(list(c1.seq_ids), [1, 1, -1])
+        self.assertEqual(c1.atom_ids, ['N', 'CA', 'ZN'])
+        self.assertEqual(c1.type_symbols, ['N', 'C', 'ZN'])
+        self.assertEqual(list(c1.xyz), [1., 2., 3., 4., 5., 6., 7., 8., 9.])
+        self.assertEqual(list(c1.biso[:2]), [10., 20.])
+        self.assertTrue(math.isnan(c1.biso[2]))
+        self.assertEqual(c2.model_id, '2')
+        self.assertEqual(c2.atom_ids, ['CA'])
+        self.assertEqual(list(c2.xyz), [1.5, 2.5, 3.5])
+
+    def test_pickle(self):
+        """Test pickling of systems read from a file"""
+        cif = """
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.description
+_ma_qa_metric.type
+_ma_qa_metric.mode
+_ma_qa_metric.type_other_details
+_ma_qa_metric.software_group_id
+1 score 'score description' other global 'my type' .
+2 pair 'pair description' 'new type' local-pairwise . .
+#
+_ma_qa_metric_global.ordinal_id 1
+_ma_qa_metric_global.model_id 1
+_ma_qa_metric_global.metric_id 1
+_ma_qa_metric_global.metric_value 42.0
+"""
+        s, = modelcif.reader.read(StringIO(cif))
+        s2 = pickle.loads(pickle.dumps(s))
+        m, = s2.model_groups[0]
+        score, = m.qa_metrics
+        self.assertEqual(score.name, 'score')
+        self.assertEqual(score.other_details, 'my type')
+        self.assertAlmostEqual(score.value, 42.0, delta=1e-6)
+        self.assertIsInstance(score, modelcif.qa_metric.Global)
+
+    def test_read_many(self):
+        """Test read_many function"""
+        with utils.temporary_directory() as tmpdir:
+            paths = []
+            for i in range(4):
+                fname = os.path.join(tmpdir, 'test%d.cif' % i)
+                with open(fname, 'w') as fh:
+                    fh.write("data_model\n_struct.entry_id entry%d\n" % i)
+                paths.append(fname)
+            # Read in this process
+            res = list(modelcif.reader.read_many(paths, processes=1))
+            self.assertEqual([r[0] for r in res], paths)
+            self.assertEqual([r[1][0].id for r in res],
+                             ['entry0', 'entry1', 'entry2', 'entry3'])
+            res = list(modelcif.reader.read_many(paths, processes=1,
+                                                 reduce=_get_entry_id))
+            self.assertEqual(res[0], (paths[0], ['entry0']))
+            res = list(modelcif.reader.read_many(paths, processes=2))
+            self.assertEqual([r[1][0].id for r in res],
+                             ['entry0', 'entry1', 'entry2', 'entry3'])
+            res = list(modelcif.reader.read_many(paths, processes=2,
+                                                 reduce=_get_entry_id))
+            self.assertEqual(res, [(p, ['entry%d' % i])
+                                   for i, p in enumerate(paths)])
+            res = list(modelcif.reader.read_many(paths, processes=2,
+                                                 reduce=_get_entry_id,
+                                                 ordered=False))
+            self.assertEqual(sorted(res), [(p, ['entry%d' % i])
+                                           for i, p in enumerate(paths)])
+
+    def test_read_many_errors(self):
+        """Test read_many function with unreadable files"""
+        with utils.temporary_directory() as tmpdir:
+            paths = []
+            for i in range(3):
+                fname = os.path.join(tmpdir, 'test%d.cif' % i)
+                with open(fname, 'w') as fh:
+                    fh.write("data_model\n_struct.entry_id entry%d\n" % i)
+                paths.append(pathlib.Path(fname))
+            paths.insert(1, os.path.join(tmpdir, 'missing.cif'))
+            for processes in (1, 2):
+                res = list(modelcif.reader.read_many(
+                    paths, processes=processes, reduce=_get_entry_id,
+                    errors='return'))
+                self.assertEqual([r[0] for r in res], paths)
+                self.assertIsInstance(res[1][1], FileNotFoundError)
+                self.assertEqual([res[0][1], res[2][1], res[3][1]],
+                                 [['entry0'], ['entry1'], ['entry2']])
+                self.assertRaises(
+                    FileNotFoundError, list,
+                    modelcif.reader.read_many(paths, processes=processes,
+                                              reduce=_get_entry_id))
+            self.assertRaises(ValueError, modelcif.reader.read_many, paths,
+                              errors='ignore')
+
+    def test_read_compressed(self):
+        """Test read of compressed files"""
+        import gzip
+        import bz2
+        import lzma
+        cif = b"data_model\n_struct.entry_id myentry\n"
+        for compress in (gzip.compress, bz2.compress, lzma.compress,
+                         lambda x: x):
+            s, = modelcif.reader.read(BytesIO(compress(cif)))
+            self.assertEqual(s.id, 'myentry')
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.cif.gz')
+            with open(fname, 'wb') as fh:
+                fh.write(gzip.compress(cif))
+            with open(fname, 'rb') as fh:
+                s, = modelcif.reader.read(fh)
+                # File handle should not be closed
+                self.assertFalse(fh.closed)
+            self.assertEqual(s.id, 'myentry')
+            (path, (s,)), = modelcif.reader.read_many([fname], processes=1)
+            self.assertEqual(s.id, 'myentry')
+
+    def test_read_profile(self):
+        """Test read with a ReadProfile"""
+        class MyHandler(ihm.reader.Handler):
+            category = '_foo'
+
+            def __call__(self, bar):
+                # Allocate, then free, a lot of memory
+                x = [0] * 100000
+                del x
+
+        cif = """data_model
+_struct.entry_id myentry
+loop_
+_foo.bar
+1
+2
+#
+"""
+        for trace_memory in (False, True):
+            profile = modelcif.reader.ReadProfile(trace_memory=trace_memory)
+            s, = modelcif.reader.read(StringIO(cif), handlers=[MyHandler],
+                                      profile=profile)
+            self.assertEqual(s.id, 'myentry')
+            h, = [h for h in profile.handlers if h.category == '_foo']
+            self.assertTrue(h.name.endswith('MyHandler'))
+            self.assertEqual(h.calls, 2)
+            h, = [h for h in profile.handlers if h.category == '_struct']
+            self.assertEqual(h.calls, 1)
+            self.assertGreaterEqual(h.total_time, h.call_time)
+            self.assertGreater(profile.total_time, 0.)
+            self.assertGreaterEqual(profile.tokenize_time, 0.)
+            if trace_memory:
+                self.assertIsInstance(h.memory, int)
+                self.assertIsInstance(h.peak_memory, int)
+                self.assertGreater(profile.peak_memory, 800000)
+                foo, = [h for h in profile.handlers if h.category == '_foo']
+                # Memory was freed, but should still show up in the peak
+                self.assertLess(foo.memory, 10000)
+                if modelcif.reader._reset_peak:
+                    self.assertGreater(foo.peak_memory, 800000)
+            else:
+                self.assertIsNone(h.memory)
+                self.assertIsNone(h.peak_memory)
+                self.assertIsNone(profile.peak_memory)
+            self.assertEqual(len(profile.slowest(3)), 3)
+            with self.assertLogs('modelcif.reader', level='INFO') as cm:
+                profile.log()
+            self.assertIn('_foo: 2 rows', "\n".join(cm.output))
+
+    def test_read_profile_no_reset_peak(self):
+        """Test ReadProfile without tracemalloc.reset_peak (Python 3.8)"""
+        cif = """data_model
+_struct.entry_id myentry
+"""
+        old_reset_peak = modelcif.reader._reset_peak
+        modelcif.reader._reset_peak = None
+        try:
+            profile = modelcif.reader.ReadProfile(trace_memory=True)
+            s, = modelcif.reader.read(StringIO(cif), profile=profile)
+        finally:
+            modelcif.reader._reset_peak = old_reset_peak
+        h, = [h for h in profile.handlers if h.category == '_struct']
+        self.assertIsInstance(h.peak_memory, int)
+        self.assertGreater(profile.peak_memory, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,234 @@
+import os
+import unittest
+import utils
+from io import StringIO, BytesIO
+
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+import modelcif.summary
+import modelcif.dumper
+import modelcif.model
+import modelcif.qa_metric
+import modelcif.reference
+
+
+CIF = """data_model
+_entry.id my_entry
+_struct.title 'My title'
+loop_
+_entity_poly.entity_id
+_entity_poly.type
+_entity_poly.pdbx_seq_one_letter_code_can
+1 polypeptide(L)
+;ACDEF
+GHIK
+;
+2 polypeptide(L) MW
+#
+loop_
+_ma_target_ref_db_details.target_entity_id
+_ma_target_ref_db_details.db_name
+_ma_target_ref_db_details.db_name_other_details
+_ma_target_ref_db_details.db_code
+_ma_target_ref_db_details.db_accession
+1 UNP . MED1_YEAST Q12321
+2 Other 'foo' X1 .
+#
+loop_
+_ma_model_list.ordinal_id
+_ma_model_list.model_type
+1 'Homology model'
+2 'Ab initio model'
+#
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.type
+_ma_qa_metric.mode
+1 pLDDT pLDDT global
+2 pTM pTM global
+#
+loop_
+_ma_qa_metric_global.ordinal_id
+_ma_qa_metric_global.model_id
+_ma_qa_metric_global.metric_id
+_ma_qa_metric_global.metric_value
+1 1 1 90.5
+2 1 2 0.8
+#
+_ma_entry_associated_files.id 1
+_ma_entry_associated_files.file_url https://example.com/qa.cif
+#
+_ma_qa_metric_local.ordinal_id 1
+#
+_struct.title 'should not be read'
+"""
+
+
+class Tests(unittest.TestCase):
+    def test_scan(self):
+        """Test scan function"""
+        s = modelcif.summary.scan(StringIO(CIF))
+        self.assertEqual(s.entry_id, 'my_entry')
+        self.assertEqual(s.title, 'My title')
+        self.assertEqual(s.sequences, {'1': 'ACDEFGHIK', '2': 'MW'})
+        r1, r2 = s.target_references
+        self.assertEqual(r1, ('1', 'UNP', 'MED1_YEAST', 'Q12321'))
+        self.assertIsNone(r2.db_accession)
+        self.assertEqual(s.uniprot_accessions, ['Q12321'])
+        self.assertEqual(s.num_models, 2)
+        self.assertEqual(s.model_types, ['Homology model', 'Ab initio model'])
+        q1, q2 = s.global_qa_metrics
+        self.assertEqual(q1.model_id, '1')
+        self.assertEqual(q1.name, 'pLDDT')
+        self.assertEqual(q1.type, 'pLDDT')
+        self.assertAlmostEqual(q1.value, 90.5, delta=1e-6)
+        self.assertEqual(q2.name, 'pTM')
+        self.assertEqual(s.associated_file_urls,
+                         ['https://example.com/qa.cif'])
+
+    def test_scan_incomplete(self):
+        """Test scan of file missing some categories"""
+        s = modelcif.summary.scan(StringIO(
+            "data_model\n_entry.id foo\n_exptl.method bar\n"
+            "_struct.title baz\n"))
+        self.assertEqual(s.entry_id, 'foo')
+        self.assertEqual(s.title, 'baz')
+        self.assertEqual(s.num_models, 0)
+        self.assertEqual(s.global_qa_metrics, [])
+
+    def test_scan_dumped(self):
+        """Test scan of a file written by modelcif.dumper"""
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PLDDT):
+            """My score"""
+            software = None
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """My local score"""
+            software = None
+
+        system = modelcif.System(id='test_id', title='Test title')
+        ref = modelcif.reference.UniProt(code='MED1_YEAST',
+                                         accession='Q12321', sequence='ACGT')
+        e = modelcif.Entity('ACGT', references=[ref])
+        system.entities.append(e)
+        asym = modelcif.AsymUnit(e)
+        system.asym_units.append(asym)
+        model = modelcif.model.HomologyModel(
+            assembly=modelcif.Assembly([asym]))
+        model.add_atom(modelcif.model.Atom(
+            asym_unit=asym, seq_id=1, atom_id='CA', type_symbol='C',
+            x=1.0, y=2.0, z=3.0))
+        model.qa_metrics.append(MyScore(42.0))
+        model.qa_metrics.extend(MyLocalScore(asym.residue(i), 10.)
+                                for i in range(1, 5))
+        system.model_groups.append(modelcif.model.ModelGroup([model]))
+
+        cif = StringIO()
+        modelcif.dumper.write(cif, [system])
+        bcif = BytesIO()
+        modelcif.dumper.write(bcif, [system], format='BCIF')
+        for fmt, inp in (('mmCIF', StringIO(cif.getvalue())),
+                         ('BCIF', BytesIO(bcif.getvalue()))):
+            s = modelcif.summary.scan(inp, format=fmt)
+            self.assertEqual(s.entry_id, 'test_id')
+            self.assertEqual(s.title, 'Test title')
+            self.assertEqual(s.sequences, {'1': 'ACGT'})
+            self.assertEqual(s.uniprot_accessions, ['Q12321'])
+            self.assertEqual(s.model_types, ['Homology model'])
+            q, = s.global_qa_metrics
+            self.assertEqual(q.name, 'MyScore')
+            self.assertAlmostEqual(q.value, 42.0, delta=1e-6)
+
+    def test_scan_stop_early(self):
+        """Test that scan does not read QA tables if optional
+           categories are missing"""
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PLDDT):
+            """My score"""
+            software = None
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """My local score"""
+            software = None
+
+        system = modelcif.System(id='test_id')
+        e = modelcif.Entity('ACGT' * 100)
+        system.entities.append(e)
+        asym = modelcif.AsymUnit(e)
+        system.asym_units.append(asym)
+        model = modelcif.model.AbInitioModel(
+            assembly=modelcif.Assembly([asym]))
+        model.add_atom(modelcif.model.Atom(
+            asym_unit=asym, seq_id=1, atom_id='CA', type_symbol='C',
+            x=1.0, y=2.0, z=3.0))
+        model.qa_metrics.append(MyScore(42.0))
+        model.qa_metrics.extend(MyLocalScore(asym.residue(i), 10.)
+                                for i in range(1, 401))
+        system.model_groups.append(modelcif.model.ModelGroup([model]))
+        cif = StringIO()
+        modelcif.dumper.write(cif, [system])
+        cif = cif.getvalue()
+        # No _ma_entry_associated_files or _ma_target_ref_db_details
+        self.assertNotIn('_ma_entry_associated_files', cif)
+
+        old_chunk_size = modelcif.summary._EarlyStopFile._chunk_size
+        modelcif.summary._EarlyStopFile._chunk_size = 64
+        try:
+            fh = StringIO(cif)
+            s = modelcif.summary.scan(fh)
+        finally:
+            modelcif.summary._EarlyStopFile._chunk_size = old_chunk_size
+        self.assertEqual(s.entry_id, 'test_id')
+        q, = s.global_qa_metrics
+        self.assertAlmostEqual(q.value, 42.0, delta=1e-6)
+        # Reading should have stopped at the start of the local scores
+        self.assertLess(fh.tell(),
+                        cif.index('_ma_qa_metric_local.ordinal_id') + 200)
+        self.assertGreater(len(cif) - fh.tell(), 4000)
+        # Optional categories were not seen, so we might have missed some
+        self.assertTrue(s.truncated)
+
+    def test_scan_late_global(self):
+        """Test scan of a file with global scores after local ones"""
+        class MyScore(modelcif.qa_metric.Global, modelcif.qa_metric.PLDDT):
+            """My score"""
+            software = None
+
+        class MyLocalScore(modelcif.qa_metric.Local,
+                           modelcif.qa_metric.PLDDT):
+            """My local score"""
+            software = None
+
+        system = modelcif.System(id='test_id')
+        e = modelcif.Entity('ACGT')
+        system.entities.append(e)
+        asym = modelcif.AsymUnit(e)
+        system.asym_units.append(asym)
+        model = modelcif.model.AbInitioModel(
+            assembly=modelcif.Assembly([asym]))
+        model.add_atom(modelcif.model.Atom(
+            asym_unit=asym, seq_id=1, atom_id='CA', type_symbol='C',
+            x=1.0, y=2.0, z=3.0))
+        model.qa_metrics.append(MyScore(42.0))
+        model.qa_metrics.extend(MyLocalScore(asym.residue(i), 10.)
+                                for i in range(1, 5))
+        system.model_groups.append(modelcif.model.ModelGroup([model]))
+        cif = StringIO()
+        modelcif.dumper.write(cif, [system])
+        cif = cif.getvalue()
+        # Move the global scores to the end of the file
+        start = cif.index('#\nloop_\n_ma_qa_metric_global.')
+        end = cif.index('#\n', start + 2)
+        cif = cif[:start] + cif[end:] + cif[start:end]
+        self.assertGreater(cif.index('_ma_qa_metric_global.'),
+                           cif.index('_ma_qa_metric_local.'))
+        s = modelcif.summary.scan(StringIO(cif))
+        q, = s.global_qa_metrics
+        self.assertAlmostEqual(q.value, 42.0, delta=1e-6)
+        self.assertFalse(s.truncated)
+
+
+if __name__ == '__main__':
+    unittest.main()